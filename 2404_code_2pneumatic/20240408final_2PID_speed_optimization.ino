@@ -18,6 +18,36 @@ double Kp_2 = 50.0, Ki_2 = 0.5, Kd_2 = 0.5;
 PID pid2(&input_2, &output_2, &setpoint_2, Kp_2, Ki_2, Kd_2, DIRECT);
 
 String receivedString = "";
+
+// Binary frames, the layout is described in pressure_protocol.py:
+// SYNC, version << 4 | opcode, sequence, channel, int16 value in hundredths, CRC-8 of bytes 1 to 5.
+// A batch frame has the entry count in place of the channel, then (channel, opcode, int16 value)
+// entries and the CRC-8 of everything after SYNC.
+// Once the host asked for the protocol, a telemetry frame laid out like a batch frame reports
+// setpoint, measured pressure and valve state of every channel each control cycle.
+const byte FRAME_SYNC = 0xA5;
+const byte PROTOCOL_VERSION = 1;
+const int FRAME_LENGTH = 7;
+const byte OP_HELLO = 0;
+const byte OP_SET_PRESSURE = 1;
+const byte OP_SET_VALVE = 2;
+const byte OP_BATCH = 3;
+const byte OP_ACK = 4;
+const byte OP_PRESSURE = 5;
+const byte OP_TELEMETRY = 6;
+const int MAX_BATCH = 16;
+const int BATCH_ENTRY_LENGTH = 4;
+const int MAX_FRAME_LENGTH = 5 + MAX_BATCH * BATCH_ENTRY_LENGTH;
+const int CHANNEL_COUNT = 2;
+byte frame[MAX_FRAME_LENGTH];
+int frameLength = 0;
+bool helloRequested = false;
+// Set by the first valid frame, from then on text commands are ignored: the payload of a
+// corrupted frame could otherwise be read as one
+bool framesReceived = false;
+bool telemetryEnabled = false; // Set by the HELLO request, text-only hosts get no frames
+byte telemetrySequence = 0;
+bool valveOpen_1 = false, valveOpen_2 = false;
 unsigned long lastReadTime = 0;
 unsigned long readInterval = 100; // Read every 100 milliseconds
 
@@ -67,6 +97,7 @@ void loop() {
       //Serial.print(", Output: ");
       //Serial.println(valveOutput_2);
     }
+    if (telemetryEnabled) sendTelemetry();
   }
 
   // Read and control System 2
@@ -90,26 +121,142 @@ void loop() {
   processSerialCommands();
 }
 
+byte crc8(const byte *data, int length) {
+  byte crc = 0;
+  for (int i = 0; i < length; i++) {
+    crc ^= data[i];
+    for (int bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void setPressure(int systemNumber, double pressure) {
+  if (pressure < 0 || pressure > 100) return;
+  if (systemNumber == 1) setpoint_1 = pressure;
+  else if (systemNumber == 2) setpoint_2 = pressure;
+}
+
+void setValve(int systemNumber, bool isOpen) {
+  if (systemNumber == 1) {
+    digitalWrite(solenoidPin_1, isOpen ? HIGH : LOW);
+    valveOpen_1 = isOpen;
+  } else if (systemNumber == 2) {
+    digitalWrite(solenoidPin_2, isOpen ? HIGH : LOW);
+    valveOpen_2 = isOpen;
+  }
+}
+
+void sendFrame(byte opcode, byte sequence, byte channel, int value) {
+  byte out[FRAME_LENGTH] = {FRAME_SYNC, (byte)((PROTOCOL_VERSION << 4) | opcode), sequence, channel,
+                            lowByte(value), highByte(value), 0};
+  out[FRAME_LENGTH - 1] = crc8(out + 1, FRAME_LENGTH - 2);
+  Serial.write(out, FRAME_LENGTH);
+}
+
+void putEntry(byte *fields, byte channel, byte opcode, double value) {
+  int scaled = (int)round(constrain(value, -300.0, 300.0) * 100);
+  fields[0] = channel;
+  fields[1] = opcode;
+  fields[2] = lowByte(scaled);
+  fields[3] = highByte(scaled);
+}
+
+// 29 bytes, 30 ms on the wire at 9600 baud, they fit the 64-byte TX buffer so the control loop does not wait
+void sendTelemetry() {
+  const int entries = CHANNEL_COUNT * 3;
+  byte out[5 + entries * BATCH_ENTRY_LENGTH] = {FRAME_SYNC, (byte)((PROTOCOL_VERSION << 4) | OP_TELEMETRY),
+                                                telemetrySequence++, entries};
+  putEntry(out + 4, 1, OP_SET_PRESSURE, setpoint_1);
+  putEntry(out + 8, 1, OP_PRESSURE, input_1);
+  putEntry(out + 12, 1, OP_SET_VALVE, valveOpen_1 ? 1 : 0);
+  putEntry(out + 16, 2, OP_SET_PRESSURE, setpoint_2);
+  putEntry(out + 20, 2, OP_PRESSURE, input_2);
+  putEntry(out + 24, 2, OP_SET_VALVE, valveOpen_2 ? 1 : 0);
+  out[sizeof(out) - 1] = crc8(out + 1, sizeof(out) - 2);
+  Serial.write(out, sizeof(out));
+}
+
+// Length of the frame being received, 0 if its batch size is invalid
+int expectedFrameLength() {
+  if (frameLength < 4 || (frame[1] & 0x0F) != OP_BATCH) return FRAME_LENGTH;
+  int count = frame[3];
+  return (count > 0 && count <= MAX_BATCH) ? 5 + count * BATCH_ENTRY_LENGTH : 0;
+}
+
+void applyEntry(byte opcode, byte channel, const byte *value) {
+  int16_t scaled = (int16_t)(value[0] | (value[1] << 8));
+  if (opcode == OP_SET_PRESSURE) setPressure(channel, scaled / 100.0);
+  else if (opcode == OP_SET_VALVE) setValve(channel, scaled != 0);
+}
+
+// Removes the first count bytes of the frame buffer and everything up to the next sync byte
+void dropFrameBytes(int count) {
+  while (count < frameLength && frame[count] != FRAME_SYNC) count++;
+  memmove(frame, frame + count, frameLength - count);
+  frameLength -= count;
+}
+
+void processFrame(int length) {
+  if (length == 0 || crc8(frame + 1, length - 2) != frame[length - 1] || (frame[1] >> 4) != PROTOCOL_VERSION) {
+    dropFrameBytes(1); // Corrupted, resynchronize on the next sync byte after its start
+    return;
+  }
+  byte opcode = frame[1] & 0x0F;
+  if (opcode == OP_BATCH) {
+    // Checked as a whole above, all entries take effect before the PIDs compute again
+    for (int entry = 0; entry < frame[3]; entry++) {
+      const byte *fields = frame + 4 + entry * BATCH_ENTRY_LENGTH;
+      applyEntry(fields[1], fields[0], fields + 2);
+    }
+  } else {
+    applyEntry(opcode, frame[3], frame + 4);
+  }
+  framesReceived = true;
+  sendFrame(OP_ACK, frame[2], 0, 0); // Tells the host the frame with this sequence number was applied
+  dropFrameBytes(length);
+}
+
 void processSerialCommands() {
   while (Serial.available() > 0) {
-    char receivedChar = Serial.read();
-    if (isdigit(receivedChar) || receivedChar == '-' || receivedChar == ',') {
+    byte receivedByte = Serial.read();
+    // A sync byte starts a binary frame, text never contains one
+    if (frameLength > 0 || receivedByte == FRAME_SYNC) {
+      if (frameLength == 0) receivedString = ""; // Drops an interrupted text line
+      frame[frameLength++] = receivedByte;
+      int length = expectedFrameLength();
+      // A resynchronized frame may already be complete
+      while (frameLength > 0 && (length == 0 || frameLength >= length)) {
+        processFrame(length);
+        length = expectedFrameLength();
+      }
+      continue;
+    }
+    char receivedChar = receivedByte;
+    if (receivedChar == '?') {
+      helloRequested = true;
+    } else if (isdigit(receivedChar) || receivedChar == '-' || receivedChar == ',') {
       receivedString += receivedChar;
     } else if (receivedChar == '\n') {
+      if (helloRequested || framesReceived) {
+        // The host asks which protocol we speak, text-only firmware ignores the request
+        if (helloRequested) {
+          sendFrame(OP_HELLO, 0, 0, CHANNEL_COUNT * 100);
+          telemetryEnabled = true;
+        }
+        helloRequested = false;
+        receivedString = "";
+        continue;
+      }
       int commaIndex = receivedString.indexOf(',');
       int systemNumber = receivedString.substring(0, commaIndex).toInt();
       int commandValue = receivedString.substring(commaIndex + 1).toInt();
 
       // Determine which system and command
-      if (systemNumber == 1) {
-        if (commandValue >= 0 && commandValue <= 100) setpoint_1 = commandValue;
-        else if (commandValue == -1) digitalWrite(solenoidPin_1, HIGH);
-        else if (commandValue == -2) digitalWrite(solenoidPin_1, LOW);
-      } else if (systemNumber == 2) {
-        if (commandValue >= 0 && commandValue <= 100) setpoint_2 = commandValue;
-        else if (commandValue == -1) digitalWrite(solenoidPin_2, HIGH);
-        else if (commandValue == -2) digitalWrite(solenoidPin_2, LOW);
-      }
+      if (commandValue >= 0 && commandValue <= 100) setPressure(systemNumber, commandValue);
+      else if (commandValue == -1) setValve(systemNumber, true);
+      else if (commandValue == -2) setValve(systemNumber, false);
       receivedString = ""; // Clear for next command
     }
   }
@@ -0,0 +1,301 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from gcode_io import split_compression_suffix
+from gcode_lexer import format_number
+from pressure_events import CHANNELS, RUNNING_GLOBAL, PressureSchedule, load_pressure_schedule, pressure_line, valve_line
+from toolpath_analysis import DEFAULT_FEED, load_toolpath, segment_points
+from toolpath_format import AXES, OPCODE_ARC_CW, OPCODE_LINEAR, OPCODE_RAPID, VERTICAL_AXES
+
+AXIS_NAMES = [axis.upper() for axis in AXES]
+# Toolpath feeds are G-code feeds in mm/min, AeroScript speeds are in mm/s
+FEED_TIME_BASE = 60.0
+# Largest deviation (mm) of a dropped point from a consolidated move, above the float32
+# resolution of toolpath positions
+COLLINEAR_TOLERANCE = 1e-4
+COORDINATE_DIGITS = 4
+INDENT = "\t"
+# Toolpath records prepared at once, bounds host memory for memory-mapped toolpaths
+CHUNK_SIZE = 65536
+_VERTICAL_COLUMNS = [AXES.index(axis) for axis in VERTICAL_AXES]
+# Axes positioned absolutely, the first absolute move names them all: an axis whose first
+# target equals PROGRAM_ORIGIN would otherwise stay wherever it was when the program started
+_PLANAR_COLUMNS = [column for column in range(len(AXES)) if column not in _VERTICAL_COLUMNS]
+# Position of all axes when the program starts, where ToolpathBuilder starts tracking a revised
+# program. The first record is a move from here, usually the incremental first layer change.
+PROGRAM_ORIGIN = (0.0,) * len(AXES)
+
+
+def aeroscript_path_for(source_path):
+    base = split_compression_suffix(str(source_path))[0]
+    for suffix in (".gcode", ".toolpath"):
+        if base.endswith(suffix):
+            return base[:-len(suffix)] + ".ascript"
+    return base + ".ascript"
+
+
+def consolidate_segments(toolpath, starts, ends, tolerance=COLLINEAR_TOLERANCE):
+    '''
+    Finds runs of collinear linear moves with the same feed, channel and layer that can be
+    sent as one MoveLinear. Pairs of segments are tested at once, runs whose combined chord
+    would deviate from a dropped point by more than tolerance (slow curves) are left as they are.
+    Returns:
+        run_start, an array giving for every segment the index of the first segment of its run.
+        Only the last segment of a run is emitted, with the run's start point.
+    '''
+    count = len(toolpath)
+    joins = np.zeros(count, dtype=bool)  # Segment k continues the run of segment k - 1
+    if count > 1:
+        opcode = toolpath['opcode']
+        d1 = ends[:-1] - starts[:-1]
+        d2 = ends[1:] - starts[1:]
+        chord = d1 + d2
+        chord_squared = np.einsum('ij,ij->i', chord, chord)
+        along = np.einsum('ij,ij->i', d1, chord)
+        deviation = np.einsum('ij,ij->i', d1, d1) - np.divide(along ** 2, chord_squared, out=np.zeros_like(along),
+                                                              where=chord_squared > 0)
+        joins[1:] = ((opcode[:-1] == OPCODE_LINEAR) & (opcode[1:] == OPCODE_LINEAR)
+                     & (toolpath['feed'][:-1] == toolpath['feed'][1:])
+                     & (toolpath['channel'][:-1] == toolpath['channel'][1:])
+                     & (toolpath['layer'][:-1] == toolpath['layer'][1:])
+                     & (np.einsum('ij,ij->i', d1, d2) > 0)
+                     & (deviation <= tolerance ** 2))
+    index = np.arange(count)
+    run_start = np.maximum.accumulate(np.where(joins, 0, index)) if count else index
+
+    # Check every interior point against the chord of its whole run
+    if joins.any():
+        chord = ends[_run_ends(run_start)[run_start]] - starts[run_start]
+        offset = ends - starts[run_start]
+        chord_squared = np.einsum('ij,ij->i', chord, chord)
+        along = np.einsum('ij,ij->i', offset, chord)
+        deviation = np.einsum('ij,ij->i', offset, offset) - np.divide(along ** 2, chord_squared,
+                                                                      out=np.zeros_like(along), where=chord_squared > 0)
+        bad_runs = np.unique(run_start[deviation > tolerance ** 2])
+        if len(bad_runs):
+            in_bad_run = np.isin(run_start, bad_runs)
+            run_start[in_bad_run] = index[in_bad_run]
+    return run_start
+
+
+def _run_ends(run_start):
+    '''
+    Returns, indexed by run start, the index of the last segment of the run.
+    '''
+    run_end = np.zeros(len(run_start), dtype=np.int64)
+    last = np.ones(len(run_start), dtype=bool)
+    last[:-1] = run_start[1:] != run_start[:-1]
+    run_end[run_start[last]] = np.flatnonzero(last)
+    return run_end
+
+
+def _values(values):
+    return ", ".join(format_number(value, COORDINATE_DIGITS) for value in values)
+
+
+def _distance(start, end):
+    # Differences of the rounded positions, so distances sum up to the rounded end exactly
+    return round(end, COORDINATE_DIGITS) - round(start, COORDINATE_DIGITS)
+
+
+def _motion_lines(opcode, start, end, moved, ij, speed, incremental=False):
+    '''
+    Returns the AeroScript statements for one (consolidated) segment from start to end, moved
+    being the columns that change. Targets are absolute positions, or distances from start
+    with incremental (the task is in incremental target mode).
+    '''
+    if not moved and opcode <= OPCODE_LINEAR:
+        return ()
+    if incremental:
+        end = [_distance(origin, position) for origin, position in zip(start, end)]
+    axes = ", ".join(AXIS_NAMES[column] for column in moved)
+    if opcode == OPCODE_RAPID:
+        return (f"MoveRapid([{axes}], [{_values(end[column] for column in moved)}])\n",)
+    feed = format_number(speed, 3)
+    if opcode == OPCODE_LINEAR:
+        return (f"MoveLinear([{axes}], [{_values(end[column] for column in moved)}], {feed})\n",)
+    command = "MoveCw" if opcode == OPCODE_ARC_CW else "MoveCcw"
+    # Full circles have no XY motion, the plane is still X and Y
+    return (f"{command}([X, Y], [{_values(end[:2])}], [{_values(ij)}], {feed})\n",)
+
+
+def _incremental_lines(start, end, moved, speed):
+    distances = _values(_distance(start[column], end[column]) for column in moved)
+    return ("SetupTaskTargetMode(TargetMode.Incremental)\n",
+            f"MoveLinear([{', '.join(AXIS_NAMES[column] for column in moved)}], [{distances}], "
+            f"{format_number(speed, 3)})\n",
+            "SetupTaskTargetMode(TargetMode.Absolute)\n")
+
+
+def _chunk_moves(chunk, starts, ends, consolidate, default_feed):
+    '''
+    Prepares the moves of one toolpath chunk with NumPy, so the caller's loop only formats.
+    Returns an iterator of (opcode, start, end, moved columns, vertical, ij, speed, channel, layer).
+    '''
+    count = len(chunk)
+    run_start = consolidate_segments(chunk, starts, ends) if consolidate else np.arange(count)
+    last = np.ones(count, dtype=bool)
+    last[:-1] = run_start[1:] != run_start[:-1]
+    emitted = np.flatnonzero(last)
+    first = run_start[emitted]
+
+    moved = np.round(ends[emitted] - starts[first], COORDINATE_DIGITS) != 0
+    vertical = moved[:, _VERTICAL_COLUMNS].any(axis=1)
+    opcode = chunk['opcode'][emitted]
+    if (vertical & (opcode > OPCODE_LINEAR)).any():
+        raise ValueError("Helical arcs (arcs moving a vertical axis) cannot be compiled")
+    feed = chunk['feed'][emitted].astype(np.float64)
+    speed = np.where(feed > 0, feed, default_feed) / FEED_TIME_BASE
+    ij = np.column_stack([chunk['i'][emitted], chunk['j'][emitted]]).astype(np.float64)
+    # The moved axes as a bit code, looked up in a table of column lists
+    axis_code = moved @ (1 << np.arange(len(AXES)))
+    column_table = {int(code): [column for column in range(len(AXES)) if code >> column & 1]
+                    for code in np.unique(axis_code)}
+    return zip(opcode.tolist(), starts[first].tolist(), ends[emitted].tolist(),
+               map(column_table.__getitem__, axis_code.tolist()), vertical.tolist(), ij.tolist(), speed.tolist(),
+               chunk['channel'][first].tolist(), chunk['layer'][first].tolist())
+
+
+def aeroscript_statements(source, pressure_schedule=None, consolidate=True, default_feed=DEFAULT_FEED, stats=None,
+                          chunk_size=CHUNK_SIZE, incremental=False):
+    '''
+    Yields the statements of the AeroScript program compiled from a toolpath, without the
+    program block, see compile_aeroscript(). The toolpath is processed in chunks of chunk_size
+    records, so host memory stays bounded for memory-mapped toolpaths of any size. Consolidated
+    runs end at chunk boundaries. The first record is a move from PROGRAM_ORIGIN, in absolute
+    target mode the first planar move names every planar axis.
+    '''
+    if pressure_schedule is None:
+        pressure_schedule = PressureSchedule()
+    elif isinstance(pressure_schedule, str):
+        pressure_schedule = load_pressure_schedule(pressure_schedule)
+    valve_events = pressure_schedule.valve_events
+    toolpath = load_toolpath(source)
+
+    pressures = {}
+    pressure_count = valve_count = move_count = 0
+
+    def layer_events(layer):
+        nonlocal pressure_count
+        for event_channel, pressure in sorted(pressure_schedule.layer_pressures.get(layer, {}).items()):
+            if pressures.get(event_channel) != pressure:
+                pressures[event_channel] = pressure
+                pressure_count += 1
+                yield pressure_line(event_channel, pressure)
+
+    yield "G75\n"  # Same origin and running flag as a revised program
+    yield f"$iglobal[{RUNNING_GLOBAL}] = 1\n"
+    if valve_events:
+        for event_channel in CHANNELS:
+            valve_count += 1
+            yield valve_line(event_channel, False)
+    yield from layer_events(0)
+    yield f"SetupTaskTargetMode(TargetMode.{'Incremental' if incremental else 'Absolute'})\n"
+    yield "VelocityBlendingOn()\n"
+
+    current_layer = 0
+    open_channel = 0
+    planar_positioned = incremental
+    previous_end = PROGRAM_ORIGIN
+    for begin in range(0, len(toolpath), chunk_size):
+        chunk = np.asarray(toolpath[begin:begin + chunk_size])
+        starts, ends = segment_points(chunk, previous_end)
+        previous_end = ends[-1].copy()
+        for opcode, start, end, moved, vertical, ij, speed, channel, layer in _chunk_moves(
+                chunk, starts, ends, consolidate, default_feed):
+            while current_layer < layer:
+                current_layer += 1
+                yield from layer_events(current_layer)
+            if valve_events and channel != open_channel:
+                if open_channel:
+                    valve_count += 1
+                    yield valve_line(open_channel, False)
+                if channel:
+                    if channel not in CHANNELS:
+                        raise ValueError(f"Channel {channel} of the toolpath, valve events need one of {CHANNELS}")
+                    valve_count += 1
+                    yield valve_line(channel, True)
+                open_channel = channel
+            if vertical and not incremental:
+                motion = _incremental_lines(start, end, moved, speed)
+            elif not planar_positioned:
+                planar_positioned = True
+                moved = sorted(set(moved).union(_PLANAR_COLUMNS))
+                motion = _motion_lines(opcode, start, end, moved, ij, speed)
+            else:
+                motion = _motion_lines(opcode, start, end, moved, ij, speed, incremental)
+            move_count += bool(motion)
+            yield from motion
+    if valve_events and open_channel:
+        valve_count += 1
+        yield valve_line(open_channel, False)
+    yield "VelocityBlendingOff()\n"
+    yield f"$iglobal[{RUNNING_GLOBAL}] = 0\n"
+
+    if stats is not None:
+        stats.update(segments=len(toolpath), moves=move_count, pressure_events=pressure_count,
+                     valve_events=valve_count)
+
+
+def compile_aeroscript(source, output_path=None, pressure_schedule=None, consolidate=True,
+                       default_feed=DEFAULT_FEED, stats=None, incremental=False):
+    '''
+    Compiles a toolpath into an AeroScript program with velocity blending on, so the controller
+    plans continuous motion instead of interpreting G-code line by line.
+    Moves of a vertical axis are incremental, like the layer changes of a revised program, the
+    others absolute. With incremental every move is, so the program runs relative to wherever
+    the axes are when it starts. Collinear linear moves are consolidated into one multi-axis
+    MoveLinear, valve events follow the deposition channel of the toolpath and the schedule's
+    pressures are written at the start of their layers, both as the globals the host listener
+    watches (see pressure_events.py).
+    Args:
+        source: A .toolpath file, a revised .gcode file or a toolpath array.
+        output_path: The .ascript file, defaults to the source path with an .ascript suffix.
+        pressure_schedule: A PressureSchedule or the path of a "layer,channel,pressure" CSV file,
+            None writes valve events only.
+        consolidate: Merge collinear moves, see consolidate_segments().
+        default_feed: Feed in mm/min for moves issued before any F word.
+        stats: Optional dict, receives "segments", "moves", "pressure_events" and "valve_events".
+        incremental: Compile every move as a distance in incremental target mode.
+    Returns:
+        The path of the AeroScript program.
+    '''
+    if output_path is None:
+        if isinstance(source, np.ndarray):
+            raise ValueError("An output path is needed to compile a toolpath array")
+        output_path = aeroscript_path_for(source)
+    name = "a toolpath" if isinstance(source, np.ndarray) else os.path.basename(str(source))
+    with open(output_path, 'w', buffering=1024 * 1024) as file:
+        file.write(f"// Compiled from {name} by aeroscript_compiler.py\n")
+        file.write("program\n")
+        file.writelines(INDENT + statement for statement in
+                        aeroscript_statements(source, pressure_schedule, consolidate, default_feed, stats,
+                                              incremental=incremental))
+        file.write("end\n")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a revised job into an AeroScript program with velocity blending.")
+    parser.add_argument("source", help="revised .gcode file or .toolpath file")
+    parser.add_argument("-o", "--output", help="AeroScript path (default: <name>.ascript)")
+    parser.add_argument("--pressure-events", metavar="SCHEDULE",
+                        help="also write the pressures of a layer,channel,pressure CSV file")
+    parser.add_argument("--no-consolidate", action="store_true", help="keep every move, even collinear ones")
+    parser.add_argument("--incremental", action="store_true",
+                        help="run relative to the start position, every move as a distance")
+    args = parser.parse_args()
+    start_time = time.perf_counter()
+    stats = {}
+    output_path = compile_aeroscript(args.source, args.output, args.pressure_events, not args.no_consolidate,
+                                     stats=stats, incremental=args.incremental)
+    print(f"Compiled {stats['segments']} segments into {stats['moves']} moves, {stats['pressure_events']} pressure "
+          f"and {stats['valve_events']} valve events in {time.perf_counter() - start_time:.3f} s")
+    print(f"AeroScript program saved to: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import numpy as np
+
+from gcode_lexer import format_number
+from path_simplify import iter_move_runs
+
+# Fewest chords worth replacing with one arc
+MIN_ARC_SEGMENTS = 3
+# Circles larger than this are straight lines for our purposes
+MAX_ARC_RADIUS = 1000.0
+# Smallest turn (rad) between consecutive chords that still counts as curved
+MIN_TURN_ANGLE = 1e-4
+
+
+def _circle_through(p1, p2, p3):
+    '''
+    Returns (center, radius) of the circle through three points, or None if they are collinear.
+    '''
+    ax, ay = p1
+    bx, by = p2
+    cx, cy = p3
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    if abs(d) < 1e-12:
+        return None
+    a2 = ax * ax + ay * ay
+    b2 = bx * bx + by * by
+    c2 = cx * cx + cy * cy
+    ux = (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d
+    uy = (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d
+    center = np.array([ux, uy])
+    return center, float(np.hypot(ax - ux, ay - uy))
+
+
+def fit_arc(points, tolerance):
+    '''
+    Checks whether a polyline can be replaced by one arc through its end points.
+    Every vertex must lie within tolerance of the circle, every chord's sagitta must be
+    within tolerance and the polyline must turn monotonically by less than a full circle.
+    All checks are vectorized over the points.
+    Returns:
+        (center, clockwise) or None.
+    '''
+    fit = _circle_through(points[0], points[len(points) // 2], points[-1])
+    if fit is None:
+        return None
+    center, radius = fit
+    if radius > MAX_ARC_RADIUS:
+        return None
+
+    offsets = points - center
+    radial = np.hypot(offsets[:, 0], offsets[:, 1])
+    if np.abs(radial - radius).max() > tolerance:
+        return None
+    chords = np.hypot(*np.diff(points, axis=0).T)
+    half_chords = np.minimum(chords / 2, radius)
+    if (radius - np.sqrt(radius * radius - half_chords * half_chords)).max() > tolerance:
+        return None
+
+    angles = np.unwrap(np.arctan2(offsets[:, 1], offsets[:, 0]))
+    steps = np.diff(angles)
+    if not ((steps > 0).all() or (steps < 0).all()):
+        return None
+    if abs(angles[-1] - angles[0]) >= 2 * np.pi:
+        return None
+    return center, bool(steps[0] < 0)
+
+
+def _turns(points):
+    '''
+    Signed turn between consecutive chords at every interior vertex, vectorized.
+    '''
+    chords = np.diff(points, axis=0)
+    cross = chords[:-1, 0] * chords[1:, 1] - chords[:-1, 1] * chords[1:, 0]
+    dot = np.einsum('ij,ij->i', chords[:-1], chords[1:])
+    return np.arctan2(cross, dot)
+
+
+def _arc_line(run_line, end, start, center, clockwise):
+    command = "G2" if clockwise else "G3"
+    i, j = center - start
+    words = [command, "X" + format_number(end[0], 4), "Y" + format_number(end[1], 4),
+             "I" + format_number(i, 4), "J" + format_number(j, 4)]
+    # Keep the extrusion word of the last replaced move so extrusion on/off is still known
+    e_words = [word for word in run_line.split() if word[0] == "E"]
+    return " ".join(words + e_words[-1:]) + "\n"
+
+
+def fit_arcs_in_run(points, tolerance):
+    '''
+    Greedily covers a polyline with arcs. The span of each arc is grown exponentially and then
+    refined by bisection, so each arc costs O(log n) vectorized fits.
+    Args:
+        points: (n + 1, 2) array, the run's start point followed by the end point of each move.
+        tolerance: Largest allowed deviation in mm.
+    Returns:
+        A list of (first, last, center, clockwise) arcs over point indices; the moves ending at
+        points first + 1 .. last are replaced by the arc.
+    '''
+    last_index = len(points) - 1
+    turns = _turns(points)
+    curved = np.abs(turns) > MIN_TURN_ANGLE
+    arcs = []
+    first = 0
+    while first + MIN_ARC_SEGMENTS <= last_index:
+        # The chords right after the start must turn the same way, otherwise skip ahead cheaply
+        window = turns[first:first + MIN_ARC_SEGMENTS - 1]
+        if not (curved[first:first + MIN_ARC_SEGMENTS - 1].all() and
+                ((window > 0).all() or (window < 0).all())):
+            first += 1
+            continue
+        last = first + MIN_ARC_SEGMENTS
+        best = fit_arc(points[first:last + 1], tolerance)
+        if best is None:
+            first += 1
+            continue
+        step = 1
+        upper = last_index + 1
+        while last + step <= last_index:
+            fit = fit_arc(points[first:last + step + 1], tolerance)
+            if fit is None:
+                upper = last + step
+                break
+            last, best = last + step, fit
+            step *= 2
+        while upper - last > 1:
+            middle = (last + upper) // 2
+            fit = fit_arc(points[first:middle + 1], tolerance)
+            if fit is None:
+                upper = middle
+            else:
+                last, best = middle, fit
+        arcs.append((first, last, best[0], best[1]))
+        first = last
+    return arcs
+
+
+def fit_arcs_gcode_lines(lines, tolerance=0.01, stats=None):
+    '''
+    Replaces runs of short G1 chords with G2/G3 arcs (I/J centre offsets, XY plane).
+    Only plain XY moves are considered, so arcs never cross extrusion on/off, feed or layer changes.
+    Args:
+        lines: Iterable of filtered slicer lines (before the E words are removed).
+        tolerance: Largest allowed deviation from the original path in mm.
+        stats: Optional dict, "arc_segments_in" / "arc_segments_out" count the moves in runs
+            and "arcs" the arcs written.
+    '''
+    segments_in = segments_out = arc_count = 0
+    for start, run in iter_move_runs(lines):
+        if start is None:
+            yield from run
+            continue
+        segments_in += len(run)
+        points = np.array([start] + [(x, y) for _, x, y in run])
+        index = 0
+        for first, last, center, clockwise in fit_arcs_in_run(points, tolerance):
+            for line, _, _ in run[index:first]:
+                yield line
+            yield _arc_line(run[last - 1][0], points[last], points[first], center, clockwise)
+            segments_out += first - index + 1
+            arc_count += 1
+            index = last
+        for line, _, _ in run[index:]:
+            yield line
+        segments_out += len(run) - index
+
+    if stats is not None:
+        stats["arc_segments_in"] = stats.get("arc_segments_in", 0) + segments_in
+        stats["arc_segments_out"] = stats.get("arc_segments_out", 0) + segments_out
+        stats["arcs"] = stats.get("arcs", 0) + arc_count
@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import collections
+import time
+
+from pressure_protocol import (MAX_BATCH, OP_ACK, OP_SET_PRESSURE, OP_SET_VALVE, FrameDecoder, check_command,
+                               encode_batch, encode_frame, request_hello)
+
+# Frames sent and not yet acknowledged. Sequence numbers wrap at 256, the window keeps them unique
+WINDOW = 8
+# Seconds without an ACK before a frame is sent again: a frame and its ACK take about 15 ms at
+# 9600 baud, the firmware reads the port between two PID updates
+ACK_TIMEOUT = 0.25
+# Sends of a frame after the first before its command fails
+MAX_RETRIES = 3
+# pySerial read timeout of the reader, bounds how long close() waits for it
+READ_TIMEOUT = 0.05
+
+CommandResult = collections.namedtuple("CommandResult", ["sequence", "attempts", "latency", "round_trip",
+                                                         "superseded"])
+CommandResult.__doc__ = '''
+Outcome of a command: the sequence number of the acknowledged frame, the number of sends, the
+seconds from submitting to the ACK (latency) and from the last send to the ACK (round_trip).
+superseded is True when newer commands replaced every entry before a retry, nothing was resent.
+'''
+
+
+class _InFlight:
+    __slots__ = ("entries", "future", "submitted", "sent", "attempts", "sequence")
+
+    def __init__(self, entries, future):
+        self.entries = entries
+        self.future = future
+        self.submitted = time.perf_counter()
+        self.sent = 0.0
+        self.attempts = 0
+        self.sequence = None
+
+
+class AsyncPressureLink:
+    '''
+    Reliable asyncio transport to a pressure box speaking the binary protocol. Up to window
+    frames are in flight, each tagged with its sequence number. A reader task matches the
+    box's ACKs to them, and a frame without an ACK after ack_timeout is sent again under a new
+    sequence number. A retry leaves out the entries a newer command changed since, so a late
+    retry never overwrites a newer setpoint. The box applies frames in arrival order and
+    setpoints are absolute, so a frame applied twice (its ACK was lost) does no harm.
+    Args:
+        port: An open pySerial port (or FakeArduino), its read timeout is set to READ_TIMEOUT.
+        window: Frames in flight, a command waits for a free slot.
+        ack_timeout: Seconds to wait for an ACK before sending again.
+        max_retries: Sends after the first before the command fails with TimeoutError.
+    '''
+
+    def __init__(self, port, window=WINDOW, ack_timeout=ACK_TIMEOUT, max_retries=MAX_RETRIES):
+        if not 0 < window <= 128:
+            raise ValueError("The window must hold 1 to 128 frames")
+        self.port = port
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+        self.stats = {"commands": 0, "frames": 0, "acks": 0, "retries": 0, "failures": 0, "superseded": 0,
+                      "bytes": 0, "latency_total": 0.0, "latency_max": 0.0}
+        self.decoder = FrameDecoder()
+        self._in_flight = {}  # Sequence number: _InFlight
+        self._latest = {}  # (opcode, channel): the newest command setting it
+        self._sequence = 0
+        self._slots = None
+        self._write_lock = None
+        self._tasks = []
+        self._closing = False  # No new commands
+        self._stopping = False  # The reader and retry tasks end
+
+    async def start(self, check_protocol=True):
+        '''
+        Starts the reader and retry tasks. With check_protocol the box is asked for its
+        protocol first, RuntimeError if it only understands text commands.
+        '''
+        loop = asyncio.get_running_loop()
+        if check_protocol and await loop.run_in_executor(None, request_hello, self.port) is None:
+            raise RuntimeError("The pressure box does not answer in the binary protocol")
+        self.port.timeout = READ_TIMEOUT
+        self._slots = asyncio.Semaphore(self.window)
+        self._write_lock = asyncio.Lock()
+        self._tasks = [asyncio.create_task(self._read_acks()), asyncio.create_task(self._retry_expired())]
+
+    async def set_pressure(self, channel, pressure):
+        return await self.set_channels(pressures={channel: pressure})
+
+    async def set_valve(self, channel, is_open):
+        return await self.set_channels(valves={channel: is_open})
+
+    async def set_channels(self, pressures=None, valves=None):
+        '''
+        Sets pressures ({channel: psi}) and valve states ({channel: is_open}) in one frame the
+        box applies at once. Returns a CommandResult when the box acknowledged it.
+        '''
+        entries = [(OP_SET_PRESSURE, channel, pressure) for channel, pressure in (pressures or {}).items()]
+        entries += [(OP_SET_VALVE, channel, bool(is_open)) for channel, is_open in (valves or {}).items()]
+        if not 0 < len(entries) <= MAX_BATCH:
+            raise ValueError(f"A command sets 1 to {MAX_BATCH} values")
+        for opcode, _, value in entries:
+            check_command(opcode, value)
+        if self._slots is None:
+            raise RuntimeError("Call start() before sending commands")
+        if self._closing:
+            raise RuntimeError("The link is closed")
+        await self._slots.acquire()
+        if self._closing:
+            self._slots.release()
+            raise RuntimeError("The link is closed")
+        command = _InFlight(entries, asyncio.get_running_loop().create_future())
+        self.stats["commands"] += 1
+        try:
+            for opcode, channel, _ in entries:
+                self._latest[(opcode, channel)] = command
+            await self._transmit(command)
+            return await command.future
+        finally:
+            self._slots.release()
+
+    async def _transmit(self, command):
+        sequence = self._sequence
+        self._sequence = (self._sequence + 1) & 0xFF
+        entries = command.entries
+        data = encode_frame(*entries[0], sequence) if len(entries) == 1 else encode_batch(entries, sequence)
+        command.sequence = sequence
+        command.attempts += 1
+        command.sent = 0.0  # Not expiring while it waits for the port
+        self._in_flight[sequence] = command
+        async with self._write_lock:
+            command.sent = time.perf_counter()
+            await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+        self.stats["frames"] += 1
+        self.stats["bytes"] += len(data)
+
+    def _write(self, data):
+        self.port.write(data)
+        self.port.flush()
+
+    def _read(self):
+        return self.port.read(self.port.in_waiting or 1)
+
+    async def _read_acks(self):
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            data = await loop.run_in_executor(None, self._read)
+            now = time.perf_counter()
+            for frame in self.decoder.feed(data):
+                if frame.opcode != OP_ACK:
+                    continue
+                command = self._in_flight.pop(frame.sequence, None)
+                if command is None or command.future.done():
+                    continue  # ACK of a frame sent again meanwhile, or noise
+                self.stats["acks"] += 1
+                latency = now - command.submitted
+                self.stats["latency_total"] += latency
+                self.stats["latency_max"] = max(self.stats["latency_max"], latency)
+                command.future.set_result(CommandResult(frame.sequence, command.attempts, latency,
+                                                        now - command.sent, False))
+
+    async def _retry_expired(self):
+        while not self._stopping:
+            await asyncio.sleep(self.ack_timeout / 4)
+            now = time.perf_counter()
+            expired = [command for command in self._in_flight.values()
+                       if command.sent and now - command.sent > self.ack_timeout]
+            for command in expired:
+                if self._in_flight.get(command.sequence) is not command:
+                    continue  # Acknowledged while an earlier one was sent again
+                del self._in_flight[command.sequence]
+                if command.attempts > self.max_retries:
+                    self.stats["failures"] += 1
+                    command.future.set_exception(TimeoutError(
+                        f"No ACK from the pressure box after {command.attempts} sends"))
+                    continue
+                command.entries = [entry for entry in command.entries if self._latest.get(entry[:2]) is command]
+                if not command.entries:
+                    self.stats["superseded"] += 1
+                    command.future.set_result(CommandResult(command.sequence, command.attempts,
+                                                            now - command.submitted, None, True))
+                    continue
+                self.stats["retries"] += 1
+                await self._transmit(command)
+
+    async def close(self):
+        '''
+        Refuses new commands and waits for the commands in flight, the reader and retry tasks
+        keep running meanwhile. Commands still unacknowledged when every retry of them would
+        have timed out fail with TimeoutError. Then stops the tasks and closes the port.
+        '''
+        self._closing = True
+        pending = [command.future for command in self._in_flight.values()]
+        if pending:
+            # Every send of a frame may wait for the other frames in the window to be written
+            await asyncio.wait(pending, timeout=(self.ack_timeout + READ_TIMEOUT) * (self.max_retries + 2))
+        for command in list(self._in_flight.values()):
+            if not command.future.done():
+                self.stats["failures"] += 1
+                command.future.set_exception(TimeoutError("The link closed before the pressure box acknowledged"))
+        self._in_flight.clear()
+        # The tasks end by themselves within a read timeout, the port is not closed under a read
+        self._stopping = True
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.port.close()
+
+
+def print_link_stats(stats):
+    acks = stats['acks']
+    mean = 1000 * stats['latency_total'] / acks if acks else 0.0
+    print(f"{stats['commands']} commands in {stats['frames']} frames ({stats['bytes']} bytes), {acks} acknowledged, "
+          f"{stats['retries']} retries, {stats['superseded']} superseded, {stats['failures']} failed")
+    print(f"Latency mean {mean:.1f} ms, max {1000 * stats['latency_max']:.1f} ms")
+
+
+async def _exercise(link, commands, concurrency):
+    await link.start()
+    setpoints = asyncio.Queue()
+    for index in range(commands):
+        setpoints.put_nowait({1: 10 + index % 50, 2: 60 - index % 50})
+
+    async def sender():
+        while not setpoints.empty():
+            try:
+                await link.set_channels(pressures=setpoints.get_nowait())
+            except TimeoutError as error:
+                print(error)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(sender() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start_time
+    await link.close()
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send setpoints over the acknowledged binary protocol.")
+    parser.add_argument("--commands", type=int, default=200, help="two-channel setpoint commands to send")
+    parser.add_argument("--concurrency", type=int, default=WINDOW, help="callers sending at the same time")
+    parser.add_argument("--window", type=int, default=WINDOW, help="frames in flight")
+    parser.add_argument("--port", help="serial port of the pressure box (default: offline fake box)")
+    parser.add_argument("--baud-rate", type=int, default=9600, help="baud rate")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="bit error rate per byte of the fake box")
+    args = parser.parse_args()
+    if args.port:
+        import serial
+
+        port = serial.Serial(args.port, args.baud_rate)
+        time.sleep(2)  # Allow time for Arduino to initialize
+    else:
+        from fake_arduino import FakeArduino
+
+        port = FakeArduino(args.baud_rate, error_rate=args.error_rate, seed=1)
+    link = AsyncPressureLink(port, args.window)
+    seconds = asyncio.run(_exercise(link, args.commands, args.concurrency))
+    print(f"{args.commands} commands completed in {seconds:.2f} s")
+    print_link_stats(link.stats)
+
+
+if __name__ == "__main__":
+    main()
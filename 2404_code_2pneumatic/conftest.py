@@ -0,0 +1,14 @@
+import pytest
+
+from gcode_benchmark import generate_slicer_file
+
+# Lines of the synthetic slicer file shared by the tests, about five layers
+SLICER_LINES = 5000
+
+
+@pytest.fixture(scope="session")
+def slicer_file(tmp_path_factory):
+    '''
+    A synthetic slicer file (see gcode_benchmark.generate_slicer_file()), generated once per session.
+    '''
+    return generate_slicer_file(str(tmp_path_factory.mktemp("slicer") / "part.gcode"), SLICER_LINES)
@@ -0,0 +1,171 @@
+import math
+import random
+import threading
+import time
+
+from pressure_protocol import (FRAME_SYNC, OP_ACK, OP_BATCH, OP_HELLO, OP_PRESSURE, OP_SET_PRESSURE, OP_SET_VALVE,
+                               OP_TELEMETRY, PROTOCOL_VERSION, FrameDecoder, encode_batch, encode_frame)
+
+BAUD_RATE = 9600
+# Bits on the wire per byte: start bit, 8 data bits, stop bit
+BITS_PER_BYTE = 10
+CHANNELS = (1, 2)
+# Seconds between telemetry frames, the firmware's PID interval
+TELEMETRY_INTERVAL = 0.1
+# Time constant in seconds of the modelled regulator following its setpoint, and the sensor noise in psi
+PRESSURE_TIME_CONSTANT = 0.3
+PRESSURE_NOISE = 0.05
+
+
+class FakeArduino:
+    '''
+    Offline stand-in for the serial port of the pressure box, with the pySerial calls the host
+    scripts use (write, flush, read, readline, in_waiting, close). Writes take as long as the
+    bytes need on the wire at baud_rate, and the text commands "channel,value\\n" are applied
+    like the firmware does: 0 to 100 sets the PID setpoint, -1 opens and -2 closes the valve.
+    With a protocol_version the box also takes binary frames, acknowledges them and answers the
+    HELLO request (see pressure_protocol.py), None imitates the text-only firmware.
+    After the HELLO request it sends a TELEMETRY frame every telemetry_interval seconds, the
+    measured pressure following the setpoint with a first-order lag.
+    error_rate is the probability of a bit error per byte in either direction, timeout the
+    pySerial read timeout.
+    '''
+
+    def __init__(self, baud_rate=BAUD_RATE, channels=CHANNELS, protocol_version=PROTOCOL_VERSION, error_rate=0.0,
+                 timeout=None, seed=None, telemetry_interval=TELEMETRY_INTERVAL):
+        self.baud_rate = baud_rate
+        self.protocol_version = protocol_version
+        self.error_rate = error_rate
+        self.timeout = timeout
+        self._random = random.Random(seed)
+        self.setpoints = dict.fromkeys(channels, 0)
+        self.valves = dict.fromkeys(channels, False)
+        self.pressures = dict.fromkeys(channels, 0.0)
+        self.telemetry_interval = telemetry_interval
+        self._telemetry_thread = None
+        self.received = bytearray()
+        self.commands = []
+        self.is_open = True
+        self._line = bytearray()
+        self._hello_requested = False
+        self._frames_received = False
+        self._decoder = FrameDecoder()
+        self._output = bytearray()
+        self._output_ready = threading.Condition()
+
+    def write(self, data):
+        if not self.is_open:
+            raise OSError("Port not open")
+        time.sleep(len(data) * BITS_PER_BYTE / self.baud_rate)
+        data = self._corrupt(data)
+        self.received += data
+        for byte in data:
+            if self.protocol_version is not None and (self._decoder.buffer or byte == FRAME_SYNC):
+                self._line.clear()  # Drops an interrupted text line
+                for frame in self._decoder.feed(bytes((byte,))):
+                    self._frames_received = True  # Text commands are ignored from now on, like the firmware does
+                    self.commands.append(frame)
+                    # The entries of a batch are applied together, after its CRC was checked
+                    for entry in frame.value if frame.opcode == OP_BATCH else (frame,):
+                        self._apply_entry(entry)
+                    self.send(encode_frame(OP_ACK, 0, 0, frame.sequence))
+            elif byte == ord("\n"):
+                if self._hello_requested:
+                    self._hello_requested = False
+                    self.send(encode_frame(OP_HELLO, 0, len(self.setpoints)))
+                    self._start_telemetry()
+                elif not self._frames_received:
+                    self._apply(self._line.decode())
+                self._line.clear()
+            elif byte == ord("?") and self.protocol_version is not None:
+                self._hello_requested = True
+            elif chr(byte).isdigit() or byte in b"-,":
+                self._line.append(byte)  # The firmware ignores everything else
+        return len(data)
+
+    def _apply_entry(self, frame):
+        if frame.channel not in self.setpoints:
+            return
+        if frame.opcode == OP_SET_PRESSURE and 0 <= frame.value <= 100:
+            self.setpoints[frame.channel] = frame.value
+        elif frame.opcode == OP_SET_VALVE:
+            self.valves[frame.channel] = frame.value != 0
+
+    def _apply(self, line):
+        channel, _, value = line.partition(",")
+        if not channel.lstrip("-").isdigit() or not value.lstrip("-").isdigit():
+            return
+        channel, value = int(channel), int(value)
+        self.commands.append((channel, value))
+        if channel not in self.setpoints:
+            return
+        if 0 <= value <= 100:
+            self.setpoints[channel] = value
+        elif value in (-1, -2):
+            self.valves[channel] = value == -1
+
+    def _start_telemetry(self):
+        if self._telemetry_thread is None and self.telemetry_interval:
+            self._telemetry_thread = threading.Thread(target=self._send_telemetry, daemon=True)
+            self._telemetry_thread.start()
+
+    def _send_telemetry(self):
+        sequence = 0
+        last_time = time.perf_counter()
+        while self.is_open:
+            time.sleep(self.telemetry_interval)
+            now = time.perf_counter()
+            settled = 1 - math.exp(-(now - last_time) / PRESSURE_TIME_CONSTANT)
+            last_time = now
+            entries = []
+            for channel, setpoint in self.setpoints.items():
+                self.pressures[channel] += (setpoint - self.pressures[channel]) * settled
+                measured = max(0.0, self.pressures[channel] + self._random.gauss(0, PRESSURE_NOISE))
+                entries += [(OP_SET_PRESSURE, channel, setpoint), (OP_PRESSURE, channel, measured),
+                            (OP_SET_VALVE, channel, self.valves[channel])]
+            self.send(encode_batch(entries, sequence, OP_TELEMETRY))
+            sequence = (sequence + 1) & 0xFF
+
+    def _corrupt(self, data):
+        if not self.error_rate:
+            return data
+        data = bytearray(data)
+        for index in range(len(data)):
+            if self._random.random() < self.error_rate:
+                data[index] ^= 1 << self._random.randrange(8)
+        return bytes(data)
+
+    def send(self, data):
+        '''
+        Queues bytes the fake firmware sends to the host.
+        '''
+        with self._output_ready:
+            self._output += self._corrupt(data)
+            self._output_ready.notify_all()
+
+    def flush(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        return len(self._output)
+
+    def read(self, size=1):
+        with self._output_ready:
+            self._output_ready.wait_for(lambda: len(self._output) >= size or not self.is_open, self.timeout)
+            data = bytes(self._output[:size])
+            del self._output[:size]
+            return data
+
+    def readline(self):
+        with self._output_ready:
+            self._output_ready.wait_for(lambda: b"\n" in self._output or not self.is_open, self.timeout)
+            end = self._output.find(b"\n") + 1 or len(self._output)
+            data = bytes(self._output[:end])
+            del self._output[:end]
+            return data
+
+    def close(self):
+        with self._output_ready:
+            self.is_open = False
+            self._output_ready.notify_all()
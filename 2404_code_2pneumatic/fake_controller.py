@@ -0,0 +1,266 @@
+import collections
+import hashlib
+import re
+import time
+
+# Compile time the fake compiler spends per MB of source, roughly what large generated programs take
+COMPILE_SECONDS_PER_MB = 0.05
+# Rate at which a fake command queue executes commands, about the block rate of short moves
+COMMANDS_PER_SECOND = 2000.0
+_GLOBAL_WRITE_RE = re.compile(r"\$([ir])global\[(\d+)\] = (\S+)")
+FAKE_COMPILED_MAGIC = b"FAKEA1EXE\n"
+
+
+class _Program:
+    def __init__(self, task):
+        self._task = task
+
+    def run(self, program_path):
+        task = self._task
+        files = task.controller.files
+        if not files.does_file_exist(program_path):
+            raise FileNotFoundError(f"{program_path} is not on the controller file system")
+        task.runs.append(program_path)
+        task.program_path = program_path
+        task.status.task_state = "ProgramRunning"
+        if not program_path.endswith(".a1exe"):
+            task.controller.compile_source(files.read_bytes(program_path), program_path)  # Run compiles the source first
+
+    def stop(self):
+        self._task.status.task_state = "ProgramComplete"
+
+
+class _TaskStatus:
+    def __init__(self):
+        self.task_state = "Idle"
+        self.error_message = ""
+
+
+class _Task:
+    def __init__(self, controller):
+        self.controller = controller
+        self.program = _Program(self)
+        self.status = _TaskStatus()
+        self.program_path = None
+        self.runs = []
+
+
+class _Tasks:
+    def __init__(self, controller):
+        self._controller = controller
+        self._tasks = {}
+
+    def __getitem__(self, index):
+        if index not in self._tasks:
+            self._tasks[index] = _Task(self._controller)
+        return self._tasks[index]
+
+
+class _Files:
+    '''
+    The controller file system, kept in memory.
+    '''
+
+    def __init__(self):
+        self.contents = {}
+        self.uploads = []
+
+    def does_file_exist(self, controller_file_path):
+        return controller_file_path in self.contents
+
+    def read_bytes(self, controller_file_path):
+        if controller_file_path not in self.contents:
+            raise FileNotFoundError(f"{controller_file_path} is not on the controller file system")
+        return self.contents[controller_file_path]
+
+    def write_bytes(self, controller_file_path, data):
+        self.contents[controller_file_path] = bytes(data)
+
+    def copy_file_to_controller(self, local_file_path, controller_file_path):
+        with open(local_file_path, 'rb') as file:
+            self.write_bytes(controller_file_path, file.read())
+        self.uploads.append(controller_file_path)
+
+
+class _CommandQueueStatus:
+    def __init__(self, queue):
+        queue.update()
+        self.number_of_unexecuted_commands = len(queue.pending)
+        self.number_of_executed_commands = queue.executed
+        self.is_paused = queue.is_paused
+
+
+class _CommandQueueCommands:
+    def __init__(self, queue):
+        self._queue = queue
+
+    def execute(self, aeroscript_text):
+        self._queue.add(aeroscript_text)
+
+
+class _CommandQueue:
+    '''
+    Executes its commands at a fixed rate, computed from the elapsed time whenever it is used,
+    and applies global variable writes when they execute.
+    '''
+
+    def __init__(self, controller, task, capacity, should_block_if_full, commands_per_second):
+        self.controller = controller
+        self.task = task
+        self.capacity = capacity
+        self.should_block_if_full = should_block_if_full
+        self.commands_per_second = commands_per_second
+        self.commands = _CommandQueueCommands(self)
+        self.pending = collections.deque()
+        self.executed = 0
+        self.is_paused = False
+        self.is_ended = False
+        self._credit = 0.0
+        self._last_update = time.perf_counter()
+
+    def update(self):
+        now = time.perf_counter()
+        if not self.is_paused:
+            self._credit += (now - self._last_update) * self.commands_per_second
+        self._last_update = now
+        variables = self.controller.runtime.variables.global_
+        while self.pending and self._credit >= 1.0:
+            self._credit -= 1.0
+            self.executed += 1
+            match = _GLOBAL_WRITE_RE.match(self.pending.popleft())
+            if match:
+                kind, index, value = match.groups()
+                if kind == "i":
+                    variables.set_integer(int(index), int(value))
+                else:
+                    variables.set_real(int(index), float(value))
+        if not self.pending:
+            self._credit = min(self._credit, 1.0)  # An idle queue does not bank execution time
+
+    def add(self, aeroscript_text):
+        if self.is_ended:
+            raise RuntimeError("The command queue has ended")
+        self.update()
+        while len(self.pending) >= self.capacity:
+            if not self.should_block_if_full or self.is_paused:
+                raise RuntimeError("The command queue is full")
+            time.sleep(1.0 / self.commands_per_second)
+            self.update()
+        self.pending.append(aeroscript_text)
+
+    @property
+    def status(self):
+        return _CommandQueueStatus(self)
+
+    def pause(self):
+        self.update()
+        self.is_paused = True
+
+    def resume(self):
+        self.update()
+        self.is_paused = False
+
+    def wait_for_empty(self, timeout=None):
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            self.update()
+            if not self.pending:
+                return True
+            if self.is_paused or (deadline is not None and time.perf_counter() > deadline):
+                return False
+            time.sleep(min(0.01, len(self.pending) / self.commands_per_second))
+
+
+class _Commands:
+    def __init__(self, controller):
+        self._controller = controller
+
+    def begin_command_queue(self, task, command_capacity, should_block_if_queue_full=True):
+        queue = _CommandQueue(self._controller, task, command_capacity, should_block_if_queue_full,
+                              self._controller.commands_per_second)
+        task_status = self._controller.runtime.tasks[task].status
+        task_status.task_state = "QueueRunning"
+        self._controller.command_queues.append(queue)
+        return queue
+
+    def end_command_queue(self, queue):
+        queue.wait_for_empty()
+        queue.is_ended = True
+        self._controller.runtime.tasks[queue.task].status.task_state = "Idle"
+
+
+class _GlobalVariables:
+    def __init__(self):
+        self.integers = {}
+        self.reals = {}
+
+    def get_integer(self, index):
+        return self.integers.get(index, 0)
+
+    def set_integer(self, index, value):
+        self.integers[index] = int(value)
+
+    def get_real(self, index):
+        return self.reals.get(index, 0.0)
+
+    def set_real(self, index, value):
+        self.reals[index] = float(value)
+
+
+class _Variables:
+    def __init__(self):
+        self.global_ = _GlobalVariables()
+
+
+class _Runtime:
+    def __init__(self, controller):
+        self.tasks = _Tasks(controller)
+        self.variables = _Variables()
+        self.commands = _Commands(controller)
+
+
+class FakeController:
+    '''
+    Offline stand-in for the parts of an automation1 Controller the host scripts use: running
+    programs on tasks, task status, command queues, the global variables and the controller
+    file system (files), which program.run() reads programs from. compile_program() imitates
+    the compiler, so the program cache and the listeners can be exercised without hardware.
+    Programs do not execute, tests set the globals and task states themselves.
+    Command queues execute commands_per_second commands and apply the global writes among them.
+    '''
+
+    def __init__(self, compile_seconds_per_mb=COMPILE_SECONDS_PER_MB, commands_per_second=COMMANDS_PER_SECOND):
+        self.runtime = _Runtime(self)
+        self.files = _Files()
+        self.compile_seconds_per_mb = compile_seconds_per_mb
+        self.commands_per_second = commands_per_second
+        self.compiles = []
+        self.command_queues = []
+
+    def compile_program(self, source_path, output_path):
+        '''
+        Imitates the compiler: takes time in proportion to the source size and writes a small
+        artifact identifying the source. output_path None only compiles.
+        '''
+        with open(source_path, 'rb') as file:
+            compiled = self.compile_source(file.read(), source_path)
+        if output_path is not None:
+            with open(output_path, 'wb') as file:
+                file.write(compiled)
+
+    def compile_source(self, source, source_path):
+        '''
+        Returns the fake compiled program of AeroScript source bytes.
+        '''
+        self.compiles.append(source_path)
+        time.sleep(len(source) / 1024 ** 2 * self.compile_seconds_per_mb)
+        return FAKE_COMPILED_MAGIC + hashlib.blake2b(source, digest_size=20).hexdigest().encode()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def disconnect(self):
+        pass
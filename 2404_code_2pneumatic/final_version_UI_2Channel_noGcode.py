@@ -5,6 +5,12 @@ import threading
 import time
 import automation1 as a1
 import numpy as np
+from pressure_events import PressureEventListener
+from pressure_protocol import negotiate_encoder
+from pressure_telemetry import TelemetryReader, save_telemetry
+from program_cache import upload_program
+from raster_plan import compare_plan, compile_plan, print_comparison, serpentine_toolpath
+from serial_writer import SerialWriter, print_writer_stats
 
 global desired_pressure_1, desired_pressure_2
 serial_lock = threading.Lock()
@@ -17,6 +23,12 @@ arduino_port = 'COM10'  # Change to your Arduino's serial port
 baud_rate = 9600
 ser = serial.Serial(arduino_port, baud_rate)
 time.sleep(2)  # Allow time for Arduino to initialize
+# Only the writer thread writes to the port, repeated setpoints are dropped (see serial_writer.py).
+# Commands are binary frames with a CRC if the firmware supports them, text lines otherwise.
+serial_writer = SerialWriter(ser, negotiate_encoder(ser))
+# A reader thread keeps the box's telemetry (setpoints, measured pressures, valve states) in a ring
+# buffer the UI and the print log read without locking (see pressure_telemetry.py)
+telemetry = TelemetryReader(ser).start()
 #############################################################
 # -*- coding: utf-8 -*-
 '''
@@ -509,17 +521,11 @@ time.sleep(2)  # Allow time for Arduino to initialize
 '''
 
 def close_valve(system_number):
-    command = f"{system_number},-2\n"
-    ser.write(command.encode())
-    #write_serial_command(command)
-    ser.flush()
+    serial_writer.set_valve(system_number, False)
     print(f"Closing valve {system_number}...")
     
 def open_valve(system_number):
-    command = f"{system_number},-1\n"
-    ser.write(command.encode())
-    #write_serial_command(command)
-    ser.flush()
+    serial_writer.set_valve(system_number, True)
     print(f"Opening valve {system_number}...")
 
 def set_PID_pressure(system_number, pressure):
@@ -527,15 +533,25 @@ def set_PID_pressure(system_number, pressure):
     if pressure < 0 or pressure > 100:
         print("Pressure out of range. Must be 0 to 100 PSI.")
         return
-    command = f"{system_number},{pressure}\n"
-    ser.write(command.encode())
-    #write_serial_command(command)
-    ser.flush()
+    serial_writer.set_pressure(system_number, pressure)
     print(f"Setting PID {system_number} to: {pressure} PSI")
     if system_number == 1:
-        desired_pressure_1 = int(pressure)
+        desired_pressure_1 = pressure
     elif system_number == 2:
-        desired_pressure_2 = int(pressure)
+        desired_pressure_2 = pressure
+
+def set_PID_pressures(pressures, valves=None):
+    global desired_pressure_1, desired_pressure_2
+    if any(pressure < 0 or pressure > 100 for pressure in pressures.values()):
+        print("Pressure out of range. Must be 0 to 100 PSI.")
+        return
+    # One command for all channels, the box applies them together
+    serial_writer.set_channels(pressures, valves)
+    print(f"Setting PIDs to: {pressures} PSI")
+    if 1 in pressures:
+        desired_pressure_1 = pressures[1]
+    if 2 in pressures:
+        desired_pressure_2 = pressures[2]
 
 def read_serial():
     if ser.in_waiting > 0:
@@ -567,8 +583,7 @@ def printing_process():
     speed = [60,60,10]
     '''
     
-    set_PID_pressure(1, desired_pressure_1)  # Set the PID setpoint of channel 1 to XX PSI
-    set_PID_pressure(2, desired_pressure_2)  # Set the PID setpoint of channel 2 to XX PSI
+    set_PID_pressures({1: desired_pressure_1, 2: desired_pressure_2})  # Set the PID setpoints of both channels
     time.sleep(5)
     
     open_valve(1)
@@ -580,50 +595,41 @@ def printing_process():
     move_y = 5
     move_vel = 50
     
-    #controller.runtime.commands.motion.movelinear('C', [0.4], 10)
-    for i in range(100):
-        if np.mod(i, 2) == 0:
-            for unit in range(0, 5):
-                controller.runtime.commands.motion.movelinear('X', [move_x], move_vel)
-                set_PID_pressure(1, desired_pressure_1)  # Set the PID setpoint of channel 1 to XX PSI
-                set_PID_pressure(2, desired_pressure_2)  # Set the PID setpoint of channel 2 to XX PSI
-                controller.runtime.commands.motion.movelinear('Y', [move_y], move_vel)
-                set_PID_pressure(1, desired_pressure_1)  # Set the PID setpoint of channel 1 to XX PSI
-                set_PID_pressure(2, desired_pressure_2)  # Set the PID setpoint of channel 2 to XX PSI
-                controller.runtime.commands.motion.movelinear('X', [-move_x], move_vel)
-                set_PID_pressure(1, desired_pressure_1)  # Set the PID setpoint of channel 1 to XX PSI
-                set_PID_pressure(2, desired_pressure_2)  # Set the PID setpoint of channel 2 to XX PSI
-                controller.runtime.commands.motion.movelinear('Y', [move_y], move_vel)
-                set_PID_pressure(1, desired_pressure_1)  # Set the PID setpoint of channel 1 to XX PSI
-                set_PID_pressure(2, desired_pressure_2)  # Set the PID setpoint of channel 2 to XX PSI
-        else:
-            for unit in range(0, 5):
-                controller.runtime.commands.motion.movelinear('X', [move_x], move_vel)
-                set_PID_pressure(1, desired_pressure_1)  # Set the PID setpoint of channel 1 to XX PSI
-                set_PID_pressure(2, desired_pressure_2)  # Set the PID setpoint of channel 2 to XX PSI
-                controller.runtime.commands.motion.movelinear('Y', [-move_y], move_vel)
-                set_PID_pressure(1, desired_pressure_1)  # Set the PID setpoint of channel 1 to XX PSI
-                set_PID_pressure(2, desired_pressure_2)  # Set the PID setpoint of channel 2 to XX PSI
-                controller.runtime.commands.motion.movelinear('X', [-move_x], move_vel)
-                set_PID_pressure(1, desired_pressure_1)  # Set the PID setpoint of channel 1 to XX PSI
-                set_PID_pressure(2, desired_pressure_2)  # Set the PID setpoint of channel 2 to XX PSI
-                controller.runtime.commands.motion.movelinear('Y', [-move_y], move_vel)
-                set_PID_pressure(1, desired_pressure_1)  # Set the PID setpoint of channel 1 to XX PSI
-                set_PID_pressure(2, desired_pressure_2)  # Set the PID setpoint of channel 2 to XX PSI
-        controller.runtime.commands.motion.movelinear('C', [0.4], 10)
+    # The whole serpentine (100 layers of 5 units) is generated up front and runs as one blended
+    # program, one blocking movelinear per segment stopped the gantry at every corner (see raster_plan.py)
+    plan = serpentine_toolpath(line_length=move_x, line_pitch=move_y, lines=10, layers=100, layer_height=0.4,
+                               speed=move_vel, layer_speed=10)
+    print_comparison(compare_plan(plan))
+    
+    # Pressures entered in the UI are forwarded while the program runs, only when they change
+    listener = PressureEventListener(
+        controller, set_PID_pressure,
+        lambda channel, is_open: open_valve(channel) if is_open else close_valve(channel),
+        host_pressures=lambda: (desired_pressure_1, desired_pressure_2), set_pressures=set_PID_pressures)
+    listener.reset()  # The compiled plan is ours, its globals are free for the listener
+    
+    # The plan is incremental and starts wherever the nozzle is, like the per-segment moves did
+    telemetry_start = telemetry.buffer.count
+    run_program(upload_program(controller, compile_plan(plan, "raster_plan.ascript")))
+    print("Started printing...")
+    
+    stats = listener.run()
+    print(f"{stats['events']} events, {stats['commands']} serial commands in {stats['polls']} polls")
     
     close_valve(1)
     close_valve(2)
-    ser.close()
+    serial_writer.flush()  # The port stays open for cleanup() when the window closes
+    print_writer_stats(serial_writer.stats)
+    records, _ = telemetry.buffer.since(telemetry_start)
+    save_telemetry(records, "print_telemetry.csv")
+    print(f"{len(records)} telemetry records saved to: print_telemetry.csv")
     print("Finished printing.")
 
 # Cleanup function to ensure valves are closed and pressures are set to zero
 def cleanup():
-    set_PID_pressure(1, 0)
-    set_PID_pressure(2, 0)
-    close_valve(1)
-    close_valve(2)
-    ser.close()
+    set_PID_pressures({1: 0, 2: 0}, valves={1: False, 2: False})
+    telemetry.stop()
+    serial_writer.close()
     print("Cleaned up and closed valves.")
 
 # UI class for controlling pressures and valves
@@ -631,9 +637,10 @@ class PressureControlApp(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("Pressure Control System")
-        self.geometry("400x300")
+        self.geometry("400x340")
         self.valve_state = {1: True, 2: True}  # Valve states: True for open, False for closed
         self.create_widgets()
+        self.update_measured_pressures()
         
     def create_widgets(self):
         # Valve 1 control
@@ -656,6 +663,20 @@ class PressureControlApp(tk.Tk):
         self.pressure2_entry.pack(pady=5)
         ttk.Button(self, text="Set Pressure 2", command=self.update_desired_pressure_2).pack(pady=5)
 
+        # Measured pressures from the box's telemetry
+        self.measured_label = ttk.Label(self, text="Measured: no telemetry")
+        self.measured_label.pack(pady=5)
+
+    def update_measured_pressures(self):
+        readings = []
+        for channel in (1, 2):
+            record = telemetry.buffer.latest(channel)
+            if record is not None:
+                readings.append(f"{channel}: {record['pressure']:.1f} psi")
+        if readings:
+            self.measured_label.config(text="Measured " + ", ".join(readings))
+        self.after(200, self.update_measured_pressures)
+
     def update_desired_pressure_1(self):
         global desired_pressure_1
         try:
@@ -697,9 +718,9 @@ if __name__ == "__main__":
     def on_closing():
         cleanup()
         app.destroy()
-        ser.close()
+        serial_writer.close()
     
     app.protocol("WM_DELETE_WINDOW", on_closing)
     app.mainloop()
     # Ensure serial connection is closed when the application is closed
-    ser.close()
+    serial_writer.close()
@@ -5,18 +5,32 @@ import threading
 import time
 import automation1 as a1
 import numpy as np
+from pressure_events import PressureEventListener
+from pressure_protocol import negotiate_encoder
+from pressure_telemetry import TelemetryReader, save_telemetry
+from program_cache import ProgramCache
+from serial_writer import SerialWriter, print_writer_stats
 
 global desired_pressure_1, desired_pressure_2
 serial_lock = threading.Lock()
 # Initialize global variables for desired pressures
 desired_pressure_1 = 15
 desired_pressure_2 = 15
+# Compiled programs are reused until the .ascript or one of its includes changes, the cache is
+# created when the first program runs
+program_cache = None
 
 # Define the serial port and baud rate
 arduino_port = 'COM10'  # Change to your Arduino's serial port
 baud_rate = 9600
 ser = serial.Serial(arduino_port, baud_rate)
 time.sleep(2)  # Allow time for Arduino to initialize
+# Only the writer thread writes to the port, repeated setpoints are dropped (see serial_writer.py).
+# Commands are binary frames with a CRC if the firmware supports them, text lines otherwise.
+serial_writer = SerialWriter(ser, negotiate_encoder(ser))
+# A reader thread keeps the box's telemetry (setpoints, measured pressures, valve states) in a ring
+# buffer the UI and the print log read without locking (see pressure_telemetry.py)
+telemetry = TelemetryReader(ser).start()
 #############################################################
 # -*- coding: utf-8 -*-
 '''
@@ -346,8 +360,16 @@ def run_program(aeroscript_program_path):
 	# but it will not wait for the program to complete before returning. The AeroScript source file
 	# will be compiled before running. If there is a compile error, it will throw a CompileException.
 	# We can use the controller's Tasks API to check on the status of our program as it runs, and to find out when it completes.
+	# A program on the host runs from the program cache instead: it is compiled only when the source changed
+	# and uploaded to the controller file system. Other paths name programs on the controller, run as they are.
+	global program_cache
+	if program_cache is None:
+		program_cache = ProgramCache()
 	print('Starting AeroScript program')
-	controller.runtime.tasks[1].program.run(aeroscript_program_path)
+	program_path = program_cache.run(controller, aeroscript_program_path)
+	stats = program_cache.stats
+	print(f'Running {program_path} ({stats["hits"]} cached, {stats["misses"]} compiled in {stats["compile_seconds"]:.1f} s, '
+	      f'{stats["uploads"]} uploaded)')
 
 def show_program_status():
 	'''
@@ -509,17 +531,11 @@ time.sleep(2)  # Allow time for Arduino to initialize
 '''
 
 def close_valve(system_number):
-    command = f"{system_number},-2\n"
-    ser.write(command.encode())
-    #write_serial_command(command)
-    ser.flush()
+    serial_writer.set_valve(system_number, False)
     print(f"Closing valve {system_number}...")
     
 def open_valve(system_number):
-    command = f"{system_number},-1\n"
-    ser.write(command.encode())
-    #write_serial_command(command)
-    ser.flush()
+    serial_writer.set_valve(system_number, True)
     print(f"Opening valve {system_number}...")
 
 def set_PID_pressure(system_number, pressure):
@@ -527,15 +543,25 @@ def set_PID_pressure(system_number, pressure):
     if pressure < 0 or pressure > 100:
         print("Pressure out of range. Must be 0 to 100 PSI.")
         return
-    command = f"{system_number},{pressure}\n"
-    ser.write(command.encode())
-    #write_serial_command(command)
-    ser.flush()
+    serial_writer.set_pressure(system_number, pressure)
     print(f"Setting PID {system_number} to: {pressure} PSI")
     if system_number == 1:
-        desired_pressure_1 = int(pressure)
+        desired_pressure_1 = pressure
     elif system_number == 2:
-        desired_pressure_2 = int(pressure)
+        desired_pressure_2 = pressure
+
+def set_PID_pressures(pressures, valves=None):
+    global desired_pressure_1, desired_pressure_2
+    if any(pressure < 0 or pressure > 100 for pressure in pressures.values()):
+        print("Pressure out of range. Must be 0 to 100 PSI.")
+        return
+    # One command for all channels, the box applies them together
+    serial_writer.set_channels(pressures, valves)
+    print(f"Setting PIDs to: {pressures} PSI")
+    if 1 in pressures:
+        desired_pressure_1 = pressures[1]
+    if 2 in pressures:
+        desired_pressure_2 = pressures[2]
 
 def read_serial():
     if ser.in_waiting > 0:
@@ -556,8 +582,7 @@ def write_serial_command(command):
 def printing_process():
     global desired_pressure_1, desired_pressure_2
     
-    set_PID_pressure(1, desired_pressure_1)  # Set the PID setpoint of channel 1 to XX PSI
-    set_PID_pressure(2, desired_pressure_2)  # Set the PID setpoint of channel 2 to XX PSI
+    set_PID_pressures({1: desired_pressure_1, 2: desired_pressure_2})  # Set the PID setpoints of both channels
     time.sleep(2)
     
     open_valve(1)
@@ -565,31 +590,38 @@ def printing_process():
     open_valve(2)
     time.sleep(0.1)
     
+    # Forward the pressures entered in the UI, only when they change (see pressure_events.py).
+    # The hand-written program embeds no events, its globals are left alone
+    listener = PressureEventListener(
+        controller, set_PID_pressure,
+        lambda channel, is_open: open_valve(channel) if is_open else close_valve(channel),
+        host_pressures=lambda: (desired_pressure_1, desired_pressure_2), set_pressures=set_PID_pressures,
+        program_events=False)
+
     # Placeholder for run_program function
+    telemetry_start = telemetry.buffer.count
     run_program("test20240110.ascript")
     #run_program("16by4unit60twist.ascript")
     print("Started printing...")
     
-    while(1):
-        global_integer = controller.runtime.variables.global_.get_integer(0)
-        set_PID_pressure(1, desired_pressure_1)
-        set_PID_pressure(2, desired_pressure_2)
-        if global_integer == 0:
-            break
+    stats = listener.run()
+    print(f"{stats['events']} events, {stats['commands']} serial commands in {stats['polls']} polls")
     
     close_valve(1)
     close_valve(2)
-    ser.close()
+    serial_writer.flush()  # The port stays open for cleanup() when the window closes
+    print_writer_stats(serial_writer.stats)
+    records, _ = telemetry.buffer.since(telemetry_start)
+    save_telemetry(records, "print_telemetry.csv")
+    print(f"{len(records)} telemetry records saved to: print_telemetry.csv")
     print("Finished printing.")
 
 
 # Cleanup function to ensure valves are closed and pressures are set to zero
 def cleanup():
-    set_PID_pressure(1, 0)
-    set_PID_pressure(2, 0)
-    close_valve(1)
-    close_valve(2)
-    ser.close()
+    set_PID_pressures({1: 0, 2: 0}, valves={1: False, 2: False})
+    telemetry.stop()
+    serial_writer.close()
     print("Cleaned up and closed valves.")
 
 # UI class for controlling pressures and valves
@@ -597,9 +629,10 @@ class PressureControlApp(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("Pressure Control System")
-        self.geometry("400x300")
+        self.geometry("400x340")
         self.valve_state = {1: True, 2: True}  # Valve states: True for open, False for closed
         self.create_widgets()
+        self.update_measured_pressures()
         
     def create_widgets(self):
         # Valve 1 control
@@ -622,6 +655,20 @@ class PressureControlApp(tk.Tk):
         self.pressure2_entry.pack(pady=5)
         ttk.Button(self, text="Set Pressure 2", command=self.update_desired_pressure_2).pack(pady=5)
 
+        # Measured pressures from the box's telemetry
+        self.measured_label = ttk.Label(self, text="Measured: no telemetry")
+        self.measured_label.pack(pady=5)
+
+    def update_measured_pressures(self):
+        readings = []
+        for channel in (1, 2):
+            record = telemetry.buffer.latest(channel)
+            if record is not None:
+                readings.append(f"{channel}: {record['pressure']:.1f} psi")
+        if readings:
+            self.measured_label.config(text="Measured " + ", ".join(readings))
+        self.after(200, self.update_measured_pressures)
+
     def update_desired_pressure_1(self):
         global desired_pressure_1
         try:
@@ -663,9 +710,9 @@ if __name__ == "__main__":
     def on_closing():
         cleanup()
         app.destroy()
-        ser.close()
+        serial_writer.close()
     
     app.protocol("WM_DELETE_WINDOW", on_closing)
     app.mainloop()
     # Ensure serial connection is closed when the application is closed
-    ser.close()
+    serial_writer.close()
@@ -0,0 +1,365 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from gcode_io import open_gcode_file
+from toolpath_analysis import analyze_toolpath
+from toolpath_format import ToolpathBuilder
+from use_this_Gcode_revision import (ARC_TOLERANCE, BUFFER_SIZE, adjust_gcode_file, read_gcode_lines,
+                                     resolve_gcode_path, revise_gcode_lines)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Assumed controller time per motion command (s) for the arc fitting estimate, i.e. 1000 blocks/s
+BLOCK_TIME = 0.001
+# Synthetic slicer file sizes (lines) of the benchmark suite
+SUITE_SIZES = [10_000, 1_000_000, 10_000_000]
+# The legacy revision keeps its whole output in memory, so equivalence is only checked up to here
+EQUIVALENCE_MAX_LINES = 2_000_000
+# Throughput drop against a saved baseline that is reported as a regression
+REGRESSION_THRESHOLD = 0.2
+# Part of the synthetic file names, bump when generate_slicer_file() changes so cached files are regenerated
+SYNTHETIC_VERSION = 2
+
+
+def legacy_revise_lines(lines, replacement_letter):
+    '''
+    The original substring-matching revision, kept as the reference for benchmarks.
+    '''
+    adjusted_lines = ["G75\n"]
+    process1_encountered = False
+    build_summary_encountered = False
+
+    for line in lines:
+        if not process1_encountered:
+            if "; process Process1" in line:
+                process1_encountered = True
+            else:
+                continue
+
+        if line.startswith(";") and build_summary_encountered:
+            continue
+        if "Build Summary" in line:
+            build_summary_encountered = True
+            continue
+
+        if any(cmd in line for cmd in ["M3", "M4", "M5", "M6", "T0", "T1", "T2", "T3", "M106"]):
+            continue
+
+        parts = line.split(" ")
+        parts = [part for part in parts if not part.startswith("E")]
+        line = " ".join(parts)
+        if not line.endswith("\n"):
+            line += "\n"
+
+        if "G1 Z" in line:
+            line = line.replace("Z", replacement_letter)
+            adjusted_lines.append("G91\n")
+            adjusted_lines.append(line)
+            adjusted_lines.append("G90\n")
+            continue
+
+        if "Z =" in line:
+            continue
+
+        adjusted_lines.append(line)
+
+    adjusted_lines.insert(1, "$iglobal[0] = 1\n")
+    adjusted_lines.append("$iglobal[0] = 0\n")
+    return adjusted_lines
+
+
+def time_revision(revise, file_path, replacement_letter):
+    '''
+    Runs a revision function over a file and returns (output line count, seconds).
+    '''
+    start_time = time.perf_counter()
+    line_count = 0
+    for _ in revise(read_gcode_lines(file_path), replacement_letter):
+        line_count += 1
+    return line_count, time.perf_counter() - start_time
+
+
+def compare_with_legacy(filename, replacement_letter='C'):
+    '''
+    Times the lexer-based revision against the legacy substring version on the same file.
+    '''
+    file_path = resolve_gcode_path(filename)
+    with open_gcode_file(file_path) as file:
+        input_lines = sum(1 for _ in file)
+
+    results = {}
+    for name, revise in (("legacy", legacy_revise_lines), ("lexer", revise_gcode_lines)):
+        output_lines, seconds = time_revision(revise, file_path, replacement_letter)
+        results[name] = seconds
+        print(f"{name:>8}: {output_lines} lines out in {seconds:.2f} s ({input_lines / seconds:.0f} lines/s)")
+    print(f"Speedup: {results['legacy'] / results['lexer']:.2f}x")
+    return results
+
+
+def compare_arc_fitting(filename, replacement_letter='C', tolerance=ARC_TOLERANCE, block_time=BLOCK_TIME,
+                        simplify_tolerance=None):
+    '''
+    Revises a file with and without arc fitting and compares motion command count and estimated
+    time, once from the feedrates alone and once with a per-command block time floor. With a
+    simplify_tolerance, simplification alone is compared as well.
+    '''
+    file_path = resolve_gcode_path(filename)
+    modes = [("chords", None, None), ("arcs", None, tolerance)]
+    if simplify_tolerance is not None:
+        modes.insert(1, ("simplify", simplify_tolerance, None))
+    results = {}
+    for name, mode_simplify_tolerance, arc_tolerance in modes:
+        toolpath = ToolpathBuilder()
+        start_time = time.perf_counter()
+        for _ in revise_gcode_lines(read_gcode_lines(file_path), replacement_letter, toolpath=toolpath,
+                                    simplify_tolerance=mode_simplify_tolerance, arc_tolerance=arc_tolerance):
+            pass
+        seconds = time.perf_counter() - start_time
+        array = toolpath.to_array()
+        feed_time = analyze_toolpath(array)["total_time"]
+        block_limited_time = analyze_toolpath(array, min_segment_time=block_time)["total_time"]
+        results[name] = (len(array), feed_time, block_limited_time)
+        print(f"{name:>8}: {len(array)} segments, {feed_time:.1f} s at feed, "
+              f"{block_limited_time:.1f} s at {1 / block_time:.0f} blocks/s (revised in {seconds:.2f} s)")
+    chords = results["chords"]
+    for name, _, _ in modes[1:]:
+        segments, _, block_limited_time = results[name]
+        print(f"{name:>8}: {1 - segments / chords[0]:.1%} fewer segments, "
+              f"block-limited time {1 - block_limited_time / chords[2]:.1%} shorter")
+    return results
+
+
+def generate_slicer_file(file_path, line_count, seed=0):
+    '''
+    Writes a synthetic slicer file of about line_count lines with everything the revision has to
+    handle: a preamble before "; process Process1", layers with "Z =" comments and pure Z moves,
+    tool changes and fan codes, curved perimeters, infill with E words, retractions, and a
+    Build Summary footer followed by comments and M codes. Like slicer output, a move only carries
+    an F word when the feed changes, so arc fitting and simplification find runs to merge.
+    '''
+    rng = random.Random(seed)
+    preamble = ["; generated by gcode_benchmark.py\n", "G21\n", "G90\n", "M82\n", "M106 S255\n", "T0\n",
+                "G28\n", "; process Process1\n"]
+    footer = ["; Build Summary\n", ";   Build time: 1 hours 2 minutes\n", ";   Filament length: 1234.5 mm\n",
+              "M5\n", "M106 S0\n"]
+    lines_left = line_count - len(preamble) - len(footer)
+    e = 0.0
+    layer = 0
+    current_feed = None
+
+    def feed(value):
+        nonlocal current_feed
+        if value == current_feed:
+            return ""
+        current_feed = value
+        return f" F{value}"
+
+    with open_gcode_file(file_path, 'w') as file:
+        file.writelines(preamble)
+        while lines_left > 0:
+            layer += 1
+            z = 0.3 * layer
+            batch = [f"; layer {layer}, Z = {z:.3f}\n", f"G1 Z{z:.3f}{feed(1000)}\n"]
+            if layer % 2 == 0:
+                batch += [f"T{layer // 2 % 2}\n", "M106 S128\n"]
+            # Perimeter: a circle of short chords
+            cx, cy, radius = rng.uniform(30, 70), rng.uniform(30, 70), rng.uniform(5, 25)
+            batch.append(f"G0 X{cx + radius:.3f} Y{cy:.3f}{feed(6000)}\n")
+            for k in range(1, 181):
+                angle = 2 * math.pi * k / 180
+                e += 0.02
+                batch.append(f"G1 X{cx + radius * math.cos(angle):.3f} Y{cy + radius * math.sin(angle):.3f} "
+                             f"E{e:.5f}{feed(1200)}\n")
+            batch += [f"G1 E{e - 1:.5f}{feed(1800)}\n", f"G1 E{e:.5f}{feed(1800)}\n"]
+            # Infill: long random lines
+            for _ in range(820):
+                e += 0.05
+                batch.append(f"G1 X{rng.uniform(0, 100):.3f} Y{rng.uniform(0, 100):.3f} E{e:.5f}{feed(1200)}\n")
+            batch = batch[:lines_left]
+            file.writelines(batch)
+            lines_left -= len(batch)
+        file.writelines(footer)
+    return file_path
+
+
+def synthetic_file(data_dir, line_count, suffix=""):
+    '''
+    Returns the path of a synthetic slicer file of line_count lines, generated on first use.
+    With suffix ".gz" or ".xz" a compressed copy of the plain file is returned.
+    '''
+    file_name = f"synthetic_v{SYNTHETIC_VERSION}_{line_count}.gcode{suffix}"
+    file_path = os.path.join(data_dir, file_name)
+    if not os.path.exists(file_path):
+        partial_path = os.path.join(data_dir, "partial_" + file_name)  # Keeps the compression suffix
+        if suffix:
+            with open_gcode_file(synthetic_file(data_dir, line_count), 'rb') as source, \
+                    open_gcode_file(partial_path, 'wb') as target:
+                shutil.copyfileobj(source, target, BUFFER_SIZE)
+        else:
+            generate_slicer_file(partial_path, line_count)
+        os.replace(partial_path, file_path)
+    return file_path
+
+
+def peak_rss_mb():
+    '''
+    Returns the peak resident set size of this process in MB, or None where it is unavailable.
+    '''
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB elsewhere
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    except (ImportError, AttributeError):
+        return None
+
+
+def _run_revision(file_path, output_path, replacement_letter, workers):
+    # Runs in a fresh worker process so its peak RSS belongs to this run only
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = adjust_gcode_file(file_path, replacement_letter, output_path, workers=workers)
+    return stats["seconds"], stats["lines_in"], peak_rss_mb()
+
+
+def file_digest(file_path):
+    digest = hashlib.blake2b()
+    with open_gcode_file(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(BUFFER_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def legacy_digest(file_path, replacement_letter):
+    digest = hashlib.blake2b()
+    for line in legacy_revise_lines(read_gcode_lines(file_path), replacement_letter):
+        digest.update(line.encode())
+    return digest.hexdigest()
+
+
+def run_suite(sizes=SUITE_SIZES, workers_list=(1,), data_dir=None, replacement_letter='C',
+              equivalence_max_lines=EQUIVALENCE_MAX_LINES, compressions=()):
+    '''
+    Revises synthetic slicer files end-to-end with adjust_gcode_file and reports throughput,
+    peak RSS of the revising process (worker processes of parallel runs not included) and
+    whether the output is byte-identical to the legacy revision.
+    Args:
+        sizes: Synthetic file sizes in lines.
+        workers_list: Worker counts to run every size with (see adjust_gcode_file).
+        compressions: Also run with input and output compressed in these formats ("gz", "xz").
+            MB/s is always counted in uncompressed text so the formats compare directly.
+        data_dir: Where synthetic files are kept between runs, defaults to the temp directory.
+        equivalence_max_lines: Largest file checked against the legacy revision.
+    Returns:
+        A list of result dicts, one per size, format and worker count.
+    '''
+    data_dir = data_dir or os.path.join(tempfile.gettempdir(), "gcode_benchmark")
+    os.makedirs(data_dir, exist_ok=True)
+    results = []
+    cpus = os.cpu_count() or 1
+    print(f"{cpus} CPUs (os.cpu_count()), worker counts above it cannot run in parallel")
+    print(f"{'lines':>10} {'format':>6} {'workers/CPUs':>12} {'seconds':>8} {'lines/s':>10} {'MB/s':>7} {'peak RSS':>9}"
+          f"  output")
+    for size in sizes:
+        plain_path = synthetic_file(data_dir, size)
+        megabytes = os.path.getsize(plain_path) / 2 ** 20
+        reference = None
+        if size <= equivalence_max_lines:
+            reference = legacy_digest(plain_path, replacement_letter)
+        for file_format, workers in [(file_format, workers) for file_format in ("plain", *compressions)
+                                     for workers in workers_list]:
+            suffix = "" if file_format == "plain" else "." + file_format
+            file_path = synthetic_file(data_dir, size, suffix)
+            output_path = os.path.join(data_dir, f"synthetic_{size}_revised_{workers}.gcode{suffix}")
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                seconds, lines_in, rss = executor.submit(_run_revision, file_path, output_path,
+                                                         replacement_letter, workers).result()
+            if reference is None:
+                equivalent = None
+            else:
+                equivalent = file_digest(output_path) == reference
+            os.remove(output_path)
+            result = {"lines": size, "format": file_format, "workers": workers, "cpus": cpus, "seconds": seconds,
+                      "lines_per_second": lines_in / seconds,
+                      "mb_per_second": megabytes / seconds, "peak_rss_mb": rss, "equivalent": equivalent}
+            results.append(result)
+            rss_text = f"{rss:.0f} MB" if rss is not None else "n/a"
+            output_text = {True: "identical to legacy", False: "DIFFERS from legacy", None: "not checked"}[equivalent]
+            print(f"{size:>10} {file_format:>6} {workers:>8}/{cpus:<3} {seconds:>8.2f} {result['lines_per_second']:>10.0f} "
+                  f"{result['mb_per_second']:>7.1f} {rss_text:>9}  {output_text}")
+    return results
+
+
+def compare_with_baseline(results, baseline_path, threshold=REGRESSION_THRESHOLD):
+    '''
+    Compares suite results with a baseline saved by an earlier run.
+    Returns True if no run got more than threshold slower or produced different output.
+    '''
+    with open(baseline_path, 'r') as file:
+        baseline = {(result["lines"], result.get("format", "plain"), result["workers"]): result
+                    for result in json.load(file)}
+    passed = True
+    for result in results:
+        previous = baseline.get((result["lines"], result["format"], result["workers"]))
+        if previous is None:
+            continue
+        change = result["lines_per_second"] / previous["lines_per_second"] - 1
+        regression = change < -threshold or result["equivalent"] is False
+        passed = passed and not regression
+        cpus_text = "" if previous.get("cpus") in (None, result["cpus"]) else f" (baseline on {previous['cpus']} CPUs)"
+        print(f"{result['lines']:>10} lines, {result['format']}, {result['workers']} workers: throughput {change:+.1%} vs baseline"
+              f"{cpus_text}{'  REGRESSION' if regression else ''}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the G-code revision pipeline.")
+    parser.add_argument("filename", nargs="?", help="slicer G-code file (relative to the scripts or absolute)")
+    parser.add_argument("replacement_letter", nargs="?", default="C")
+    parser.add_argument("--suite", action="store_true",
+                        help="run the end-to-end suite on synthetic slicer files instead of one file")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SUITE_SIZES, help="suite file sizes in lines")
+    parser.add_argument("-j", "--workers", type=int, nargs="+", default=[1], help="suite worker counts")
+    parser.add_argument("--compression", nargs="+", choices=["gz", "xz"], default=[],
+                        help="also run the suite on compressed input and output")
+    parser.add_argument("--data-dir", help="where the synthetic files are kept between runs")
+    parser.add_argument("--save", metavar="PATH", help="save the suite results as a baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="fail if the suite regressed against this baseline")
+    parser.add_argument("--arcs", nargs="?", type=float, const=ARC_TOLERANCE, metavar="TOLERANCE",
+                        help="compare arc fitting within TOLERANCE mm against plain chords instead")
+    parser.add_argument("--simplify", nargs="?", type=float, const=0.0, metavar="TOLERANCE",
+                        help="with --arcs, also compare simplification within TOLERANCE mm (default 0)")
+    args = parser.parse_args()
+    if args.suite:
+        results = run_suite(args.sizes, args.workers, args.data_dir, args.replacement_letter,
+                            compressions=args.compression)
+        if args.save:
+            with open(args.save, 'w') as file:
+                json.dump(results, file, indent=1)
+        if args.baseline and not compare_with_baseline(results, args.baseline):
+            sys.exit(1)
+        return
+    if args.filename is None:
+        parser.error("a filename is needed unless --suite is given")
+    if args.arcs is not None:
+        compare_arc_fitting(args.filename, args.replacement_letter, args.arcs, simplify_tolerance=args.simplify)
+    else:
+        compare_with_legacy(args.filename, args.replacement_letter)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import hashlib
+import sqlite3
+import time
+
+# Layers kept in the cache, the least recently used ones are dropped beyond this
+CACHE_MAX_LAYERS = 200000
+
+
+def layer_key(layer_text, fingerprint):
+    '''
+    Hashes one layer of slicer text together with the revision settings it is revised with.
+    '''
+    digest = hashlib.blake2b(fingerprint.encode(), digest_size=20)
+    digest.update(layer_text.encode())
+    return digest.digest()
+
+
+class LayerCache:
+    '''
+    Persistent on-disk store of revised layers keyed by layer_key(), backed by SQLite.
+    '''
+
+    def __init__(self, file_path, max_layers=CACHE_MAX_LAYERS):
+        self.file_path = file_path
+        self.max_layers = max_layers
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(file_path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS layers ("
+            "key BLOB PRIMARY KEY, revised TEXT NOT NULL, line_count INTEGER NOT NULL, last_used REAL NOT NULL)")
+
+    def get(self, key):
+        '''
+        Returns (revised text, line count) for a key, or None if the layer is not cached.
+        '''
+        row = self._connection.execute("SELECT revised, line_count FROM layers WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._connection.execute("UPDATE layers SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row
+
+    def put(self, key, revised, line_count):
+        self._connection.execute("INSERT OR REPLACE INTO layers VALUES (?, ?, ?, ?)",
+                                 (key, revised, line_count, time.time()))
+
+    def prune(self):
+        '''
+        Drops the least recently used layers beyond max_layers.
+        '''
+        self._connection.execute(
+            "DELETE FROM layers WHERE key NOT IN (SELECT key FROM layers ORDER BY last_used DESC LIMIT ?)",
+            (self.max_layers,))
+
+    def clear(self):
+        self._connection.execute("DELETE FROM layers")
+        self._connection.commit()
+
+    def close(self):
+        self.prune()
+        self._connection.commit()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,75 @@
+import gzip
+import io
+import lzma
+import os
+
+# Large buffers keep the number of read/write system calls low on multi-GB slicer files
+BUFFER_SIZE = 1024 * 1024
+# Fast compression settings: G-code compresses well even at the lowest levels, while the
+# default levels (gzip 9, xz 6) would be slower than the revision itself
+GZIP_LEVEL = 1
+XZ_PRESET = 0
+COMPRESSED_SUFFIXES = (".gz", ".xz")
+
+
+def split_compression_suffix(file_path):
+    '''
+    Returns (path without compression suffix, suffix), e.g. ("part.gcode", ".gz").
+    '''
+    for suffix in COMPRESSED_SUFFIXES:
+        if file_path.endswith(suffix):
+            return file_path[:-len(suffix)], suffix
+    return file_path, ""
+
+
+def is_compressed(file_path):
+    return split_compression_suffix(file_path)[1] != ""
+
+
+def derived_path(file_path, tag, extension=None):
+    '''
+    Returns the path of a file derived from file_path: tag is inserted before the extension and
+    the compression suffix is kept, e.g. ("part.gcode.gz", "_revised") gives "part_revised.gcode.gz".
+    With an extension the file gets it instead, uncompressed, e.g. ("part.nc", "", ".toolpath").
+    '''
+    base, compression = split_compression_suffix(file_path)
+    root, original_extension = os.path.splitext(base)
+    if extension is None:
+        return f"{root}{tag}{original_extension}{compression}"
+    return f"{root}{tag}{extension}"
+
+
+def check_output_path(input_path, output_path):
+    '''
+    Raises ValueError if output_path is the input file, opening it for writing would truncate
+    the input before it was read.
+    '''
+    if os.path.abspath(input_path) == os.path.abspath(output_path) or (
+            os.path.exists(input_path) and os.path.exists(output_path) and os.path.samefile(input_path, output_path)):
+        raise ValueError(f"The output file {output_path} is the input file")
+
+
+def _open_compressed(file_path, mode, suffix):
+    if suffix == ".gz":
+        return gzip.open(file_path, mode, compresslevel=GZIP_LEVEL) if "w" in mode else gzip.open(file_path, mode)
+    return lzma.open(file_path, mode, preset=XZ_PRESET) if "w" in mode else lzma.open(file_path, mode)
+
+
+def open_gcode_file(file_path, mode='r', buffer_size=BUFFER_SIZE):
+    '''
+    Opens a G-code file like open(), transparently (de)compressing .gz and .xz files.
+    Args:
+        file_path: The file, compressed if it ends with ".gz" or ".xz".
+        mode: 'r', 'w', 'rb' or 'wb'.
+        buffer_size: Size of the buffer between the caller and the (de)compressor or disk.
+    '''
+    _, suffix = split_compression_suffix(file_path)
+    if not suffix:
+        return open(file_path, mode, buffering=buffer_size)
+    binary_mode = mode if "b" in mode else mode + "b"
+    compressed = _open_compressed(file_path, binary_mode, suffix)
+    if "w" in mode:
+        stream = io.BufferedWriter(compressed, buffer_size)
+    else:
+        stream = io.BufferedReader(compressed, buffer_size)
+    return stream if "b" in mode else io.TextIOWrapper(stream)
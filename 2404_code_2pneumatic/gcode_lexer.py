@@ -0,0 +1,107 @@
+import re
+
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)'
+# Anything that is not an upper-case letter, number, space or line end
+_IRREGULAR_RE = re.compile(r'[^A-Z0-9.+\- \r\n]')
+_NUMBER_CHARACTERS = "0123456789.+-"
+# A code section made only of word-address words, with or without spaces between them
+_CODE_RE = re.compile(rf'(?:\s*[A-Z]{_NUMBER})*\s*')
+_WORD_RE = re.compile(rf'[A-Z]{_NUMBER}')
+
+
+def tokenize_line(line):
+    '''
+    Splits a G-code line into its code, words and comment in a single pass.
+    Args:
+        line: One line of G-code, with or without the trailing newline.
+    Returns:
+        (code, words, comment). code is the upper-cased text before the comment, which may
+        still end with the newline.
+        words is the list of words, each a letter followed by its number as source text
+        (word[0] is the letter and word[1:] the number, e.g. "X12.5"), so rewritten lines
+        keep the slicer's formatting. Lines that are not upper case and space separated, e.g.
+        packed words ("G1X1Y2") or lower case, are normalized: code then holds the words
+        separated by single spaces. Packed words are recognized by a packed first word, as
+        programs that pack words pack every line.
+        comment is the text from ";" onwards without the newline, or "".
+        words is None when the code is not plain word-address G-code (e.g. "$iglobal[0] = 1"),
+        in which case the line should be passed through as is.
+    '''
+    index = line.find(";")
+    if index < 0:
+        code, comment = line, ""
+    else:
+        code, comment = line[:index], line[index:].rstrip("\r\n")
+
+    # Slicer output is upper-case and space separated, so a plain split is enough
+    # unless the line contains anything else (lower case, tabs, "$", "=", ...)
+    if _IRREGULAR_RE.search(code) is None:
+        words = code.split()
+        if not words or not words[0][1:].lstrip(_NUMBER_CHARACTERS):
+            return code, words, comment
+    code = code.upper()
+    if _CODE_RE.fullmatch(code):
+        words = _WORD_RE.findall(code)
+        stripped = code.rstrip()
+        return " ".join(words) + code[len(stripped):], words, comment
+    return code, None, comment
+
+
+def command_key(words):
+    '''
+    Returns the line's command word with leading zeros removed, e.g. "G1" for "G01", or None.
+    A leading line number ("N10") is skipped.
+    '''
+    word = words[0]
+    if word[0] == "N" and len(words) > 1:
+        word = words[1]
+    if word[0] not in "GMT":
+        return None
+    if word[1] == "0" and len(word) > 2:
+        return word[0] + (word[1:].lstrip("0") or "0")
+    return word
+
+
+def word_value(words, letter, default=None):
+    '''
+    Returns the value of the first word with the given letter as a float.
+    '''
+    for word in words:
+        if word[0] == letter:
+            return float(word[1:])
+    return default
+
+
+def remove_words(code, letter):
+    '''
+    Removes every word with the given letter from a space separated code section
+    returned by tokenize_line(). String slicing is much cheaper than rebuilding the
+    line from its word list, and most slicer lines carry an extrusion word.
+    '''
+    code = " " + code
+    marker = " " + letter
+    start = code.find(marker)
+    while start >= 0:
+        end = code.find(" ", start + 2)
+        if end < 0:
+            end = len(code.rstrip("\r\n"))
+        code = code[:start] + code[end:]
+        start = code.find(marker, start)
+    return code[1:]
+
+
+def format_number(value, digits=6):
+    '''
+    Formats a coordinate with at most digits decimals and without trailing zeros.
+    '''
+    return f"{value:.{digits}f}".rstrip("0").rstrip(".") or "0"
+
+
+def format_line(words, comment=""):
+    '''
+    Builds a G-code line with a trailing newline from words and an optional comment.
+    '''
+    line = " ".join(words)
+    if comment:
+        line = f"{line} {comment}" if line else comment
+    return line + "\n"
@@ -0,0 +1,204 @@
+import argparse
+import json
+import mmap
+import os
+import re
+import shutil
+import time
+
+from gcode_io import check_output_path, derived_path, is_compressed
+from gcode_lexer import command_key, format_number, tokenize_line
+
+LAYER_INDEX_VERSION = 1
+# Height (mm) above the layer the nozzle travels at when moving to the resume position
+RESUME_CLEARANCE = 5.0
+# Amount of text read at once when looking back for the position before a layer
+_LOOKBACK_SIZE = 64 * 1024
+
+# Layer changes are written as "G91", a pure vertical move and "G90" by the revision. The
+# leading newline keeps the scan a fast literal search instead of testing every line start.
+_EVENT_RE = re.compile(rb"\n(?:G91\n|\$[ir]global\[)")
+_GLOBAL_RE = re.compile(r"\$([ir])global\[(\d+)\] = (\S+)")
+_VERTICAL_LETTERS = "ZABCD"
+
+
+def layer_index_path_for(revised_file_path):
+    return derived_path(revised_file_path, "", ".layers.json")
+
+
+def _line_at(data, start):
+    end = data.find(b"\n", start)
+    return data[start:end if end >= 0 else len(data)].decode()
+
+
+def _last_position(data, offset):
+    '''
+    Looks back from offset for the last absolute X, Y and feed of the revised program.
+    Returns a dict with the values found, the scan stops once all three are known.
+    '''
+    position = {}
+    end = offset
+    while end > 0 and len(position) < 3:
+        start = max(0, end - _LOOKBACK_SIZE)
+        text = data[start:end].decode()
+        lines = text.split("\n")
+        if start > 0 and len(lines) > 1:
+            end = start + len(lines[0])  # The first line may be cut, read it with the next block
+            lines = lines[1:]
+        else:
+            end = start
+        for line in reversed(lines):
+            _, words, _ = tokenize_line(line)
+            if not words or command_key(words) not in ("G0", "G1", "G2", "G3", None):
+                continue
+            for word in words:
+                letter = word[0]
+                if letter in "XYF" and letter not in position:
+                    position[letter] = float(word[1:])
+            if len(position) == 3:
+                break
+    return {"x": position.get("X"), "y": position.get("Y"), "feed": position.get("F")}
+
+
+def build_layer_index(revised_file_path):
+    '''
+    Scans a revised file once and records where every layer starts.
+    Layer n starts at the n-th layer change, layer 0 being the start of the program.
+    Returns:
+        A dict with the file size and, per layer, the byte offset and 1-based line number of
+        its layer change, the vertical axis and its cumulative position after the change, the
+        last X/Y/feed before it and the pressure/valve globals in effect.
+    '''
+    if is_compressed(revised_file_path):
+        raise ValueError("Layers can only be indexed in an uncompressed revised file")
+    layers = []
+    axis = None
+    height = 0.0
+    pressures = {}
+    valves = {}
+    line_number = 1
+    counted = 0
+    size = os.path.getsize(revised_file_path)
+    with open(revised_file_path, 'rb') as file:
+        if size == 0:
+            return {"version": LAYER_INDEX_VERSION, "size": 0, "axis": None, "layers": []}
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for match in _EVENT_RE.finditer(data):
+                start = match.start() + 1
+                line_number += data[counted:start].count(b"\n")
+                counted = start
+                if data[start] == ord("$"):
+                    kind, index, value = _GLOBAL_RE.match(_line_at(data, start)).groups()
+                    if kind == "r":
+                        pressures[index] = float(value)
+                    elif index != "0":
+                        valves[index] = int(value)
+                    continue
+
+                _, words, _ = tokenize_line(_line_at(data, match.end()))
+                moves = [word for word in words or () if word[0] in _VERTICAL_LETTERS]
+                if not moves or any(word[0] in "XY" for word in words):
+                    continue
+                axis = moves[0][0]
+                height += float(moves[0][1:])
+                layers.append({
+                    "layer": len(layers) + 1,
+                    "offset": start,
+                    "line": line_number,
+                    "height": round(height, 6),
+                    **_last_position(data, start),
+                    "pressures": dict(pressures),
+                    "valves": dict(valves),
+                })
+    return {"version": LAYER_INDEX_VERSION, "size": size, "axis": axis, "layers": layers}
+
+
+def write_layer_index(index, index_path):
+    with open(index_path, 'w') as file:
+        json.dump(index, file, indent=1)
+
+
+def load_layer_index(revised_file_path, index_path=None):
+    '''
+    Loads the layer index of a revised file, rebuilding it when it is missing or stale.
+    '''
+    index_path = index_path or layer_index_path_for(revised_file_path)
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as file:
+            index = json.load(file)
+        if index.get("version") == LAYER_INDEX_VERSION and index.get("size") == os.path.getsize(revised_file_path):
+            return index
+    index = build_layer_index(revised_file_path)
+    write_layer_index(index, index_path)
+    return index
+
+
+def resume_preamble(index, layer, start_height=0.0, clearance=RESUME_CLEARANCE):
+    '''
+    Returns the lines that bring the machine to the state before layer's layer change: running
+    flag, pressures and valves, then an absolute move over the part to the last XY position.
+    Args:
+        index: A layer index from build_layer_index() or load_layer_index().
+        layer: The layer to resume at, 1 for the first layer change.
+        start_height: Position of the vertical axis when the original program started, its
+            moves in the revised program are relative to that.
+        clearance: Height above the layer the nozzle travels at to the resume position.
+    '''
+    layers = index["layers"]
+    if not 1 <= layer <= len(layers):
+        raise ValueError(f"Layer must be between 1 and {len(layers)}")
+    entry = layers[layer - 1]
+    axis = index["axis"]
+    height = start_height + (layers[layer - 2]["height"] if layer > 1 else 0.0)
+
+    lines = ["G75\n", "$iglobal[0] = 1\n"]
+    lines += [f"$rglobal[{channel}] = {pressure:g}\n" for channel, pressure in sorted(entry["pressures"].items())]
+    lines += [f"$iglobal[{channel}] = {state}\n" for channel, state in sorted(entry["valves"].items())]
+    lines.append("G90\n")
+    lines.append(f"G0 {axis}{format_number(height + clearance)}\n")
+    if entry["x"] is not None and entry["y"] is not None:
+        lines.append(f"G0 X{format_number(entry['x'])} Y{format_number(entry['y'])}\n")
+    lines.append(f"G0 {axis}{format_number(height)}\n")
+    if entry["feed"] is not None:
+        lines.append(f"F{format_number(entry['feed'])}\n")
+    return lines
+
+
+def write_resume_file(revised_file_path, layer, output_path=None, start_height=0.0, clearance=RESUME_CLEARANCE):
+    '''
+    Writes a program that resumes a revised file at a layer: the synthesized preamble followed
+    by the revised file from that layer's byte offset, copied without parsing.
+    Returns the path of the resume program.
+    '''
+    index = load_layer_index(revised_file_path)
+    preamble = resume_preamble(index, layer, start_height, clearance)
+    offset = index["layers"][layer - 1]["offset"]
+    output_path = output_path or derived_path(revised_file_path, f"_from_layer_{layer}")
+    check_output_path(revised_file_path, output_path)
+    with open(revised_file_path, 'rb') as source, open(output_path, 'wb') as target:
+        target.write("".join(preamble).encode())
+        source.seek(offset)
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the layers of a revised job or resume it at a layer.")
+    parser.add_argument("revised_file", help="revised .gcode file")
+    parser.add_argument("--layer", type=int, help="write a program resuming at this layer")
+    parser.add_argument("-o", "--output", help="resume program path (default: <name>_from_layer_<N>.gcode)")
+    parser.add_argument("--start-height", type=float, default=0.0,
+                        help="vertical axis position the original program started at")
+    args = parser.parse_args()
+    start_time = time.perf_counter()
+    if args.layer is None:
+        index = build_layer_index(args.revised_file)
+        write_layer_index(index, layer_index_path_for(args.revised_file))
+        print(f"Indexed {len(index['layers'])} layers in {time.perf_counter() - start_time:.3f} s")
+    else:
+        output_path = write_resume_file(args.revised_file, args.layer, args.output, args.start_height)
+        print(f"Resume program saved to: {output_path} ({time.perf_counter() - start_time:.3f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import argparse
+import csv
+import json
+import time
+
+import numpy as np
+
+from toolpath_analysis import DEFAULT_FEED, analyze_toolpath, arc_geometry, load_toolpath, segment_points
+from toolpath_format import OPCODE_ARC_CCW, OPCODE_ARC_CW
+
+MOTION_PROFILE_VERSION = 1
+# Starting values until a profile is calibrated against real runs
+ACCELERATION = 1000.0  # mm/s^2
+JERK = None  # mm/s^3, None for a trapezoidal profile
+JUNCTION_DEVIATION = 0.01  # mm, how far a blended corner may cut the programmed corner
+MIN_SEGMENT_TIME = 0.001  # s, block processing floor per motion command
+# Candidates searched by calibrate_motion_profile()
+CALIBRATION_ACCELERATIONS = np.geomspace(100.0, 20000.0, 16)
+CALIBRATION_SEGMENT_TIMES = (0.0, 0.0005, 0.001, 0.002, 0.004)
+
+
+class MotionProfile:
+    '''
+    Machine dynamics used by the simulation.
+    Args:
+        acceleration: Acceleration limit in mm/s^2, also bounds the centripetal acceleration on arcs.
+        jerk: Jerk limit in mm/s^3 for an S-curve profile, None for trapezoidal.
+        junction_deviation: Corner blending tolerance in mm, the speed through a corner is the one
+            whose centripetal acceleration on a circle cutting the corner by this much equals
+            acceleration. Larger values blend faster.
+        blending: False stops at the end of every motion command (velocity blending off).
+        min_segment_time: Shortest time in s the controller spends on one motion command.
+    '''
+
+    def __init__(self, acceleration=ACCELERATION, jerk=JERK, junction_deviation=JUNCTION_DEVIATION,
+                 blending=True, min_segment_time=MIN_SEGMENT_TIME):
+        self.acceleration = acceleration
+        self.jerk = jerk
+        self.junction_deviation = junction_deviation
+        self.blending = blending
+        self.min_segment_time = min_segment_time
+
+    def to_dict(self):
+        return {"version": MOTION_PROFILE_VERSION, "acceleration": self.acceleration, "jerk": self.jerk,
+                "junction_deviation": self.junction_deviation, "blending": self.blending,
+                "min_segment_time": self.min_segment_time}
+
+
+def save_motion_profile(profile, file_path):
+    with open(file_path, 'w') as file:
+        json.dump(profile.to_dict(), file, indent=1)
+
+
+def load_motion_profile(file_path):
+    with open(file_path, 'r') as file:
+        values = json.load(file)
+    if values.pop("version", None) != MOTION_PROFILE_VERSION:
+        raise ValueError(f"{file_path} is not a version {MOTION_PROFILE_VERSION} motion profile")
+    return MotionProfile(**values)
+
+
+def _segment_directions(toolpath, starts, ends, lengths):
+    '''
+    Returns (entry, exit), the unit direction of every segment at its start and end point.
+    Lines have the same direction at both ends, arcs are tangent to the circle in XY.
+    '''
+    delta = ends - starts
+    entry = np.divide(delta, lengths[:, None], out=np.zeros_like(delta), where=lengths[:, None] > 0)
+    exit = entry.copy()
+    opcode = toolpath['opcode']
+    arcs = (opcode == OPCODE_ARC_CW) | (opcode == OPCODE_ARC_CCW)
+    if arcs.any():
+        center, radius, _, sweep = arc_geometry(toolpath, starts, ends, arcs)
+        # XY tangent is the radius turned by 90 degrees in the arc's direction
+        sign = np.sign(sweep)[:, None]
+        for direction, points in ((entry, starts), (exit, ends)):
+            radial = points[arcs, :2] - center
+            tangent = sign * np.column_stack([-radial[:, 1], radial[:, 0]])
+            # The other axes move linearly along the arc
+            arc_length = radius * np.abs(sweep)
+            tangent *= np.divide(arc_length, radius, out=np.zeros_like(radius), where=radius > 0)[:, None]
+            vector = np.column_stack([tangent, delta[arcs, 2:]])
+            norm = np.sqrt(np.einsum('ij,ij->i', vector, vector))
+            direction[arcs] = np.divide(vector, norm[:, None], out=np.zeros_like(vector), where=norm[:, None] > 0)
+    return entry, exit
+
+
+def _phase_time(speed_change, acceleration, jerk):
+    '''
+    Time to change speed by speed_change, with a jerk limit the acceleration ramps up and down.
+    '''
+    if jerk is None:
+        return speed_change / acceleration
+    full_ramp = acceleration ** 2 / jerk
+    return np.where(speed_change >= full_ramp, speed_change / acceleration + acceleration / jerk,
+                    2 * np.sqrt(speed_change / jerk))
+
+
+def simulate_toolpath(source, profile=None, default_feed=DEFAULT_FEED):
+    '''
+    Replays a toolpath with acceleration-limited motion. The speed at every junction is capped
+    by corner blending and by both segments' feeds, then forward and backward passes limit it
+    to what the acceleration allows over the path before and after. Both passes are prefix
+    minima over the cumulative path length, so everything is vectorized over segments.
+    Every segment then follows a trapezoidal (or S-curve) profile between its junction speeds.
+    Args:
+        source: A .toolpath file, a revised .gcode file or a toolpath array.
+        profile: A MotionProfile, defaults to MotionProfile().
+        default_feed: Feed in mm/min for moves issued before any F word.
+    Returns:
+        A dict with the total time (s), per-layer time and peak speed (mm/s) indexed by layer,
+        the overall peak speed, the share of segments that never reach their feed and the
+        number of junctions the motion comes to a stop at.
+    '''
+    profile = profile or MotionProfile()
+    acceleration = profile.acceleration
+    toolpath = load_toolpath(source)
+    starts, ends = segment_points(toolpath)
+    delta = ends - starts
+    lengths = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+    feed = toolpath['feed'].astype(np.float64)
+    cruise = np.where(feed > 0, feed, default_feed) / 60.0  # mm/s
+
+    opcode = toolpath['opcode']
+    arcs = (opcode == OPCODE_ARC_CW) | (opcode == OPCODE_ARC_CCW)
+    if arcs.any():
+        _, radius, _, sweep = arc_geometry(toolpath, starts, ends, arcs)
+        other = delta[arcs, 2:]
+        lengths[arcs] = np.hypot(radius * np.abs(sweep), np.sqrt(np.einsum('ij,ij->i', other, other)))
+        cruise[arcs] = np.minimum(cruise[arcs], np.sqrt(acceleration * radius))
+
+    # Zero-length commands take the block time only and do not break blending
+    moving = lengths > 0
+    length = lengths[moving]
+    speed = cruise[moving]
+    entry, exit = _segment_directions(toolpath, starts, ends, lengths)
+    entry, exit = entry[moving], exit[moving]
+
+    # Junction speed caps, junction k lies between moving segments k - 1 and k
+    caps = np.zeros(len(length) + 1)
+    if profile.blending and len(length) > 1:
+        cos_theta = np.clip(-np.einsum('ij,ij->i', exit[:-1], entry[1:]), -1.0, 1.0)
+        sin_half = np.sqrt(0.5 * (1.0 - cos_theta))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corner = np.sqrt(acceleration * profile.junction_deviation * sin_half / (1.0 - sin_half))
+        corner[sin_half >= 1.0] = np.inf  # Straight continuation
+        caps[1:-1] = np.minimum(corner, np.minimum(speed[:-1], speed[1:]))
+
+    distance = np.concatenate(([0.0], np.cumsum(length)))
+    squared = caps ** 2
+    forward = 2 * acceleration * distance + np.minimum.accumulate(squared - 2 * acceleration * distance)
+    backward = np.minimum.accumulate((squared + 2 * acceleration * distance)[::-1])[::-1] - 2 * acceleration * distance
+    junction = np.sqrt(np.maximum(np.minimum(forward, backward), 0.0))
+    v_in, v_out = junction[:-1], junction[1:]
+
+    # Highest speed reached, limited by the feed and by accelerating and decelerating in the segment
+    peak = np.minimum(speed, np.sqrt(acceleration * length + 0.5 * (v_in ** 2 + v_out ** 2)))
+    peak = np.maximum(peak, np.maximum(v_in, v_out))
+    accelerate = _phase_time(peak - v_in, acceleration, profile.jerk)
+    decelerate = _phase_time(peak - v_out, acceleration, profile.jerk)
+    ramp_length = 0.5 * (v_in + peak) * accelerate + 0.5 * (v_out + peak) * decelerate
+    ramps = accelerate + decelerate
+    # An S-curve ramp covers more distance than the trapezoid it replaces, shorten it to fit
+    too_long = ramp_length > length
+    ramps[too_long] *= np.sqrt(length[too_long] / ramp_length[too_long])
+    times = np.full(len(toolpath), float(profile.min_segment_time))
+    times[moving] = np.maximum(ramps + np.maximum(length - ramp_length, 0.0) / peak, profile.min_segment_time)
+
+    peaks = np.zeros(len(toolpath))
+    peaks[moving] = peak
+    layer = toolpath['layer']
+    layer_count = int(layer.max()) + 1 if len(layer) else 0
+    layer_peak = np.zeros(layer_count)
+    np.maximum.at(layer_peak, layer, peaks)
+    return {
+        "segments": len(toolpath),
+        "total_time": float(times.sum()),
+        "layer_time": np.bincount(layer, weights=times, minlength=layer_count),
+        "layer_peak_speed": layer_peak,
+        "peak_speed": float(peaks.max()) if len(peaks) else 0.0,
+        "below_feed": float(np.mean(peak < speed - 1e-9)) if len(peak) else 0.0,
+        "stops": int(np.count_nonzero(junction[1:-1] <= 1e-9)),
+    }
+
+
+def load_layer_times(file_path):
+    '''
+    Reads measured layer durations of a real run from a "layer,seconds" CSV file.
+    Returns {layer: seconds}.
+    '''
+    layer_times = {}
+    with open(file_path, 'r', newline='') as file:
+        for row in csv.reader(file):
+            if not row or not row[0].strip().isdigit():
+                continue  # Comments and the header row
+            layer_times[int(row[0])] = float(row[1])
+    return layer_times
+
+
+def calibrate_motion_profile(source, layer_times, profile=None, accelerations=CALIBRATION_ACCELERATIONS,
+                             segment_times=CALIBRATION_SEGMENT_TIMES):
+    '''
+    Fits the acceleration and block time of a profile to the layer durations of a real run by
+    searching the candidates for the smallest relative RMS error over the measured layers.
+    Returns (calibrated MotionProfile, relative RMS error).
+    '''
+    profile = profile or MotionProfile()
+    toolpath = load_toolpath(source)
+    layers = np.array(sorted(layer_times))
+    measured = np.array([layer_times[layer] for layer in layers])
+    best = None
+    for acceleration in accelerations:
+        for segment_time in segment_times:
+            candidate = MotionProfile(acceleration, profile.jerk, profile.junction_deviation, profile.blending,
+                                      segment_time)
+            predicted = simulate_toolpath(toolpath, candidate)["layer_time"]
+            predicted = np.append(predicted, np.zeros(max(0, layers.max() + 1 - len(predicted))))[layers]
+            error = float(np.sqrt(np.mean(((predicted - measured) / measured) ** 2)))
+            if best is None or error < best[1]:
+                best = (candidate, error)
+    return best
+
+
+def print_simulation(simulation, feed_only_time=None):
+    total_time = simulation['total_time']
+    print(f"Simulated time: {total_time:.1f} s ({total_time / 3600:.2f} h) over {len(simulation['layer_time'])} layers")
+    if feed_only_time:
+        print(f"Feedrate-only estimate: {feed_only_time:.1f} s, simulated {total_time / feed_only_time:.2f}x longer")
+    print(f"Peak speed: {simulation['peak_speed']:.1f} mm/s, "
+          f"{100 * simulation['below_feed']:.1f} % of moves never reach their feed, "
+          f"{simulation['stops']} stops between moves")
+    slowest = np.argsort(simulation['layer_time'])[::-1][:5]
+    for layer in sorted(slowest):
+        print(f"Layer {layer}: {simulation['layer_time'][layer]:.2f} s, "
+              f"peak {simulation['layer_peak_speed'][layer]:.1f} mm/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the motion of a revised job to estimate its duration.")
+    parser.add_argument("source", help="revised .gcode file or .toolpath file")
+    parser.add_argument("--profile", help="motion profile (JSON), written by --calibrate")
+    parser.add_argument("--acceleration", type=float, help=f"acceleration in mm/s^2 (default {ACCELERATION})")
+    parser.add_argument("--jerk", type=float, help="jerk in mm/s^3 for an S-curve profile")
+    parser.add_argument("--junction-deviation", type=float, help=f"corner blending in mm (default {JUNCTION_DEVIATION})")
+    parser.add_argument("--no-blending", action="store_true", help="stop at the end of every move")
+    parser.add_argument("--calibrate", metavar="LAYER_TIMES",
+                        help="fit the profile to a layer,seconds CSV of a real run and save it to --profile")
+    args = parser.parse_args()
+    profile = load_motion_profile(args.profile) if args.profile and not args.calibrate else MotionProfile()
+    if args.acceleration is not None:
+        profile.acceleration = args.acceleration
+    if args.jerk is not None:
+        profile.jerk = args.jerk
+    if args.junction_deviation is not None:
+        profile.junction_deviation = args.junction_deviation
+    if args.no_blending:
+        profile.blending = False
+
+    toolpath = load_toolpath(args.source)
+    if args.calibrate:
+        if not args.profile:
+            parser.error("--calibrate needs --profile to save the result to")
+        profile, error = calibrate_motion_profile(toolpath, load_layer_times(args.calibrate), profile)
+        save_motion_profile(profile, args.profile)
+        print(f"Calibrated acceleration {profile.acceleration:.0f} mm/s^2, block time "
+              f"{profile.min_segment_time * 1000:g} ms (RMS error {100 * error:.1f} %), saved to: {args.profile}")
+
+    start_time = time.perf_counter()
+    simulation = simulate_toolpath(toolpath, profile)
+    elapsed = time.perf_counter() - start_time
+    print_simulation(simulation, analyze_toolpath(toolpath)["total_time"])
+    print(f"Simulated {simulation['segments']} segments in {elapsed:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
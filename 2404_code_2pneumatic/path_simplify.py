@@ -0,0 +1,157 @@
+import numpy as np
+
+from gcode_lexer import command_key, tokenize_line
+
+# Deviation (mm) below which points are treated as collinear
+COLLINEAR_TOLERANCE = 1e-6
+# Longest run of moves buffered before it is processed, bounds memory on huge single paths
+MAX_RUN_LENGTH = 10000
+
+_RUN_COMMANDS = ("G1", "G01")
+_RUN_LETTERS = frozenset("XYE")
+# Commands whose X/Y words move or set the position (None is a modal move without G word)
+_POSITION_COMMANDS = ("G0", "G1", "G2", "G3", "G92", None)
+
+
+def iter_move_runs(lines):
+    '''
+    Groups slicer lines into runs of plain XY linear moves that can be replaced without
+    changing anything but the geometry. A run never crosses a change of extrusion state
+    (E word present or not), a layer change, a feed change or any other command, and
+    only starts once the absolute XY position is known.
+    Yields:
+        (start, run) tuples. start is the (x, y) position before the run and run a list of
+        (line, x, y) tuples, or (None, [line]) for a line that is passed through as is.
+    '''
+    x = y = None
+    relative = False
+    start = None
+    run = []
+    run_extruding = False
+
+    for line in lines:
+        code, words, comment = tokenize_line(line)
+        if (words and not comment and words[0] in _RUN_COMMANDS and not relative
+                and x is not None and y is not None
+                and all(word[0] in _RUN_LETTERS for word in words[1:])):
+            new_x, new_y = x, y
+            extruding = has_xy = False
+            for word in words[1:]:
+                letter = word[0]
+                if letter == "X":
+                    new_x = float(word[1:])
+                    has_xy = True
+                elif letter == "Y":
+                    new_y = float(word[1:])
+                    has_xy = True
+                else:
+                    extruding = True
+            if has_xy:
+                if run and (extruding != run_extruding or len(run) >= MAX_RUN_LENGTH):
+                    yield start, run
+                    run = []
+                if not run:
+                    start = (x, y)
+                    run_extruding = extruding
+                run.append((line, new_x, new_y))
+                x, y = new_x, new_y
+                continue
+
+        if run:
+            yield start, run
+            run = []
+        yield None, [line]
+        if not words:
+            continue
+
+        # Track the modal position through every other line
+        key = command_key(words)
+        if key == "G90" or key == "G91":
+            relative = key == "G91"
+        elif key == "G28":
+            x = y = None
+        elif key in _POSITION_COMMANDS:
+            incremental = relative and key != "G92"
+            for word in words:
+                if word[0] == "X":
+                    x = float(word[1:]) + (x or 0.0) if incremental else float(word[1:])
+                elif word[0] == "Y":
+                    y = float(word[1:]) + (y or 0.0) if incremental else float(word[1:])
+
+    if run:
+        yield start, run
+
+
+def segment_distances(points, start, end):
+    '''
+    Distance of every point to the segment from start to end, vectorized over the points.
+    '''
+    chord = end - start
+    chord_length = chord @ chord
+    offsets = points - start
+    if chord_length == 0:
+        return np.sqrt(np.einsum('ij,ij->i', offsets, offsets))
+    t = np.clip(offsets @ chord / chord_length, 0.0, 1.0)
+    deviation = offsets - np.outer(t, chord)
+    return np.sqrt(np.einsum('ij,ij->i', deviation, deviation))
+
+
+def douglas_peucker(points, tolerance):
+    '''
+    Returns a mask of the points kept by Douglas-Peucker simplification within tolerance.
+    The end points are always kept. Distances are measured to the chord segment rather than
+    the infinite line, so moves that reverse along the same line are never merged away.
+    '''
+    count = len(points)
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = segment_distances(points[first + 1:last], points[first], points[last])
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def simplify_gcode_lines(lines, tolerance=0.0, stats=None):
+    '''
+    Merges collinear G1 moves and simplifies runs of moves with Douglas-Peucker.
+    Only whole lines are dropped, the kept lines are written unchanged.
+    Args:
+        lines: Iterable of filtered slicer lines (before the E words are removed).
+        tolerance: Largest allowed deviation from the original path in mm, 0 merges
+            collinear moves only.
+        stats: Optional dict, "segments_in" and "segments_out" count the moves in runs and
+            "run_length" adds up their path length in mm.
+    '''
+    tolerance = max(tolerance, COLLINEAR_TOLERANCE)
+    segments_in = segments_out = 0
+    run_length = 0.0
+    for start, run in iter_move_runs(lines):
+        if start is None:
+            yield from run
+            continue
+        segments_in += len(run)
+        points = np.array([start] + [(x, y) for _, x, y in run])
+        run_length += float(np.hypot(*np.diff(points, axis=0).T).sum())
+        if len(run) == 1:
+            segments_out += 1
+            yield run[0][0]
+            continue
+        keep = douglas_peucker(points, tolerance)[1:]
+        segments_out += int(keep.sum())
+        for (line, _, _), kept in zip(run, keep):
+            if kept:
+                yield line
+
+    if stats is not None:
+        stats["segments_in"] = stats.get("segments_in", 0) + segments_in
+        stats["segments_out"] = stats.get("segments_out", 0) + segments_out
+        stats["run_length"] = stats.get("run_length", 0.0) + run_length
@@ -0,0 +1,196 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from toolpath_analysis import DEFAULT_FEED, arc_geometry, load_toolpath, segment_points
+from toolpath_format import AXES, OPCODE_ARC_CCW, OPCODE_ARC_CW
+
+LIMITS_PROFILE_VERSION = 1
+# Offending lines printed per axis and check, the report holds all of them
+MAX_PRINTED_LINES = 20
+# Slack (mm, mm/s) for float32 positions and feeds rounded in the revised file
+TOLERANCE = 1e-3
+# Angles at which an XY arc reaches its extreme X or Y
+_QUADRANT_ANGLES = np.array([0.0, 0.5, 1.0, 1.5]) * np.pi
+
+
+def read_axis_limits(controller, axes):
+    '''
+    Reads the soft limits and maximum speed of each axis from the controller, once, so the
+    check itself does not talk to the controller. Disabled soft limits and a zero speed clamp
+    are stored as None (not checked).
+    Args:
+        controller: A connected automation1 Controller.
+        axes: Axis names, e.g. ['X', 'Y', 'C'].
+    Returns:
+        A limits profile, {axis: {"min": mm, "max": mm, "max_speed": mm/s}}.
+    '''
+    import automation1 as a1
+
+    limits = {}
+    for axis in axes:
+        parameters = controller.runtime.parameters.axes[axis]
+        enabled = int(parameters[a1.AxisParameterId.SoftwareLimitSetup].value) != 0
+        low = parameters[a1.AxisParameterId.SoftwareLimitLow].value
+        high = parameters[a1.AxisParameterId.SoftwareLimitHigh].value
+        max_speed = parameters[a1.AxisParameterId.MaxSpeedClamp].value
+        limits[axis] = {
+            "min": float(low) if enabled else None,
+            "max": float(high) if enabled else None,
+            "max_speed": float(max_speed) if max_speed > 0 else None,
+        }
+    return limits
+
+
+def save_limits_profile(limits, file_path):
+    with open(file_path, 'w') as file:
+        json.dump({"version": LIMITS_PROFILE_VERSION, "axes": limits}, file, indent=1)
+
+
+def load_limits_profile(file_path):
+    with open(file_path, 'r') as file:
+        profile = json.load(file)
+    if profile.get("version") != LIMITS_PROFILE_VERSION:
+        raise ValueError(f"{file_path} has unsupported limits profile version {profile.get('version')}")
+    return profile["axes"]
+
+
+def _arc_extents(starts, ends, center, radius, start_angle, sweep):
+    '''
+    Returns (low, high), two (m, 2) arrays with the XY bounding box of every arc, which can
+    reach past both end points. The arguments are those of the arc segments only.
+    '''
+    # Angle travelled from the start to each quadrant angle, in the arc's direction
+    offset = _QUADRANT_ANGLES[None, :] - start_angle[:, None]
+    travelled = np.where(sweep[:, None] < 0, np.mod(-offset, 2 * np.pi), np.mod(offset, 2 * np.pi))
+    reached = travelled <= np.abs(sweep)[:, None]
+    # Quadrant angles 0 and pi are the X extremes, pi/2 and 3pi/2 the Y extremes
+    x_max = np.where(reached[:, 0], center[:, 0] + radius, -np.inf)
+    y_max = np.where(reached[:, 1], center[:, 1] + radius, -np.inf)
+    x_min = np.where(reached[:, 2], center[:, 0] - radius, np.inf)
+    y_min = np.where(reached[:, 3], center[:, 1] - radius, np.inf)
+    low = np.minimum(np.minimum(starts, ends), np.column_stack([x_min, y_min]))
+    high = np.maximum(np.maximum(starts, ends), np.column_stack([x_max, y_max]))
+    return low, high
+
+
+def check_toolpath(source, limits, origin=None, default_feed=DEFAULT_FEED, tolerance=TOLERANCE):
+    '''
+    Checks every segment of a toolpath against per-axis soft limits and maximum speeds.
+    Positions are checked along the whole segment (the bounding box of arcs), speeds are the
+    commanded feed split onto each axis by the segment's direction, which bounds the speed an
+    axis reaches while following the path.
+    Args:
+        source: A .toolpath file, a revised .gcode file or a toolpath array.
+        limits: {axis: {"min", "max", "max_speed"}} from read_axis_limits() or
+            load_limits_profile(), None values are not checked.
+        origin: Optional {axis: mm}, the machine position of program zero. The vertical axis
+            moves relatively in a revised program, its origin is the height it starts at.
+        default_feed: Feed in mm/min for moves issued before any F word.
+    Returns:
+        A dict with the number of segments checked and, per check ("position", "velocity") and
+        axis, the line numbers of the revised file that violate the limit, in increasing order.
+    '''
+    toolpath = load_toolpath(source)
+    origin = {axis.lower(): value for axis, value in (origin or {}).items()}
+    starts, ends = segment_points(toolpath)
+    line = toolpath['line']
+    axes = [axis for axis in limits if axis.lower() in AXES]
+    report = {"segments": len(toolpath), "position": {}, "velocity": {}}
+    if not len(toolpath):
+        return report
+
+    # Travel of each axis over each segment
+    travel = np.abs(ends - starts)
+    lengths = np.sqrt(np.einsum('ij,ij->i', travel, travel))
+    low = np.minimum(starts, ends)
+    high = np.maximum(starts, ends)
+    opcode = toolpath['opcode']
+    arcs = (opcode == OPCODE_ARC_CW) | (opcode == OPCODE_ARC_CCW)
+    if arcs.any():
+        center, radius, start_angle, sweep = arc_geometry(toolpath, starts, ends, arcs)
+        low[arcs, :2], high[arcs, :2] = _arc_extents(starts[arcs, :2], ends[arcs, :2], center, radius,
+                                                     start_angle, sweep)
+        # X and Y each move at up to the full XY speed somewhere along an arc
+        arc_length = radius * np.abs(sweep)
+        other = travel[arcs, 2:]
+        lengths[arcs] = np.hypot(arc_length, np.sqrt(np.einsum('ij,ij->i', other, other)))
+        travel[arcs, 0] = travel[arcs, 1] = arc_length
+    feed = toolpath['feed'].astype(np.float64)
+    feed = np.where(feed > 0, feed, default_feed) / 60.0  # mm/s
+    speed_per_length = np.divide(feed, lengths, out=np.zeros_like(feed), where=lengths > 0)
+
+    for axis in axes:
+        column = AXES.index(axis.lower())
+        axis_limits = limits[axis]
+        offset = origin.get(axis.lower(), 0.0)
+        outside = np.zeros(len(toolpath), dtype=bool)
+        if axis_limits.get("min") is not None:
+            outside |= low[:, column] + offset < axis_limits["min"] - tolerance
+        if axis_limits.get("max") is not None:
+            outside |= high[:, column] + offset > axis_limits["max"] + tolerance
+        if outside.any():
+            report["position"][axis] = line[outside]
+        if axis_limits.get("max_speed") is not None:
+            too_fast = travel[:, column] * speed_per_length > axis_limits["max_speed"] + tolerance
+            if too_fast.any():
+                report["velocity"][axis] = line[too_fast]
+    return report
+
+
+def print_report(report, max_lines=MAX_PRINTED_LINES):
+    '''
+    Prints the violations of a check_toolpath() report. Returns True if there were none.
+    '''
+    passed = True
+    for check, description in (("position", "outside the soft limits"), ("velocity", "above the maximum speed")):
+        for axis, lines in report[check].items():
+            passed = False
+            shown = ", ".join(str(line) for line in lines[:max_lines])
+            more = f" and {len(lines) - max_lines} more" if len(lines) > max_lines else ""
+            print(f"{axis} {description} on {len(lines)} lines: {shown}{more}")
+    if passed:
+        print(f"All {report['segments']} segments within limits")
+    return passed
+
+
+def _parse_origin(text):
+    origin = {}
+    for item in text.split(","):
+        axis, _, value = item.partition("=")
+        origin[axis.strip().upper()] = float(value)
+    return origin
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check a revised job against the soft limits and maximum speeds.")
+    parser.add_argument("source", nargs="?", help="revised .gcode file or .toolpath file")
+    parser.add_argument("--profile", required=True,
+                        help="limits profile (JSON), written from the controller with --save-profile")
+    parser.add_argument("--save-profile", nargs="+", metavar="AXIS",
+                        help="read the limits of these axes from the controller into --profile first")
+    parser.add_argument("--origin", type=_parse_origin, metavar="AXIS=MM,...",
+                        help="machine position of program zero, e.g. X=100,Y=50,C=-20")
+    args = parser.parse_args()
+    if args.save_profile:
+        import automation1 as a1
+
+        controller = a1.Controller.connect()
+        save_limits_profile(read_axis_limits(controller, args.save_profile), args.profile)
+        controller.disconnect()
+        print(f"Limits of {', '.join(args.save_profile)} saved to: {args.profile}")
+    if args.source is None:
+        return
+    toolpath = load_toolpath(args.source)
+    start_time = time.perf_counter()
+    report = check_toolpath(toolpath, load_limits_profile(args.profile), args.origin)
+    passed = print_report(report)
+    print(f"Checked in {time.perf_counter() - start_time:.3f} s")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import csv
+import time
+
+from gcode_lexer import command_key, tokenize_line
+from pressure_protocol import VALUE_DIGITS
+
+# Controller globals shared by the revised program and the host. $iglobal[0] stays the
+# "program running" flag, $rglobal[n] is the pressure setpoint (psi) and $iglobal[n] the valve
+# state (1 open, 0 closed) of pneumatic channel n.
+RUNNING_GLOBAL = 0
+CHANNELS = (1, 2)
+# Written by the host before a run so that stale values from an earlier program are not events
+UNSET = -1
+# Seconds between two reads of the globals, bounds host CPU use and event latency
+POLL_INTERVAL = 0.02
+# Task states (automation1 TaskState names) of a program that has not ended yet
+ACTIVE_TASK_STATES = ("ProgramReady", "ProgramRunning", "ProgramPaused", "ProgramFeedhold")
+
+
+def pressure_line(channel, pressure):
+    return f"$rglobal[{channel}] = {pressure:g}\n"
+
+
+def valve_line(channel, is_open):
+    return f"$iglobal[{channel}] = {int(is_open)}\n"
+
+
+class PressureSchedule:
+    '''
+    Pressure and valve events to embed in a revised program.
+    Args:
+        layer_pressures: {layer: {channel: psi}}, layer 0 being the start of the program and
+            layer n the n-th layer change. A value holds until it is changed again.
+        valve_events: Open a channel's valve before its first deposition move and close it
+            before the next travel move or tool change.
+    '''
+
+    def __init__(self, layer_pressures=None, valve_events=True):
+        self.layer_pressures = layer_pressures or {}
+        self.valve_events = valve_events
+
+
+def load_pressure_schedule(file_path, valve_events=True):
+    '''
+    Reads a pressure schedule from a CSV file with "layer,channel,pressure" rows.
+    '''
+    layer_pressures = {}
+    with open(file_path, 'r', newline='') as file:
+        for row in csv.reader(file):
+            if not row or row[0].strip().startswith("#") or not row[0].strip().isdigit():
+                continue  # Comments and the header row
+            layer, channel, pressure = int(row[0]), int(row[1]), float(row[2])
+            if channel not in CHANNELS:
+                raise ValueError(f"Channel {channel} in {file_path} must be one of {CHANNELS}")
+            if pressure < 0 or pressure > 100:
+                raise ValueError(f"Pressure {pressure} in {file_path} out of range, must be 0 to 100 PSI")
+            layer_pressures.setdefault(layer, {})[channel] = pressure
+    return PressureSchedule(layer_pressures, valve_events)
+
+
+def annotate_pressure_events(lines, schedule, stats=None):
+    '''
+    Inserts $rglobal/$iglobal writes for the schedule's pressure and valve events into filtered
+    slicer lines (before the E and T words are removed). Only changes are written.
+    Layer changes are pure Z moves, extrusion is detected from the E words like in the toolpath.
+    Tool Tn selects channel n + 1, ValueError for a tool whose channel is not in CHANNELS, the
+    listener would never see its valve events.
+    Args:
+        lines: Iterable of filtered slicer lines.
+        schedule: A PressureSchedule.
+        stats: Optional dict, "pressure_events" and "valve_events" count the writes inserted.
+    '''
+    pressures = {}
+    open_channel = None
+    channel = 1
+    relative_e = False
+    last_e = 0.0
+    extruding = False
+    layer = 0
+    pressure_count = valve_count = 0
+
+    def layer_events(layer):
+        nonlocal pressure_count
+        for event_channel, pressure in sorted(schedule.layer_pressures.get(layer, {}).items()):
+            if pressures.get(event_channel) != pressure:
+                pressures[event_channel] = pressure
+                pressure_count += 1
+                yield pressure_line(event_channel, pressure)
+
+    if schedule.valve_events:
+        for event_channel in CHANNELS:
+            valve_count += 1
+            yield valve_line(event_channel, False)
+    yield from layer_events(0)
+
+    for line in lines:
+        _, words, _ = tokenize_line(line)
+        key = command_key(words) if words else None
+        if key is None:
+            yield line
+            continue
+        letters = {word[0] for word in words[1:]}
+
+        if key in ("M82", "M83"):
+            relative_e = key == "M83"
+        elif key[0] == "T":
+            channel = int(float(key[1:])) + 1
+            if schedule.valve_events and channel not in CHANNELS:
+                raise ValueError(f"Tool {key} selects channel {channel}, valve events need one of {CHANNELS}")
+        elif key == "G92":
+            for word in words:
+                if word[0] == "E":
+                    last_e = float(word[1:])
+        elif key in ("G0", "G1", "G2", "G3"):
+            extruding = False
+            for word in words:
+                if word[0] == "E":
+                    value = float(word[1:])
+                    delta = value if relative_e else value - last_e
+                    last_e = last_e + value if relative_e else value
+                    extruding = delta > 0 and key != "G0"
+            if "Z" in letters and not letters & {"X", "Y"}:
+                layer += 1
+                yield from layer_events(layer)
+            if schedule.valve_events and letters & {"X", "Y", "Z"}:
+                wanted = channel if extruding else None
+                if wanted != open_channel:
+                    if open_channel is not None:
+                        valve_count += 1
+                        yield valve_line(open_channel, False)
+                    if wanted is not None:
+                        valve_count += 1
+                        yield valve_line(wanted, True)
+                    open_channel = wanted
+        yield line
+
+    if open_channel is not None:
+        valve_count += 1
+        yield valve_line(open_channel, False)
+
+    if stats is not None:
+        stats["pressure_events"] = pressure_count
+        stats["valve_events"] = valve_count
+
+
+class PressureEventListener:
+    '''
+    Host side of the pressure schedule. Polls the controller globals at a fixed interval and
+    only talks to the pressure box when a value changed, so host CPU and serial traffic follow
+    the number of events instead of the loop rate. Events shorter than the poll interval may
+    be merged or missed, the final state is always applied.
+    Args:
+        controller: A connected automation1 Controller.
+        set_pressure: Function (channel, psi) sending a setpoint to the pressure box.
+        set_valve: Function (channel, is_open) opening or closing a valve.
+        host_pressures: Optional function returning the setpoints entered on the host (one per
+            channel), a change there is sent like a program event.
+        poll_interval: Seconds between two reads of the globals.
+        set_pressures: Optional function ({channel: psi}) sending the setpoints that changed in
+            one poll as one command, used instead of set_pressure.
+        task: The controller task running the program.
+        program_events: Forward the pressure and valve globals of the program. False for
+            programs without embedded events, which may use those globals for other things.
+    '''
+
+    def __init__(self, controller, set_pressure, set_valve, host_pressures=None, channels=CHANNELS,
+                 poll_interval=POLL_INTERVAL, set_pressures=None, task=1, program_events=True):
+        self.controller = controller
+        self.task = task
+        self.program_events = program_events
+        self.set_pressure = set_pressure
+        self.set_pressures = set_pressures
+        self.set_valve = set_valve
+        self.host_pressures = host_pressures
+        self.channels = channels
+        self.poll_interval = poll_interval
+        self.stats = {"polls": 0, "events": 0, "commands": 0}
+        self._program_pressures = {}
+        self._program_valves = {}
+        self._host_pressures = {}
+        self._sent_pressures = {}
+
+    def reset(self):
+        '''
+        Marks the schedule globals as unset and sets the running flag from the host. Call before
+        starting a program with embedded events (see annotate_pressure_events()), other
+        programs may use these globals themselves.
+        '''
+        variables = self.controller.runtime.variables.global_
+        variables.set_integer(RUNNING_GLOBAL, 1)
+        for channel in self.channels:
+            variables.set_real(channel, UNSET)
+            variables.set_integer(channel, UNSET)
+            self._program_pressures[channel] = UNSET
+            self._program_valves[channel] = UNSET
+
+    def _send_pressure(self, channel, pressure, changes):
+        pressure = round(pressure, VALUE_DIGITS)
+        if self._sent_pressures.get(channel) != pressure:
+            self._sent_pressures[channel] = pressure
+            changes[channel] = pressure
+
+    def poll(self):
+        '''
+        Reads the globals once and forwards every change. Returns the program running flag.
+        '''
+        variables = self.controller.runtime.variables.global_
+        self.stats["polls"] += 1
+        changes = {}
+        valves = {}
+        for channel in self.channels if self.program_events else ():
+            pressure = variables.get_real(channel)
+            if pressure != self._program_pressures.get(channel):
+                self._program_pressures[channel] = pressure
+                if pressure != UNSET:
+                    self.stats["events"] += 1
+                    self._send_pressure(channel, pressure, changes)
+            valve = variables.get_integer(channel)
+            if valve != self._program_valves.get(channel):
+                self._program_valves[channel] = valve
+                if valve != UNSET:
+                    self.stats["events"] += 1
+                    valves[channel] = bool(valve)
+
+        if self.host_pressures is not None:
+            for channel, pressure in zip(self.channels, self.host_pressures()):
+                if pressure != self._host_pressures.get(channel):
+                    # set_pressure may update the host value itself, that echo is no event
+                    if channel in self._host_pressures and round(pressure, VALUE_DIGITS) != self._sent_pressures.get(channel):
+                        self.stats["events"] += 1
+                    self._host_pressures[channel] = pressure
+                    self._send_pressure(channel, pressure, changes)
+
+        # Pressures first, a valve opened by the same event must not start at the old pressure
+        if changes and self.set_pressures is not None:
+            self.stats["commands"] += 1
+            self.set_pressures(changes)
+        else:
+            for channel, pressure in changes.items():
+                self.stats["commands"] += 1
+                self.set_pressure(channel, pressure)
+        for channel, is_open in valves.items():
+            self.stats["commands"] += 1
+            self.set_valve(channel, is_open)
+        return variables.get_integer(RUNNING_GLOBAL)
+
+    def task_running(self):
+        '''
+        Returns True while the program task has not completed, faulted or been stopped.
+        '''
+        task_state = self.controller.runtime.tasks[self.task].status.task_state
+        return getattr(task_state, "name", task_state) in ACTIVE_TASK_STATES
+
+    def run(self, stop_event=None):
+        '''
+        Polls until the program clears $iglobal[0] after setting it, the task is no longer
+        running (or stop_event is set). Returns the stats.
+        '''
+        flag_seen = False
+        while stop_event is None or not stop_event.is_set():
+            next_poll = time.perf_counter() + self.poll_interval
+            # Checked before the poll, so the last poll sees everything the program wrote
+            task_running = self.task_running()
+            running_flag = self.poll()
+            if not task_running or (flag_seen and running_flag == 0):
+                break
+            flag_seen = flag_seen or running_flag != 0
+            time.sleep(max(0.0, next_poll - time.perf_counter()))
+        return self.stats
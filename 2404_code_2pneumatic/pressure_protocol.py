@@ -0,0 +1,274 @@
+import argparse
+import collections
+import struct
+import time
+
+# Binary frames between the host and the pressure box, the firmware parses the same layout
+# (see the .ino). A command frame is 7 bytes, multi-byte fields are little endian:
+#   0     SYNC, 0xA5
+#   1     protocol version (high nibble) and opcode (low nibble)
+#   2     sequence number, counts up per frame sent and wraps at 256
+#   3     channel, 1-based, 0 addresses the box itself
+#   4-5   value, int16 in hundredths: psi for pressures, 1 open / 0 closed for valves
+#   6     CRC-8 (polynomial 0x07, initial value 0) of bytes 1 to 5
+# A BATCH frame sets several channels at once: byte 3 holds the number of entries, then every
+# entry is 4 bytes (channel, opcode, int16 value) and the CRC-8 of bytes 1 to the last entry
+# ends the frame. The box checks the whole frame before it applies any entry.
+# The box answers every valid frame it applied with an ACK frame carrying its sequence number.
+# Once asked for its protocol it sends a TELEMETRY frame per control cycle, laid out like a
+# BATCH frame with a SET_PRESSURE (setpoint), PRESSURE (measured) and SET_VALVE entry per channel.
+# A frame with a wrong CRC or version is dropped and the parser resynchronizes on the next
+# SYNC byte. Text commands ("channel,value\n") stay valid until the first valid frame, after
+# it the box ignores them, as the payload of a corrupted frame could read as one.
+FRAME_SYNC = 0xA5
+PROTOCOL_VERSION = 1
+FRAME_LENGTH = 7
+VALUE_SCALE = 100
+# Decimal digits of a value a frame keeps, VALUE_SCALE is in hundredths
+VALUE_DIGITS = 2
+OP_HELLO = 0  # Box to host, answers HELLO_REQUEST, the value is its channel count
+OP_SET_PRESSURE = 1
+OP_SET_VALVE = 2
+OP_BATCH = 3
+OP_ACK = 4  # Box to host, the sequence number of the frame applied
+OP_PRESSURE = 5  # Telemetry entry, the measured pressure
+OP_TELEMETRY = 6
+# Frames made of entries, their length follows from the entry count
+_ENTRY_FRAMES = (OP_BATCH, OP_TELEMETRY)
+# Entries of one BATCH frame, bounds the firmware's frame buffer
+MAX_BATCH = 16
+# Setpoints the PID loop accepts, in psi
+MIN_PRESSURE = 0
+MAX_PRESSURE = 100
+# Values of the text commands "channel,value\n" besides the setpoints
+VALVE_OPEN = -1
+VALVE_CLOSED = -2
+# Sent as text, so a box with the text-only firmware ignores it: '?' is not part of a
+# command and the empty line addresses no channel
+HELLO_REQUEST = b"?\n"
+# Seconds to wait for the box to answer HELLO_REQUEST before falling back to text commands
+HELLO_TIMEOUT = 0.5
+_FRAME = struct.Struct("<BBBBh")
+_BATCH_HEADER = struct.Struct("<BBBB")
+_BATCH_ENTRY = struct.Struct("<BBh")
+
+# value is a tuple of the entry Frames for BATCH and TELEMETRY frames, channel their number
+Frame = collections.namedtuple("Frame", ["opcode", "sequence", "channel", "value"])
+
+
+def _crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+_CRC8_TABLE = _crc8_table()
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def _scale(value):
+    scaled = int(round(value * VALUE_SCALE))
+    if not -32768 <= scaled <= 32767:
+        raise ValueError(f"Value {value} does not fit in a frame")
+    return scaled
+
+
+def encode_frame(opcode, channel, value, sequence=0):
+    '''
+    Returns the bytes of one frame, value in psi (or 1/0 for valves), kept to hundredths.
+    '''
+    body = _FRAME.pack(FRAME_SYNC, PROTOCOL_VERSION << 4 | opcode, sequence & 0xFF, channel, _scale(value))
+    return body + bytes((crc8(body[1:]),))
+
+
+def encode_batch(entries, sequence=0, opcode=OP_BATCH):
+    '''
+    Returns the bytes of a BATCH frame from (opcode, channel, value) entries, applied together,
+    or with opcode OP_TELEMETRY of a TELEMETRY frame.
+    '''
+    if not 0 < len(entries) <= MAX_BATCH:
+        raise ValueError(f"A batch holds 1 to {MAX_BATCH} entries")
+    body = bytearray(_BATCH_HEADER.pack(FRAME_SYNC, PROTOCOL_VERSION << 4 | opcode, sequence & 0xFF, len(entries)))
+    for entry_opcode, channel, value in entries:
+        body += _BATCH_ENTRY.pack(channel, entry_opcode, _scale(value))
+    body.append(crc8(body[1:]))
+    return bytes(body)
+
+
+def _frame_length(buffer):
+    '''
+    Returns the length of the frame starting the buffer, None while unknown, 0 if invalid.
+    '''
+    if len(buffer) < 2 or buffer[1] & 0x0F not in _ENTRY_FRAMES:
+        return FRAME_LENGTH
+    if len(buffer) < _BATCH_HEADER.size:
+        return None
+    count = buffer[3]
+    return _BATCH_HEADER.size + count * _BATCH_ENTRY.size + 1 if 0 < count <= MAX_BATCH else 0
+
+
+class FrameDecoder:
+    '''
+    Splits a byte stream into frames. Bytes outside frames (text lines) and frames with a wrong
+    CRC or version are skipped, stats counts them as "skipped_bytes" and "bad_frames".
+    '''
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.stats = {"frames": 0, "bad_frames": 0, "skipped_bytes": 0}
+
+    def feed(self, data):
+        '''
+        Adds received bytes and returns the frames completed by them.
+        '''
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        while True:
+            start = buffer.find(FRAME_SYNC)
+            if start < 0:
+                self.stats["skipped_bytes"] += len(buffer)
+                buffer.clear()
+                break
+            if start:
+                self.stats["skipped_bytes"] += start
+                del buffer[:start]
+            length = _frame_length(buffer)
+            if length is None or len(buffer) < length:
+                break
+            if not length or crc8(buffer[1:length - 1]) != buffer[length - 1] or buffer[1] >> 4 != PROTOCOL_VERSION:
+                self.stats["bad_frames"] += 1
+                del buffer[:1]  # Resynchronize on the next SYNC byte
+                continue
+            if length == FRAME_LENGTH:
+                _, header, sequence, channel, scaled = _FRAME.unpack_from(buffer)
+                frame = Frame(header & 0x0F, sequence, channel, scaled / VALUE_SCALE)
+            else:
+                _, header, sequence, count = _BATCH_HEADER.unpack_from(buffer)
+                entries = tuple(Frame(opcode, sequence, channel, scaled / VALUE_SCALE) for channel, opcode, scaled in
+                                _BATCH_ENTRY.iter_unpack(buffer[_BATCH_HEADER.size:length - 1]))
+                frame = Frame(header & 0x0F, sequence, count, entries)
+            del buffer[:length]
+            self.stats["frames"] += 1
+            frames.append(frame)
+        return frames
+
+
+def check_command(opcode, value):
+    '''
+    Raises ValueError unless (opcode, value) is a command the box takes: a SET_PRESSURE setpoint
+    from MIN_PRESSURE to MAX_PRESSURE psi or a SET_VALVE state.
+    '''
+    if opcode == OP_SET_PRESSURE:
+        if not MIN_PRESSURE <= value <= MAX_PRESSURE:
+            raise ValueError(f"Pressure {value} out of range, must be {MIN_PRESSURE} to {MAX_PRESSURE} PSI")
+    elif opcode != OP_SET_VALVE:
+        raise ValueError(f"Opcode {opcode} is not a command")
+
+
+def text_command(opcode, channel, value):
+    '''
+    Encodes a command as the firmware's text line "channel,value\\n". The firmware parses
+    whole numbers only, pressures are rounded to whole psi.
+    '''
+    check_command(opcode, value)
+    value = (VALVE_OPEN if value else VALVE_CLOSED) if opcode == OP_SET_VALVE else int(round(value))
+    return f"{channel},{value}\n".encode()
+
+
+def text_commands(commands):
+    '''
+    Encodes (opcode, channel, value) commands as text lines. The box applies the lines one by
+    one as they arrive, even when they were written together: the text protocol has no way
+    to set several channels at once.
+    '''
+    return b"".join(text_command(opcode, channel, value) for opcode, channel, value in commands)
+
+
+class FrameEncoder:
+    '''
+    Encodes the commands of a SerialWriter ((opcode, channel, value) entries, value in psi for
+    OP_SET_PRESSURE and a bool for OP_SET_VALVE) as numbered frames. A single command is one
+    frame, several are BATCH frames of up to MAX_BATCH entries.
+    '''
+
+    def __init__(self):
+        self.sequence = 0
+
+    def __call__(self, commands):
+        frames = []
+        for begin in range(0, len(commands), MAX_BATCH):
+            entries = commands[begin:begin + MAX_BATCH]
+            for opcode, _, value in entries:
+                check_command(opcode, value)
+            if len(entries) == 1:
+                frames.append(encode_frame(*entries[0], self.sequence))
+            else:
+                frames.append(encode_batch(entries, self.sequence))
+            self.sequence = (self.sequence + 1) & 0xFF
+        return b"".join(frames)
+
+
+def request_hello(port, timeout=HELLO_TIMEOUT):
+    '''
+    Asks the box for its protocol version. Returns its HELLO frame, None if it did not answer
+    (text-only firmware). Call before any other thread reads from the port.
+    '''
+    port.write(HELLO_REQUEST)
+    port.flush()
+    decoder = FrameDecoder()
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        waiting = port.in_waiting
+        if not waiting:
+            time.sleep(0.01)
+            continue
+        for frame in decoder.feed(port.read(waiting)):
+            if frame.opcode == OP_HELLO:
+                return frame
+    return None
+
+
+def negotiate_encoder(port, timeout=HELLO_TIMEOUT):
+    '''
+    Returns the command encoder for a SerialWriter on this port: frames if the box speaks the
+    binary protocol, text commands otherwise.
+    '''
+    return FrameEncoder() if request_hello(port, timeout) is not None else text_commands
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check which protocol the pressure box speaks.")
+    parser.add_argument("--port", help="serial port of the pressure box (default: offline fake box)")
+    parser.add_argument("--baud-rate", type=int, default=9600, help="baud rate")
+    parser.add_argument("--text-only", action="store_true", help="fake box with the text-only firmware")
+    args = parser.parse_args()
+    if args.port:
+        import serial
+
+        port = serial.Serial(args.port, args.baud_rate)
+        time.sleep(2)  # Allow time for Arduino to initialize
+    else:
+        from fake_arduino import FakeArduino
+
+        port = FakeArduino(args.baud_rate, protocol_version=None if args.text_only else PROTOCOL_VERSION)
+    hello = request_hello(port)
+    if hello is None:
+        print("No answer, the box only understands text commands")
+    else:
+        print(f"Binary protocol version {PROTOCOL_VERSION}, {int(hello.value)} channels")
+    port.close()
+
+
+if __name__ == "__main__":
+    main()
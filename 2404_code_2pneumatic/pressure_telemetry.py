@@ -0,0 +1,204 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from pressure_protocol import OP_PRESSURE, OP_SET_PRESSURE, OP_SET_VALVE, OP_TELEMETRY, FrameDecoder, request_hello
+
+# One record per channel and telemetry frame. time is the host clock (time.time()) when the
+# frame arrived, pressures are in psi, valve is 1 open and 0 closed
+TELEMETRY_DTYPE = np.dtype([
+    ('time', '<f8'), ('channel', 'u1'), ('setpoint', '<f4'), ('pressure', '<f4'), ('valve', 'u1'),
+])
+# Records kept, about 90 minutes of two channels at the firmware's 10 Hz control cycle
+TELEMETRY_CAPACITY = 1 << 17
+# pySerial read timeout of the reader thread, bounds how long stop() waits for it
+READ_TIMEOUT = 0.05
+
+
+class TelemetryBuffer:
+    '''
+    Preallocated ring buffer of TELEMETRY_DTYPE records with one writer and any number of
+    readers. The writer fills a slot and then publishes it by counting it, readers copy
+    without a lock and afterwards drop what the writer may have overwritten while they copied.
+    '''
+
+    def __init__(self, capacity=TELEMETRY_CAPACITY):
+        self.capacity = capacity
+        self._records = np.zeros(capacity, dtype=TELEMETRY_DTYPE)
+        self._count = 0  # Records ever appended
+
+    @property
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, timestamp, channel, setpoint, pressure, valve):
+        '''
+        Adds a record, from the writer thread only.
+        '''
+        self._records[self._count % self.capacity] = (timestamp, channel, setpoint, pressure, valve)
+        self._count += 1
+
+    def _copy(self, start, end):
+        start = max(start, end - self.capacity, 0)
+        first = start % self.capacity
+        size = end - start
+        if first + size <= self.capacity:
+            records = self._records[first:first + size].copy()
+        else:
+            records = np.concatenate((self._records[first:], self._records[:first + size - self.capacity]))
+        # Records before this one may have been overwritten during the copy, the one being written included
+        valid_from = self._count + 1 - self.capacity
+        if valid_from > start:
+            records = records[valid_from - start:]
+        return records
+
+    def snapshot(self, last=None):
+        '''
+        Returns a copy of the records held (the newest last ones), oldest first.
+        '''
+        end = self._count
+        return self._copy(end - (self.capacity if last is None else last), end)
+
+    def since(self, index):
+        '''
+        Returns (records appended since the count was index, the count now), for loggers
+        that pick up where they left off. Records overwritten before they were read are lost.
+        '''
+        end = self._count
+        return self._copy(index, end), end
+
+    def latest(self, channel):
+        '''
+        Returns the newest record of a channel, None if there is none in the last few records.
+        '''
+        records = self.snapshot(64)
+        records = records[records['channel'] == channel]
+        return records[-1] if len(records) else None
+
+
+def telemetry_records(frame, timestamp):
+    '''
+    Returns {channel: (setpoint, pressure, valve)} of a TELEMETRY frame.
+    '''
+    channels = {}
+    for entry in frame.value:
+        setpoint, pressure, valve = channels.get(entry.channel, (np.nan, np.nan, 0))
+        if entry.opcode == OP_SET_PRESSURE:
+            setpoint = entry.value
+        elif entry.opcode == OP_PRESSURE:
+            pressure = entry.value
+        elif entry.opcode == OP_SET_VALVE:
+            valve = int(entry.value != 0)
+        channels[entry.channel] = (setpoint, pressure, valve)
+    return channels
+
+
+class TelemetryReader:
+    '''
+    Background thread reading the port of the pressure box, TELEMETRY frames go into a
+    TelemetryBuffer as fast as the firmware sends them. Other frames (e.g. ACKs) are passed to
+    on_frame, bytes outside frames are skipped. The reader owns the reading side of the port,
+    start it after the protocol was negotiated.
+    Args:
+        port: An open pySerial port (or FakeArduino), its read timeout is set to READ_TIMEOUT.
+        buffer: The TelemetryBuffer to fill, a new one by default.
+        on_frame: Optional function (frame) called on the reader thread for other frames.
+    '''
+
+    def __init__(self, port, buffer=None, on_frame=None):
+        self.port = port
+        self.buffer = buffer if buffer is not None else TelemetryBuffer()
+        self.on_frame = on_frame
+        self.decoder = FrameDecoder()
+        self.stats = {"frames": 0, "records": 0, "other_frames": 0}
+        self._stopping = threading.Event()
+        self._thread = None
+        self.failure = None
+
+    def start(self):
+        self.port.timeout = READ_TIMEOUT
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                data = self.port.read(self.port.in_waiting or 1)
+            except (OSError, TypeError) as error:  # A port closed under the reader raises either
+                if not self._stopping.is_set():
+                    self.failure = error
+                return
+            if not data:
+                continue
+            timestamp = time.time()
+            for frame in self.decoder.feed(data):
+                if frame.opcode != OP_TELEMETRY:
+                    self.stats["other_frames"] += 1
+                    if self.on_frame is not None:
+                        self.on_frame(frame)
+                    continue
+                self.stats["frames"] += 1
+                for channel, (setpoint, pressure, valve) in telemetry_records(frame, timestamp).items():
+                    self.buffer.append(timestamp, channel, setpoint, pressure, valve)
+                    self.stats["records"] += 1
+
+    def stop(self):
+        '''
+        Stops the thread, the port stays open.
+        '''
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def save_telemetry(records, file_path):
+    '''
+    Writes telemetry records to a CSV file.
+    '''
+    np.savetxt(file_path, records, fmt=["%.3f", "%d", "%.2f", "%.2f", "%d"], delimiter=",",
+               header=",".join(TELEMETRY_DTYPE.names), comments="")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record the pressure telemetry of the box.")
+    parser.add_argument("--seconds", type=float, default=5.0, help="recording time")
+    parser.add_argument("-o", "--output", help="CSV file for the records")
+    parser.add_argument("--port", help="serial port of the pressure box (default: offline fake box)")
+    parser.add_argument("--baud-rate", type=int, default=9600, help="baud rate")
+    args = parser.parse_args()
+    if args.port:
+        import serial
+
+        port = serial.Serial(args.port, args.baud_rate)
+        time.sleep(2)  # Allow time for Arduino to initialize
+    else:
+        from fake_arduino import FakeArduino
+
+        port = FakeArduino(args.baud_rate)
+        port.setpoints = {1: 20.0, 2: 35.0}
+    if request_hello(port) is None:
+        parser.exit(1, "The box only understands text commands and sends no telemetry\n")
+    reader = TelemetryReader(port).start()
+    time.sleep(args.seconds)
+    reader.stop()
+    port.close()
+    records = reader.buffer.snapshot()
+    print(f"{reader.stats['records']} records from {reader.stats['frames']} frames in {args.seconds:.1f} s "
+          f"({reader.stats['frames'] / args.seconds:.1f} frames/s), {reader.decoder.stats['bad_frames']} bad frames")
+    for channel in np.unique(records['channel']):
+        latest = reader.buffer.latest(channel)
+        print(f"Channel {channel}: setpoint {latest['setpoint']:.1f} psi, measured {latest['pressure']:.2f} psi, "
+              f"valve {'open' if latest['valve'] else 'closed'}")
+    if args.output:
+        save_telemetry(records, args.output)
+        print(f"Telemetry saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import argparse
+import hashlib
+import os
+import re
+import time
+
+# Compiled programs kept in the cache, the least recently used ones are deleted beyond this
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "program_cache")
+COMPILED_SUFFIX = ".a1exe"
+# Directory on the controller file system that programs from the host are uploaded to
+CONTROLLER_DIR = "HostPrograms"
+_HASH_CHUNK_SIZE = 1024 * 1024
+# AeroScript pulls other source files and libraries in with #include "file" / #import "file"
+_INCLUDE_RE = re.compile(rb'^[ \t]*#(?:include|import)[ \t]+"([^"]+)"', re.MULTILINE)
+
+
+def _automation1_compiler():
+    '''
+    Returns a function (source_path, output_path) compiling with the Automation1 host compiler,
+    None if the installed Automation1 API has none.
+    '''
+    try:
+        import automation1 as a1
+    except ImportError:
+        return None
+    compile_file = getattr(getattr(a1, "Compiler", None), "compile_file", None)
+    if compile_file is None:
+        return None
+
+    def compile_program(source_path, output_path):
+        result = compile_file(source_path, output_path)
+        if result.errors:
+            raise RuntimeError(f"Compiling {source_path} failed: {result.errors[0]}")
+
+    return compile_program
+
+
+def upload_program(controller, local_path, controller_path=None, overwrite=True):
+    '''
+    Copies a program from the host to the controller file system, where program.run() looks
+    for it. Without overwrite a file already there is kept, e.g. a compiled program whose name
+    holds its digest. Returns the controller path, by default in CONTROLLER_DIR.
+    '''
+    controller_path = controller_path or f"{CONTROLLER_DIR}/{os.path.basename(local_path)}"
+    if overwrite or not controller.files.does_file_exist(controller_path):
+        controller.files.copy_file_to_controller(local_path, controller_path)
+    return controller_path
+
+
+def program_digest(source_path, compiler_version=""):
+    '''
+    Hashes an AeroScript source file together with every file it includes, recursively, and the
+    compiler version. Includes are resolved relative to the including file, an include that
+    cannot be found is hashed by name (the controller resolves it when compiling).
+    '''
+    digest = hashlib.blake2b(compiler_version.encode(), digest_size=20)
+    pending = [os.path.abspath(source_path)]
+    seen = set()
+    while pending:
+        path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        digest.update(path.encode() + b"\0")
+        if not os.path.exists(path):
+            digest.update(b"missing\0")
+            continue
+        with open(path, 'rb') as file:
+            while chunk := file.read(_HASH_CHUNK_SIZE):
+                digest.update(chunk)
+                # An include line split over two chunks only happens in huge generated
+                # programs, which have no includes after their first lines
+                for include in _INCLUDE_RE.findall(chunk):
+                    pending.append(os.path.join(os.path.dirname(path), include.decode()))
+    return digest.hexdigest()
+
+
+class ProgramCache:
+    '''
+    Local store of compiled AeroScript programs keyed by program_digest(), so a program is only
+    compiled again when its source, one of its includes or the compiler changed.
+    Args:
+        cache_dir: Directory of the compiled programs on the host.
+        compile_program: Function (source_path, output_path) compiling a program, defaults to
+            the Automation1 host compiler. Without one, run() leaves compiling to the controller.
+        compiler_version: Part of every key, e.g. the controller software version.
+        max_bytes: Size above which the least recently used programs are deleted.
+    '''
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, compile_program=None, compiler_version="",
+                 max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.compile_program = compile_program or _automation1_compiler()
+        self.compiler_version = compiler_version
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "hash_seconds": 0.0, "compile_seconds": 0.0, "uploads": 0,
+                      "controller_compiles": 0}
+
+    def compiled_path(self, source_path):
+        '''
+        Returns the compiled program for an AeroScript source file, compiling it on a miss.
+        '''
+        if self.compile_program is None:
+            raise RuntimeError("No AeroScript compiler on the host, the Automation1 API has no Compiler.compile_file")
+        start_time = time.perf_counter()
+        digest = program_digest(source_path, self.compiler_version)
+        self.stats["hash_seconds"] += time.perf_counter() - start_time
+        name = os.path.splitext(os.path.basename(source_path))[0]
+        output_path = os.path.join(self.cache_dir, f"{name}-{digest[:16]}{COMPILED_SUFFIX}")
+        if os.path.exists(output_path):
+            self.stats["hits"] += 1
+            os.utime(output_path)  # Marks it as recently used for prune()
+            return output_path
+
+        self.stats["misses"] += 1
+        os.makedirs(self.cache_dir, exist_ok=True)  # Created by the first compile only
+        start_time = time.perf_counter()
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
+        try:
+            self.compile_program(source_path, temp_path)
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.stats["compile_seconds"] += time.perf_counter() - start_time
+        self.prune()
+        return output_path
+
+    def run(self, controller, source_path, task=1):
+        '''
+        Runs an AeroScript program on a controller task. A source file on the host runs from its
+        cached compiled form, uploaded to the controller file system unless it is there already.
+        Any other path names a program on the controller file system, which the controller
+        compiles and runs as before. Without a host compiler a host source file is uploaded and
+        compiled by the controller, its includes must be on the controller already.
+        Returns the controller path of the program run.
+        '''
+        program = controller.runtime.tasks[task].program
+        if not os.path.isfile(source_path):
+            self.stats["controller_compiles"] += 1
+            program.run(source_path)
+            return source_path
+        if self.compile_program is None:
+            self.stats["controller_compiles"] += 1
+            local_path, overwrite = source_path, True
+        else:
+            local_path, overwrite = self.compiled_path(source_path), False
+        program_path = f"{CONTROLLER_DIR}/{os.path.basename(local_path)}"
+        if overwrite or not controller.files.does_file_exist(program_path):
+            upload_program(controller, local_path, program_path)
+            self.stats["uploads"] += 1
+        program.run(program_path)
+        return program_path
+
+    def prune(self):
+        '''
+        Deletes the least recently used compiled programs beyond max_bytes.
+        '''
+        entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(COMPILED_SUFFIX)]
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        total = 0
+        for entry in entries:
+            total += entry.stat().st_size
+            if total > self.max_bytes:
+                os.remove(entry.path)
+
+    def clear(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(COMPILED_SUFFIX):
+                os.remove(entry.path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile AeroScript programs into the program cache.")
+    parser.add_argument("sources", nargs="+", help=".ascript files")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="compiled program directory")
+    parser.add_argument("--fake", action="store_true", help="use the offline fake controller compiler")
+    args = parser.parse_args()
+    compile_program = None
+    if args.fake:
+        from fake_controller import FakeController
+
+        compile_program = FakeController().compile_program
+    cache = ProgramCache(args.cache_dir, compile_program)
+    for source in args.sources:
+        print(f"{source} -> {cache.compiled_path(source)}")
+    stats = cache.stats
+    print(f"{stats['hits']} cached, {stats['misses']} compiled in {stats['compile_seconds']:.3f} s "
+          f"(hashing {stats['hash_seconds']:.3f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import argparse
+import time
+
+import numpy as np
+
+from aeroscript_compiler import compile_aeroscript
+from motion_simulator import MotionProfile, load_motion_profile, simulate_toolpath
+from pressure_events import PressureSchedule
+from streaming_executor import StreamingExecutor, print_stream_stats
+from toolpath_format import OPCODE_LINEAR, OPCODE_RAPID, TOOLPATH_DTYPE
+
+# Serpentine the noGcode UI printed with one blocking movelinear per segment: 100 layers of
+# 10 X lines of 60 mm, each followed by a 5 mm Y step, the Y direction reversing every layer
+LEGACY_SERPENTINE = {"line_length": 60.0, "line_pitch": 5.0, "lines": 10, "layers": 100, "layer_height": 0.4,
+                     "speed": 50.0, "layer_speed": 10.0}
+# Host time a blocking per-segment move costs on top of the motion itself (s): the command
+# round trip to the controller and the two pressure setpoints ("1,15\n", 10 bits a byte at
+# 9600 baud) the loop wrote after every move
+HOST_SECONDS_PER_MOVE = 0.002 + 2 * 5 * 10 / 9600
+
+
+def serpentine_toolpath(line_length=60.0, line_pitch=5.0, lines=10, layers=1, layer_height=0.4, speed=50.0,
+                        layer_speed=10.0, alternate_layers=True, channel=1):
+    '''
+    Generates a serpentine raster as a toolpath array, every move computed at once with NumPy.
+    Each layer is lines X lines of line_length, alternating in direction, each followed by a
+    line_pitch step in Y. A C move of layer_height ends every layer.
+    Args:
+        line_length, line_pitch, layer_height: In mm, negative values run the other way.
+        lines, layers: Lines per layer and layers.
+        speed, layer_speed: Speeds in mm/s of the raster moves and the layer changes.
+        alternate_layers: Step in -Y on odd layers, so every layer goes back over the previous one.
+        channel: Deposition channel of the raster moves, layer changes are travel.
+    Returns:
+        A TOOLPATH_DTYPE array starting with a record at the origin, positions relative to the
+        start point, usable wherever a .toolpath file is (compiler, simulator, streaming).
+        Run it in incremental target mode like compile_plan() and stream_plan() do.
+    '''
+    if lines < 1 or layers < 1:
+        raise ValueError("A serpentine needs at least one line and one layer")
+    per_layer = 2 * lines + 1
+    line_sign = np.where(np.arange(lines) % 2 == 0, 1.0, -1.0)
+    layer_sign = np.where(np.arange(layers) % 2 == 1, -1.0, 1.0) if alternate_layers else np.ones(layers)
+
+    delta = np.zeros((layers, per_layer, 3))  # X, Y, C
+    delta[:, 0:-1:2, 0] = line_length * line_sign
+    delta[:, 1:-1:2, 1] = line_pitch * layer_sign[:, None]
+    delta[:, -1, 2] = layer_height
+    positions = np.cumsum(delta.reshape(-1, 3), axis=0)
+
+    toolpath = np.zeros(len(positions) + 1, dtype=TOOLPATH_DTYPE)
+    toolpath['opcode'] = OPCODE_LINEAR
+    toolpath['opcode'][0] = OPCODE_RAPID
+    toolpath['line'] = np.arange(1, len(toolpath) + 1)
+    moves = toolpath[1:]
+    moves['x'], moves['y'], moves['c'] = positions.T
+    layer_change = np.zeros((layers, per_layer), dtype=bool)
+    layer_change[:, -1] = True
+    layer_change = layer_change.ravel()
+    # A layer change starts the next layer, as in a revised program
+    moves['layer'] = np.repeat(np.arange(layers), per_layer) + layer_change
+    moves['channel'] = np.where(layer_change, 0, channel)
+    moves['feed'] = np.where(layer_change, layer_speed, speed) * 60.0  # mm/min like G-code feeds
+    toolpath['feed'][0] = speed * 60.0
+    return toolpath
+
+
+def compile_plan(toolpath, output_path, pressure_schedule=None):
+    '''
+    Compiles a plan into one blended AeroScript program, see compile_aeroscript(). The program
+    is incremental, so the raster starts wherever the nozzle is, like the per-segment movelinear
+    distances did. pressure_schedule None leaves the valves to the host, as the loop did.
+    '''
+    if pressure_schedule is None:
+        pressure_schedule = PressureSchedule(valve_events=False)
+    return compile_aeroscript(toolpath, output_path, pressure_schedule, incremental=True)
+
+
+def stream_plan(controller, toolpath, pressure_schedule=None, task=1, stop_event=None):
+    '''
+    Runs a plan as a queued batch through the command queue of a task, see StreamingExecutor.
+    Moves are incremental like those of compile_plan(). Returns the streaming stats.
+    '''
+    if pressure_schedule is None:
+        pressure_schedule = PressureSchedule(valve_events=False)
+    return StreamingExecutor(controller, task).run_toolpath(toolpath, pressure_schedule, stop_event, incremental=True)
+
+
+def compare_plan(toolpath, profile=None, host_seconds_per_move=HOST_SECONDS_PER_MOVE):
+    '''
+    Estimates what running a plan as one batch saves over one blocking command per move.
+    Per-move commands stop at the end of every move and add host_seconds_per_move each, the
+    batch blends its corners (profile.blending is forced on for it).
+    Returns a dict with the moves, the stops and times (s) of both ways and the time saved.
+    '''
+    profile = profile or MotionProfile()
+    blocking, batched = (simulate_toolpath(toolpath, MotionProfile(profile.acceleration, profile.jerk,
+                                                                   profile.junction_deviation, blending,
+                                                                   profile.min_segment_time))
+                         for blending in (False, True))
+    moves = len(toolpath) - 1  # The first record only sets the start point
+    blocking_time = blocking["total_time"] + moves * host_seconds_per_move
+    return {
+        "moves": moves,
+        "blocking_stops": blocking["stops"],
+        "batched_stops": batched["stops"],
+        "blocking_time": blocking_time,
+        "batched_time": batched["total_time"],
+        "saved_time": blocking_time - batched["total_time"],
+    }
+
+
+def print_comparison(comparison):
+    print(f"{comparison['moves']} moves: {comparison['blocking_stops']} corner stops one command at a time, "
+          f"{comparison['batched_stops']} as one batch")
+    saved = comparison['saved_time']
+    print(f"Estimated time {comparison['blocking_time']:.1f} s -> {comparison['batched_time']:.1f} s, "
+          f"{saved:.1f} s saved ({100 * saved / comparison['blocking_time']:.1f} %)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a serpentine raster plan and compile or stream it as one batch.")
+    parser.add_argument("-o", "--output", default="raster_plan.ascript", help="AeroScript path of the compiled plan")
+    parser.add_argument("--line-length", type=float, default=LEGACY_SERPENTINE["line_length"], help="X line length (mm)")
+    parser.add_argument("--line-pitch", type=float, default=LEGACY_SERPENTINE["line_pitch"], help="Y step (mm)")
+    parser.add_argument("--lines", type=int, default=LEGACY_SERPENTINE["lines"], help="lines per layer")
+    parser.add_argument("--layers", type=int, default=LEGACY_SERPENTINE["layers"], help="layers")
+    parser.add_argument("--layer-height", type=float, default=LEGACY_SERPENTINE["layer_height"], help="C step (mm)")
+    parser.add_argument("--speed", type=float, default=LEGACY_SERPENTINE["speed"], help="raster speed (mm/s)")
+    parser.add_argument("--layer-speed", type=float, default=LEGACY_SERPENTINE["layer_speed"],
+                        help="layer change speed (mm/s)")
+    parser.add_argument("--profile", help="motion profile (JSON) for the time estimate, see motion_simulator.py")
+    parser.add_argument("--stream", action="store_true", help="stream the plan into the controller instead of compiling")
+    parser.add_argument("--fake", action="store_true", help="stream into the offline fake controller")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    toolpath = serpentine_toolpath(args.line_length, args.line_pitch, args.lines, args.layers, args.layer_height,
+                                   args.speed, args.layer_speed)
+    print(f"Generated {len(toolpath) - 1} moves in {1000 * (time.perf_counter() - start_time):.1f} ms")
+    profile = load_motion_profile(args.profile) if args.profile else None
+    print_comparison(compare_plan(toolpath, profile))
+
+    if args.stream or args.fake:
+        if args.fake:
+            from fake_controller import FakeController
+
+            controller = FakeController()
+        else:
+            import automation1 as a1
+
+            controller = a1.Controller.connect()
+            controller.start()
+        print_stream_stats(stream_plan(controller, toolpath))
+    else:
+        print(f"AeroScript program saved to: {compile_plan(toolpath, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import argparse
+import collections
+import threading
+import time
+
+from pressure_protocol import OP_SET_PRESSURE, OP_SET_VALVE, VALUE_DIGITS, check_command, text_commands
+
+
+class SerialWriter:
+    '''
+    Owns the writing side of the serial port to the pressure box. Callers on any thread only
+    submit commands, a writer thread sends them. Pending commands are kept per opcode and
+    channel (pressure or valve): a newer value replaces a pending one, and a value equal to the
+    last one sent is dropped, so repeated setpoints cost no serial bandwidth. Commands are
+    sent in the order their opcode and channel were first submitted, everything pending at
+    once in one write.
+    Args:
+        port: An open pySerial port (or FakeArduino).
+        encode: Function ([(opcode, channel, value), ...]) returning the bytes of a list of
+            commands, value in psi for OP_SET_PRESSURE and a bool for OP_SET_VALVE, e.g.
+            text_commands or a FrameEncoder (see pressure_protocol.py).
+    '''
+
+    def __init__(self, port, encode=text_commands):
+        self.port = port
+        self.encode = encode
+        self.stats = {"submitted": 0, "coalesced": 0, "dropped": 0, "commands": 0, "bytes": 0, "writes": 0}
+        self._pending = collections.OrderedDict()
+        self._last = {}  # Last value handed to the port per (opcode, channel)
+        self._writing = False
+        self._closing = False
+        self._failure = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def set_pressure(self, channel, pressure):
+        # Kept to hundredths like the frames, the text encoder rounds to whole psi itself
+        self.submit(OP_SET_PRESSURE, channel, round(pressure, VALUE_DIGITS))
+
+    def set_valve(self, channel, is_open):
+        self.submit(OP_SET_VALVE, channel, bool(is_open))
+
+    def set_channels(self, pressures=None, valves=None):
+        '''
+        Sets the pressures ({channel: psi}) and valve states ({channel: is_open}) of any number
+        of channels together. They are queued at once, so they go out in the same write, and
+        with the binary protocol in one batch frame the box applies at once (see pressure_protocol.py).
+        The text protocol has no batches, the box applies the lines of the write one by one.
+        '''
+        commands = [(OP_SET_PRESSURE, channel, round(pressure, VALUE_DIGITS))
+                    for channel, pressure in (pressures or {}).items()]
+        commands += [(OP_SET_VALVE, channel, bool(is_open)) for channel, is_open in (valves or {}).items()]
+        for opcode, _, value in commands:
+            check_command(opcode, value)  # Before any of them is queued
+        with self._condition:
+            for opcode, channel, value in commands:
+                self.submit(opcode, channel, value)
+
+    def submit(self, opcode, channel, value):
+        '''
+        Queues a command, replacing a pending one of the same opcode and channel. ValueError if
+        the box does not take it, see check_command().
+        '''
+        check_command(opcode, value)
+        key = (opcode, channel)
+        with self._condition:  # Reentrant, set_channels() holds it for all its commands
+            self._raise_failure()
+            if self._closing:
+                raise RuntimeError("The serial writer is closed")
+            self.stats["submitted"] += 1
+            if key in self._pending:
+                self.stats["coalesced"] += 1
+                if value == self._last.get(key):
+                    del self._pending[key]  # Back to what the box already has
+                else:
+                    self._pending[key] = value
+            elif value == self._last.get(key):
+                self.stats["dropped"] += 1
+            else:
+                self._pending[key] = value
+                self._condition.notify_all()
+
+    def resend(self):
+        '''
+        Forgets what was sent, so the next value of every channel is sent even if unchanged,
+        e.g. after the box was reset.
+        '''
+        with self._condition:
+            self._last.clear()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._closing)
+                if not self._pending:
+                    return
+                commands = list(self._pending.items())
+                self._pending.clear()
+                for key, value in commands:
+                    self._last[key] = value
+                self._writing = True
+            # Everything pending goes out in one write, the port is not held between batches
+            data = self.encode([(opcode, channel, value) for (opcode, channel), value in commands])
+            try:
+                self.port.write(data)
+                self.port.flush()
+            except Exception as error:
+                with self._condition:
+                    self._failure = error
+                    self._writing = False
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._writing = False
+                self.stats["commands"] += len(commands)
+                self.stats["bytes"] += len(data)
+                self.stats["writes"] += 1
+                self._condition.notify_all()
+
+    def _raise_failure(self):
+        if self._failure is not None:
+            raise self._failure
+
+    def flush(self, timeout=None):
+        '''
+        Waits until every pending command was written. Returns False on a timeout.
+        '''
+        with self._condition:
+            done = self._condition.wait_for(
+                lambda: self._failure is not None or not (self._pending or self._writing), timeout)
+            self._raise_failure()
+            return done
+
+    def close(self):
+        '''
+        Sends what is pending, stops the writer thread and closes the port. Closing twice is harmless.
+        '''
+        with self._condition:
+            if self._closing:
+                return
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join()
+        self.port.close()
+        self._raise_failure()
+
+
+def print_writer_stats(stats):
+    print(f"{stats['submitted']} commands submitted, {stats['commands']} sent in {stats['writes']} writes "
+          f"({stats['bytes']} bytes), {stats['coalesced']} coalesced, {stats['dropped']} unchanged dropped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the print loop's setpoint traffic through the serial writer.")
+    parser.add_argument("--seconds", type=float, default=5.0, help="duration of the replay")
+    parser.add_argument("--port", help="serial port of the pressure box (default: offline fake box)")
+    parser.add_argument("--baud-rate", type=int, default=9600, help="baud rate")
+    args = parser.parse_args()
+    if args.port:
+        import serial
+
+        port = serial.Serial(args.port, args.baud_rate)
+        time.sleep(2)  # Allow time for Arduino to initialize
+    else:
+        from fake_arduino import FakeArduino
+
+        port = FakeArduino(args.baud_rate)
+    writer = SerialWriter(port)
+    # Like the old print loop: both setpoints after every move, a pressure change now and then
+    end_time = time.perf_counter() + args.seconds
+    pressure = 15
+    while time.perf_counter() < end_time:
+        for _ in range(200):
+            writer.set_pressure(1, pressure)
+            writer.set_pressure(2, pressure)
+            time.sleep(0.001)
+        pressure = 30 if pressure == 15 else 15
+    writer.set_channels({1: 0, 2: 0}, {1: False, 2: False})
+    writer.close()
+    print_writer_stats(writer.stats)
+
+
+if __name__ == "__main__":
+    main()
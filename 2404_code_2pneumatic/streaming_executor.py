@@ -0,0 +1,166 @@
+import argparse
+import queue
+import threading
+import time
+
+from aeroscript_compiler import aeroscript_statements
+
+# Commands the controller's command queue holds
+QUEUE_CAPACITY = 4096
+# The queue is refilled up to the high watermark once it drained to the low one (fractions of
+# the capacity), so the host talks to the controller in bursts instead of per command
+HIGH_WATERMARK = 0.9
+LOW_WATERMARK = 0.5
+# Statements the producer thread prepares ahead, bounds host memory
+PRODUCER_BUFFER = 8192
+# Seconds between two reads of the queue depth while it drains
+POLL_INTERVAL = 0.005
+_END = None
+
+
+class StreamingExecutor:
+    '''
+    Runs a job of any size through the command queue of a controller task. A producer thread
+    turns the toolpath into AeroScript statements ahead of time into a bounded buffer, the
+    caller's thread keeps the controller queue between the low and high watermark. Host memory
+    is bounded by the buffer and the chunk the producer prepares.
+    Args:
+        controller: A connected automation1 Controller (or FakeController).
+        task: The controller task the queue runs on.
+        capacity: Commands the controller queue holds.
+        high_watermark, low_watermark: Fractions of the capacity to refill to and at.
+        producer_buffer: Statements prepared ahead by the producer thread.
+        poll_interval: Seconds between two reads of the queue depth.
+    '''
+
+    def __init__(self, controller, task=1, capacity=QUEUE_CAPACITY, high_watermark=HIGH_WATERMARK,
+                 low_watermark=LOW_WATERMARK, producer_buffer=PRODUCER_BUFFER, poll_interval=POLL_INTERVAL):
+        if not 0 <= low_watermark < high_watermark <= 1:
+            raise ValueError("Watermarks must satisfy 0 <= low < high <= 1")
+        self.controller = controller
+        self.task = task
+        self.capacity = capacity
+        self.high = max(1, int(capacity * high_watermark))
+        self.low = int(capacity * low_watermark)
+        self.producer_buffer = producer_buffer
+        self.poll_interval = poll_interval
+        self.stats = {}
+
+    def _produce(self, statements, buffer, stopping, failure):
+        try:
+            for statement in statements:
+                buffer.put(statement.rstrip("\n"))
+                if stopping.is_set():
+                    return
+        except Exception as error:
+            failure.append(error)
+        finally:
+            buffer.put(_END)
+
+    def run(self, statements, stop_event=None):
+        '''
+        Streams AeroScript statements into the command queue and waits until they executed
+        (or stop_event is set). Returns the stats: commands sent, seconds, commands per second,
+        refills, polls, underruns (the queue ran empty while the job was not finished, i.e.
+        motion had to stop) and producer waits (the producer could not keep up).
+        '''
+        stats = self.stats = {"commands": 0, "refills": 0, "polls": 0, "underruns": 0, "producer_waits": 0,
+                              "max_depth": 0, "aborted": False}
+        buffer = queue.Queue(self.producer_buffer)
+        stopping = threading.Event()
+        failure = []
+        producer = threading.Thread(target=self._produce, args=(statements, buffer, stopping, failure), daemon=True)
+        producer.start()
+
+        commands = self.controller.runtime.commands
+        command_queue = commands.begin_command_queue(self.task, self.capacity, False)
+        command_queue.pause()  # Filled before motion starts, the first moves must not wait for the host
+        start_time = time.perf_counter()
+        depth = 0
+        finished = False
+        try:
+            while not finished:
+                stats["refills"] += 1
+                while depth < self.high:
+                    try:
+                        statement = buffer.get_nowait()
+                    except queue.Empty:
+                        stats["producer_waits"] += 1
+                        statement = buffer.get()
+                    if statement is _END:
+                        finished = True
+                        break
+                    command_queue.commands.execute(statement)
+                    depth += 1
+                    stats["commands"] += 1
+                stats["max_depth"] = max(stats["max_depth"], depth)
+                if stats["refills"] == 1:
+                    command_queue.resume()
+
+                while not finished:
+                    if stop_event is not None and stop_event.is_set():
+                        stats["aborted"] = True
+                        return stats
+                    time.sleep(self.poll_interval)
+                    depth = command_queue.status.number_of_unexecuted_commands
+                    stats["polls"] += 1
+                    if depth == 0:
+                        stats["underruns"] += 1
+                    if depth <= self.low:
+                        break
+            if failure:
+                raise failure[0]
+            command_queue.wait_for_empty()
+        finally:
+            stopping.set()
+            while producer.is_alive():  # Unblocks a producer waiting for buffer space
+                try:
+                    buffer.get(timeout=0.01)
+                except queue.Empty:
+                    pass
+            if stats["aborted"]:
+                command_queue.pause()
+            commands.end_command_queue(command_queue)
+            stats["seconds"] = time.perf_counter() - start_time
+            stats["commands_per_second"] = stats["commands"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+        return stats
+
+    def run_toolpath(self, source, pressure_schedule=None, stop_event=None, incremental=False):
+        '''
+        Streams a toolpath (ideally a memory-mapped .toolpath file) compiled on the fly like
+        compile_aeroscript(), valve and pressure events included.
+        '''
+        return self.run(aeroscript_statements(source, pressure_schedule, incremental=incremental), stop_event)
+
+
+def print_stream_stats(stats):
+    print(f"Streamed {stats['commands']} commands in {stats['seconds']:.2f} s "
+          f"({stats['commands_per_second']:.0f} commands/s){' (aborted)' if stats['aborted'] else ''}")
+    print(f"{stats['refills']} refills, {stats['polls']} polls, {stats['underruns']} underruns, "
+          f"{stats['producer_waits']} producer waits, deepest queue {stats['max_depth']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a job through a controller task's command queue.")
+    parser.add_argument("source", help=".toolpath file (memory-mapped) or revised .gcode file")
+    parser.add_argument("--pressure-events", metavar="SCHEDULE",
+                        help="also write the pressures of a layer,channel,pressure CSV file")
+    parser.add_argument("--capacity", type=int, default=QUEUE_CAPACITY, help="command queue capacity")
+    parser.add_argument("--task", type=int, default=1, help="controller task")
+    parser.add_argument("--fake", action="store_true", help="stream into the offline fake controller")
+    args = parser.parse_args()
+    if args.fake:
+        from fake_controller import FakeController
+
+        controller = FakeController()
+    else:
+        import automation1 as a1
+
+        controller = a1.Controller.connect()
+        controller.start()
+    executor = StreamingExecutor(controller, args.task, args.capacity)
+    print_stream_stats(executor.run_toolpath(args.source, args.pressure_events))
+
+
+if __name__ == "__main__":
+    main()
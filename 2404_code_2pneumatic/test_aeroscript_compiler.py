@@ -0,0 +1,72 @@
+import fake_controller
+from aeroscript_compiler import aeroscript_statements
+from fake_controller import FakeController
+from streaming_executor import StreamingExecutor
+from toolpath_format import parse_toolpath
+
+# Two layers of a revised program, each starting with the incremental layer change
+REVISED_LINES = [
+    "G75\n", "$iglobal[0] = 1\n",
+    "G91\n", "G1 C0.3\n", "G90\n",
+    "G1 X10 Y0 F600\n", "G1 X10 Y10\n", "G1 X0 Y10\n",
+    "G91\n", "G1 C0.3\n", "G90\n",
+    "G1 X0 Y0\n", "G1 X10 Y0\n",
+    "$iglobal[0] = 0\n",
+]
+FIRST_LAYER_CHANGE = ["SetupTaskTargetMode(TargetMode.Incremental)\n", "MoveLinear([C], [0.3], 10)\n",
+                      "SetupTaskTargetMode(TargetMode.Absolute)\n"]
+
+
+def _moves(statements):
+    return [statement for statement in statements if statement.startswith("Move")]
+
+
+def test_every_record_is_compiled():
+    toolpath = parse_toolpath(REVISED_LINES)
+    stats = {}
+    statements = list(aeroscript_statements(toolpath, consolidate=False, stats=stats))
+    assert stats["moves"] == stats["segments"] == len(toolpath)
+    assert len(_moves(statements)) == len(toolpath)
+
+
+def test_first_layer_change_is_compiled():
+    statements = list(aeroscript_statements(parse_toolpath(REVISED_LINES), consolidate=False))
+    first_move = statements.index(_moves(statements)[0])
+    assert statements[first_move - 1:first_move + 2] == FIRST_LAYER_CHANGE
+
+
+def test_chunk_boundaries_lose_no_record():
+    toolpath = parse_toolpath(REVISED_LINES)
+    assert list(aeroscript_statements(toolpath, consolidate=False, chunk_size=1)) == \
+        list(aeroscript_statements(toolpath, consolidate=False))
+
+
+def test_streamed_job_starts_with_the_first_layer_change(monkeypatch):
+    executed = []
+    add = fake_controller._CommandQueue.add
+
+    def record(queue, aeroscript_text):
+        executed.append(aeroscript_text + "\n")
+        add(queue, aeroscript_text)
+
+    monkeypatch.setattr(fake_controller._CommandQueue, "add", record)
+    toolpath = parse_toolpath(REVISED_LINES)
+    StreamingExecutor(FakeController(commands_per_second=1e6)).run_toolpath(toolpath)
+    assert executed == list(aeroscript_statements(toolpath))
+    first_move = executed.index(_moves(executed)[0])
+    assert executed[first_move - 1:first_move + 2] == FIRST_LAYER_CHANGE
+
+
+def test_incremental_program_runs_from_the_start_position():
+    toolpath = parse_toolpath(REVISED_LINES)
+    statements = list(aeroscript_statements(toolpath, consolidate=False, incremental=True))
+    assert "SetupTaskTargetMode(TargetMode.Incremental)\n" in statements
+    assert "SetupTaskTargetMode(TargetMode.Absolute)\n" not in statements
+    assert _moves(statements)[:3] == ["MoveLinear([C], [0.3], 10)\n", "MoveLinear([X], [10], 10)\n",
+                                      "MoveLinear([Y], [10], 10)\n"]
+
+
+def test_first_absolute_move_names_every_planar_axis():
+    toolpath = parse_toolpath(["G1 X10 Y0 F600\n", "G1 X10 Y5\n"])
+    assert _moves(aeroscript_statements(toolpath)) == ["MoveLinear([X, Y], [10, 0], 10)\n",
+                                                       "MoveLinear([Y], [5], 10)\n"]
@@ -0,0 +1,52 @@
+import numpy as np
+
+from arc_fitting import fit_arcs_gcode_lines
+from gcode_lexer import tokenize_line
+
+
+def _chords(radius, count, sweep, clockwise=False):
+    '''
+    Lines tracing count chords of an arc of radius around the origin, starting on the X axis.
+    '''
+    angles = np.linspace(0, sweep, count + 1) * (-1 if clockwise else 1)
+    lines = [f"G0 X{radius:.4f} Y0 F6000\n"]
+    for index, angle in enumerate(angles[1:], 1):
+        lines.append(f"G1 X{radius * np.cos(angle):.4f} Y{radius * np.sin(angle):.4f} E{index * 0.1:.1f}\n")
+    return lines
+
+
+def _words(line):
+    return {word[0]: float(word[1:]) for word in tokenize_line(line)[1][1:]}
+
+
+def test_chords_become_one_arc():
+    lines = _chords(10, 36, np.pi)
+    stats = {}
+    out = list(fit_arcs_gcode_lines(lines, tolerance=0.01, stats=stats))
+    assert len(out) == 2
+    assert out[1].startswith("G3 ")
+    words = _words(out[1])
+    # Ends where the chords end, centre offset back to the origin, extrusion word of the last chord
+    assert (words["X"], words["Y"]) == (-10, 0)
+    assert np.hypot(words["I"] + 10, words["J"]) < 0.01
+    assert words["E"] == 3.6
+    assert stats == {"arc_segments_in": 36, "arc_segments_out": 1, "arcs": 1}
+
+
+def test_clockwise_chords_become_g2():
+    out = list(fit_arcs_gcode_lines(_chords(5, 24, np.pi / 2, clockwise=True)))
+    assert [line.split()[0] for line in out] == ["G0", "G2"]
+    assert (_words(out[1])["X"], _words(out[1])["Y"]) == (0, -5)
+
+
+def test_coarse_chords_stay_lines():
+    # The sagitta of 10 degree chords of radius 10 is about 0.04 mm
+    lines = _chords(10, 18, np.pi)
+    assert list(fit_arcs_gcode_lines(lines, tolerance=0.01)) == lines
+
+
+def test_straight_lines_and_short_runs_stay_lines():
+    lines = ["G0 X0 Y0\n", "G1 X1 Y0 E1\n", "G1 X2 Y0 E2\n", "G1 X3 Y0 E3\n", "G1 X4 Y0 E4\n"]
+    assert list(fit_arcs_gcode_lines(lines)) == lines
+    lines = _chords(10, 2, np.pi / 18)
+    assert list(fit_arcs_gcode_lines(lines)) == lines
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from async_pressure_link import AsyncPressureLink
+from fake_arduino import FakeArduino
+
+
+class _LossyArduino(FakeArduino):
+    '''
+    Drops the first lost_acks frames the box sends.
+    '''
+
+    def __init__(self, lost_acks, **kwargs):
+        super().__init__(baud_rate=115200, **kwargs)
+        self.lost_acks = lost_acks
+
+    def send(self, data):
+        if self.lost_acks:
+            self.lost_acks -= 1
+            return
+        super().send(data)
+
+
+async def _close_with_command_in_flight(port, **link_options):
+    link = AsyncPressureLink(port, ack_timeout=0.05, **link_options)
+    await link.start(check_protocol=False)
+    command = asyncio.create_task(link.set_pressure(1, 25.5))
+    await asyncio.sleep(0.01)  # Sent, ACK lost
+    await asyncio.wait_for(link.close(), 5)
+    return link, await asyncio.gather(command, return_exceptions=True)
+
+
+def test_close_keeps_retrying_commands_in_flight():
+    port = _LossyArduino(lost_acks=1)
+    link, (result,) = asyncio.run(_close_with_command_in_flight(port))
+    assert result.attempts == 2 and not result.superseded
+    assert port.setpoints[1] == 25.5 and not port.is_open
+    assert link.stats["retries"] == 1 and link.stats["failures"] == 0
+
+
+def test_close_fails_commands_never_acknowledged():
+    link, (result,) = asyncio.run(_close_with_command_in_flight(_LossyArduino(lost_acks=1000), max_retries=1))
+    assert isinstance(result, TimeoutError)
+    assert link.stats["failures"] == 1
+
+
+def test_commands_need_start():
+    link = AsyncPressureLink(FakeArduino())
+    with pytest.raises(RuntimeError, match="start"):
+        asyncio.run(link.set_pressure(1, 20))
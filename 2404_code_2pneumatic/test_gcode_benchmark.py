@@ -0,0 +1,48 @@
+import json
+
+from gcode_benchmark import compare_with_baseline, generate_slicer_file, run_suite, synthetic_file
+from gcode_io import open_gcode_file
+from gcode_lexer import tokenize_line
+
+
+def test_synthetic_file_has_the_requested_lines(slicer_file):
+    with open(slicer_file) as file:
+        lines = file.readlines()
+    assert len(lines) == 5000
+    assert lines[-5] == "; Build Summary\n"
+    assert sum(line.startswith("; layer ") for line in lines) == 5
+
+
+def test_synthetic_feed_words_only_on_change(slicer_file):
+    feeds = []
+    with open(slicer_file) as file:
+        for line in file:
+            feeds += [word for word in tokenize_line(line)[1] if word[0] == "F"]
+    assert all(previous != feed for previous, feed in zip(feeds, feeds[1:]))
+
+
+def test_synthetic_file_is_reproducible(slicer_file, tmp_path):
+    with open(slicer_file) as file, open(generate_slicer_file(str(tmp_path / "again.gcode"), 5000)) as again:
+        assert file.read() == again.read()
+
+
+def test_compressed_synthetic_file_is_a_copy(tmp_path):
+    with open(synthetic_file(str(tmp_path), 1000)) as plain, \
+            open_gcode_file(synthetic_file(str(tmp_path), 1000, ".gz"), 'r') as compressed:
+        assert compressed.read() == plain.read()
+
+
+def test_suite_output_is_identical_to_legacy(tmp_path):
+    results = run_suite([2000], workers_list=(1, 2), data_dir=str(tmp_path), compressions=("gz",))
+    assert [(result["format"], result["workers"]) for result in results] == [
+        ("plain", 1), ("plain", 2), ("gz", 1), ("gz", 2)]
+    assert all(result["equivalent"] for result in results)
+
+
+def test_baseline_comparison_flags_regressions(tmp_path):
+    baseline_path = tmp_path / "baseline.json"
+    baseline_path.write_text(json.dumps([{"lines": 10, "workers": 1, "lines_per_second": 100.0}]))
+    result = {"lines": 10, "format": "plain", "workers": 1, "cpus": 1, "lines_per_second": 90.0, "equivalent": True}
+    assert compare_with_baseline([result], str(baseline_path))
+    assert not compare_with_baseline([dict(result, lines_per_second=70.0)], str(baseline_path))
+    assert not compare_with_baseline([dict(result, equivalent=False)], str(baseline_path))
@@ -0,0 +1,44 @@
+import gzip
+import lzma
+import shutil
+
+import pytest
+
+from gcode_io import derived_path, open_gcode_file
+from layer_index import build_layer_index
+from use_this_Gcode_revision import adjust_gcode_file
+
+
+@pytest.mark.parametrize("file_path, tag, extension, derived", [
+    ("part.gcode", "_revised", None, "part_revised.gcode"),
+    ("dir/part.gcode.gz", "_revised", None, "dir/part_revised.gcode.gz"),
+    ("part.nc.xz", "", ".toolpath", "part.toolpath"),
+])
+def test_derived_path_keeps_the_compression(file_path, tag, extension, derived):
+    assert derived_path(file_path, tag, extension) == derived
+
+
+@pytest.mark.parametrize("suffix, decompress", [(".gz", gzip.decompress), (".xz", lzma.decompress)])
+def test_compressed_round_trip(tmp_path, suffix, decompress):
+    file_path = str(tmp_path / f"part.gcode{suffix}")
+    with open_gcode_file(file_path, 'w') as file:
+        file.write("G1 X1 Y1\n" * 1000)
+    with open(file_path, 'rb') as file:
+        assert decompress(file.read()) == b"G1 X1 Y1\n" * 1000
+    with open_gcode_file(file_path) as file:
+        assert file.readlines() == ["G1 X1 Y1\n"] * 1000
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".xz"])
+def test_compressed_revision_matches_the_plain_one(slicer_file, tmp_path, suffix):
+    plain_path = str(tmp_path / "part_revised.gcode")
+    adjust_gcode_file(slicer_file, "C", plain_path)
+    compressed_input = str(tmp_path / f"part.gcode{suffix}")
+    with open(slicer_file, 'rb') as source, open_gcode_file(compressed_input, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    stats = adjust_gcode_file(compressed_input, "C")
+    assert stats["revised_file_path"] == str(tmp_path / f"part_revised.gcode{suffix}")
+    with open_gcode_file(stats["revised_file_path"]) as compressed, open(plain_path) as plain:
+        assert compressed.read() == plain.read()
+    with pytest.raises(ValueError, match="uncompressed"):
+        build_layer_index(stats["revised_file_path"])
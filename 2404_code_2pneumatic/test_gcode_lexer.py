@@ -0,0 +1,29 @@
+import pytest
+
+from gcode_lexer import command_key, remove_words, tokenize_line
+
+
+@pytest.mark.parametrize("line, words", [
+    ("G1 X5 Y5 E4\n", ["G1", "X5", "Y5", "E4"]),
+    ("G1X5Y5E4\n", ["G1", "X5", "Y5", "E4"]),
+    ("g1 x5\ty5\n", ["G1", "X5", "Y5"]),
+    ("$iglobal[0] = 1\n", None),
+])
+def test_words(line, words):
+    assert tokenize_line(line)[1] == words
+
+
+def test_packed_words_are_normalized_for_rewriting():
+    code, _, comment = tokenize_line("G1X5Y5E4 ; packed\n")
+    assert code == "G1 X5 Y5 E4 " and comment == "; packed"
+    assert remove_words(code, "E") == "G1 X5 Y5 "
+
+
+def test_comments_are_not_words():
+    assert tokenize_line("; switch to T0\n") == ("", [], "; switch to T0")
+
+
+@pytest.mark.parametrize("words, key", [(["G01", "X1"], "G1"), (["N10", "G0", "X1"], "G0"), (["T10"], "T10"),
+                                        (["M30"], "M30"), (["X1", "Y2"], None)])
+def test_command_key(words, key):
+    assert command_key(words) == key
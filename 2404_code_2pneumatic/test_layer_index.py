@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from layer_index import build_layer_index, layer_index_path_for, load_layer_index, write_resume_file
+from use_this_Gcode_revision import adjust_gcode_file
+
+# A revised program with two layer changes, a pressure change and a valve opening in between
+REVISED = ("G90\n", "$iglobal[0] = 1\n", "G0 X1 Y2 F6000\n", "G91\n", "G1 C0.3 F1000\n", "G90\n",
+           "$rglobal[1] = 25.5\n", "$iglobal[1] = 1\n", "G1 X3 Y4 F600\n", "G91\n", "G1 C0.3 F1000\n", "G90\n",
+           "G1 X5 Y6\n", "$iglobal[0] = 0\n")
+
+
+@pytest.fixture
+def revised_file(tmp_path):
+    file_path = tmp_path / "part_revised.gcode"
+    file_path.write_text("".join(REVISED))
+    return str(file_path)
+
+
+def test_index_records_the_state_before_each_layer(revised_file):
+    index = build_layer_index(revised_file)
+    assert index["axis"] == "C"
+    first, second = index["layers"]
+    assert (first["line"], first["height"], first["x"], first["y"], first["feed"]) == (4, 0.3, 1, 2, 6000)
+    assert (first["pressures"], first["valves"]) == ({}, {})
+    assert (second["line"], second["height"], second["x"], second["y"], second["feed"]) == (10, 0.6, 3, 4, 600)
+    assert (second["pressures"], second["valves"]) == ({"1": 25.5}, {"1": 1})
+    with open(revised_file, 'rb') as file:
+        assert file.read()[second["offset"]:].startswith(b"G91\nG1 C0.3")
+
+
+def test_resume_file_starts_at_the_layer(revised_file, tmp_path):
+    resume_path = write_resume_file(revised_file, 2, str(tmp_path / "resume.gcode"), start_height=10)
+    with open(resume_path) as file:
+        lines = file.readlines()
+    preamble = ["G75\n", "$iglobal[0] = 1\n", "$rglobal[1] = 25.5\n", "$iglobal[1] = 1\n", "G90\n", "G0 C15.3\n",
+                "G0 X3 Y4\n", "G0 C10.3\n", "F600\n"]
+    assert lines == preamble + list(REVISED[9:])
+
+
+def test_resume_file_of_a_revised_job(slicer_file, tmp_path):
+    revised_path = str(tmp_path / "part_revised.gcode")
+    adjust_gcode_file(slicer_file, "C", output_path=revised_path, layer_index_path=layer_index_path_for(revised_path))
+    with open(revised_path) as file:
+        revised = file.read()
+    index = load_layer_index(revised_path)
+    assert len(index["layers"]) == 5
+    for entry in index["layers"]:
+        assert revised[:entry["offset"]].count("\n") + 1 == entry["line"]
+    resume_path = write_resume_file(revised_path, 3)
+    with open(resume_path) as file:
+        resumed = file.read()
+    layer = revised[index["layers"][2]["offset"]:]
+    assert layer.startswith("G91\nG1 C0.900 ")
+    preamble, resumed_layer = resumed[:-len(layer)], resumed[-len(layer):]
+    assert resumed_layer == layer
+    # Lowered to the height after the second layer change, with the feed in effect before the third
+    assert preamble.endswith("G0 C0.9\nF1200\n")
+
+
+def test_stale_index_is_rebuilt(revised_file):
+    index_path = layer_index_path_for(revised_file)
+    with open(index_path, 'w') as file:
+        json.dump({"version": 1, "size": 0, "axis": None, "layers": []}, file)
+    assert len(load_layer_index(revised_file)["layers"]) == 2
+    with open(index_path) as file:
+        assert len(json.load(file)["layers"]) == 2
+
+
+def test_resume_layer_out_of_range(revised_file):
+    with pytest.raises(ValueError):
+        write_resume_file(revised_file, 3)
@@ -0,0 +1,85 @@
+import math
+
+import pytest
+
+from motion_simulator import (CALIBRATION_ACCELERATIONS, MotionProfile, calibrate_motion_profile, load_layer_times,
+                              load_motion_profile, save_motion_profile, simulate_toolpath)
+from toolpath_format import parse_toolpath
+from use_this_Gcode_revision import adjust_gcode_file
+
+# 1000 mm/s^2 and no block time, so the times below follow from the trapezoids alone
+PROFILE = MotionProfile(acceleration=1000.0, min_segment_time=0.0)
+
+
+def _simulate(*lines, profile=PROFILE):
+    return simulate_toolpath(parse_toolpath(["G1 X0 Y0 F6000\n", *lines]), profile)
+
+
+def test_long_line_reaches_its_feed():
+    # 0.1 s each to accelerate to and brake from 100 mm/s over 5 mm, 90 mm at full speed
+    simulation = _simulate("G1 X100\n")
+    assert simulation["total_time"] == pytest.approx(0.1 + 0.9 + 0.1)
+    assert simulation["peak_speed"] == pytest.approx(100)
+    assert simulation["below_feed"] == 0
+
+
+def test_short_line_never_reaches_its_feed():
+    simulation = _simulate("G1 X1\n")
+    assert simulation["peak_speed"] == pytest.approx(math.sqrt(1000))
+    assert simulation["total_time"] == pytest.approx(2 * math.sqrt(1000) / 1000)
+    assert simulation["below_feed"] == 1
+
+
+def test_blending_keeps_the_speed_through_junctions():
+    assert _simulate("G1 X50\n", "G1 X100\n")["total_time"] == pytest.approx(1.1)
+    unblended = _simulate("G1 X50\n", "G1 X100\n", profile=MotionProfile(1000.0, blending=False, min_segment_time=0))
+    assert unblended["total_time"] == pytest.approx(2 * (0.1 + 0.4 + 0.1))
+    assert unblended["stops"] == 1
+
+    # A right angle slows down to the junction deviation speed but does not stop
+    corner = _simulate("G1 X50\n", "G1 X50 Y50\n")
+    assert 1.1 < corner["total_time"] < 1.2
+    assert corner["stops"] == 0
+
+
+def test_arcs_are_limited_by_centripetal_acceleration():
+    # A full speed circle of radius 1 would need 10000 mm/s^2
+    simulation = _simulate("G1 X10\n", "G3 X10 Y2 I0 J1\n", "G1 X0\n")
+    assert simulation["peak_speed"] == pytest.approx(100)
+    assert _simulate("G3 X0 Y2 I0 J1\n")["peak_speed"] == pytest.approx(math.sqrt(1000))
+
+
+def test_jerk_limit_and_block_time_only_add_time():
+    lines = ("G1 X10\n", "G1 X10 Y10\n", "G1 X0\n")
+    trapezoidal = _simulate(*lines)["total_time"]
+    s_curve = MotionProfile(1000.0, jerk=20000.0, min_segment_time=0)
+    assert _simulate(*lines, profile=s_curve)["total_time"] > trapezoidal
+    assert _simulate(*lines, profile=MotionProfile(1000.0, min_segment_time=0.5))["total_time"] == pytest.approx(2.0)
+
+
+def test_times_per_layer():
+    simulation = _simulate("G1 X100\n", "G91\n", "G1 C0.3 F60\n", "G90\n", "G1 X0 F6000\n")
+    # Up to the blended corners into and out of the 1 mm/s layer change
+    assert simulation["layer_time"] == pytest.approx([1.1, 0.3 + 1.1], abs=0.01)
+    assert simulation["layer_peak_speed"] == pytest.approx([100, 100])
+    assert simulation["total_time"] == pytest.approx(sum(simulation["layer_time"]))
+
+
+def test_calibration_recovers_the_profile(slicer_file, tmp_path):
+    revised_path = str(tmp_path / "part_revised.gcode")
+    adjust_gcode_file(slicer_file, "C", revised_path)
+    actual = MotionProfile(CALIBRATION_ACCELERATIONS[5], min_segment_time=0.002)
+    # Layer 0 holds no motion, a real run only measures the layers
+    layer_times = {layer: float(seconds)
+                   for layer, seconds in enumerate(simulate_toolpath(revised_path, actual)["layer_time"]) if layer}
+    times_path = tmp_path / "layer_times.csv"
+    times_path.write_text("layer,seconds\n# measured\n" + "".join(f"{layer},{seconds!r}\n"
+                                                                  for layer, seconds in layer_times.items()))
+    assert load_layer_times(str(times_path)) == layer_times
+
+    profile, error = calibrate_motion_profile(revised_path, layer_times)
+    assert (profile.acceleration, profile.min_segment_time) == (actual.acceleration, 0.002)
+    assert error == pytest.approx(0)
+    profile_path = str(tmp_path / "profile.json")
+    save_motion_profile(profile, profile_path)
+    assert load_motion_profile(profile_path).to_dict() == profile.to_dict()
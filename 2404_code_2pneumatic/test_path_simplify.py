@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from path_simplify import segment_distances, simplify_gcode_lines
+
+# Positioned at the origin, a straight extruded line cut into four moves, a slight kink and a travel back
+LINES = ["G0 X0 Y0 F6000\n", "G1 X1 Y0 E0.1\n", "G1 X2 Y0 E0.2\n", "G1 X3 Y0 E0.3\n", "G1 X4 Y0 E0.4\n",
+         "G1 X5 Y0.05 E0.5\n", "G1 X6 Y0 E0.6\n", "G1 X0 Y0\n"]
+
+
+def test_collinear_moves_are_merged():
+    stats = {}
+    out = list(simplify_gcode_lines(LINES, stats=stats))
+    assert out == ["G0 X0 Y0 F6000\n", "G1 X4 Y0 E0.4\n", "G1 X5 Y0.05 E0.5\n", "G1 X6 Y0 E0.6\n",
+                   "G1 X0 Y0\n"]
+    assert stats["segments_in"] == 7
+    assert stats["segments_out"] == 4
+    assert stats["run_length"] == pytest.approx(4 + 2 * np.hypot(1, 0.05) + 6)
+
+
+def test_tolerance_bounds_the_deviation():
+    assert list(simplify_gcode_lines(LINES, tolerance=0.01))[1:3] == ["G1 X4 Y0 E0.4\n", "G1 X5 Y0.05 E0.5\n"]
+    out = list(simplify_gcode_lines(LINES, tolerance=0.1))
+    assert out == ["G0 X0 Y0 F6000\n", "G1 X6 Y0 E0.6\n", "G1 X0 Y0\n"]
+
+
+def test_runs_stop_at_other_commands():
+    lines = ["G0 X0 Y0\n", "G1 X1 Y0 E1\n", "G1 X2 Y0 E2\n", "; perimeter\n", "G1 X3 Y0 E3\n", "G1 X4 Y0 E4\n",
+             "G1 X5 Y0 E5 F900\n", "G1 X6 Y0 E6\n"]
+    out = list(simplify_gcode_lines(lines))
+    assert out == ["G0 X0 Y0\n", "G1 X2 Y0 E2\n", "; perimeter\n", "G1 X4 Y0 E4\n", "G1 X5 Y0 E5 F900\n",
+                   "G1 X6 Y0 E6\n"]
+
+
+def test_relative_moves_are_passed_through():
+    lines = ["G0 X0 Y0\n", "G91\n", "G1 X1 Y0 E1\n", "G1 X1 Y0 E1\n", "G90\n"]
+    assert list(simplify_gcode_lines(lines)) == lines
+
+
+def test_reversing_moves_are_kept():
+    lines = ["G0 X0 Y0\n", "G1 X5 Y0 E1\n", "G1 X2 Y0 E2\n"]
+    assert list(simplify_gcode_lines(lines, tolerance=0.5)) == lines
+    assert segment_distances(np.array([[5.0, 0.0]]), np.array([0.0, 0.0]), np.array([2.0, 0.0])) == [3.0]
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from preflight_check import check_toolpath, load_limits_profile, print_report, save_limits_profile
+from toolpath_format import parse_toolpath
+
+# A line along X, a half circle bulging to X60 between two points at X50, a fast travel back and a layer change
+LINES = ["G0 X0 Y0 F6000\n", "G1 X50 Y0 F600\n", "G3 X50 Y20 I0 J10\n", "G1 X0 Y20 F6000\n", "G91\n", "G1 C0.3\n",
+         "G90\n"]
+
+
+@pytest.fixture
+def toolpath():
+    return parse_toolpath(LINES)
+
+
+def test_arcs_are_checked_along_their_bounding_box(toolpath):
+    report = check_toolpath(toolpath, {"X": {"min": 0, "max": 55, "max_speed": None},
+                                       "Y": {"min": 0, "max": 20, "max_speed": None}})
+    assert report["segments"] == 5
+    assert list(report["position"]["X"]) == [3]
+    assert "Y" not in report["position"] and not report["velocity"]
+    assert not check_toolpath(toolpath, {"X": {"min": 0, "max": 60, "max_speed": None}})["position"]
+
+
+def test_speeds_are_split_onto_the_axes(toolpath):
+    # 6000 mm/min is 100 mm/s along X for the travel back, the arc moves at 10 mm/s
+    report = check_toolpath(toolpath, {"X": {"min": None, "max": None, "max_speed": 50},
+                                       "Y": {"min": None, "max": None, "max_speed": 50}})
+    assert list(report["velocity"]["X"]) == [4]
+    assert "Y" not in report["velocity"] and not report["position"]
+
+
+def test_origin_shifts_the_vertical_axis(toolpath):
+    limits = {"C": {"min": None, "max": 0.2, "max_speed": None}}
+    assert list(check_toolpath(toolpath, limits)["position"]["C"]) == [6]
+    assert not check_toolpath(toolpath, limits, origin={"C": -1})["position"]
+
+
+def test_limits_profile_round_trip(tmp_path):
+    limits = {"X": {"min": -1.0, "max": 1.0, "max_speed": None}}
+    profile_path = str(tmp_path / "limits.json")
+    save_limits_profile(limits, profile_path)
+    assert load_limits_profile(profile_path) == limits
+    with open(profile_path, 'w') as file:
+        json.dump({"version": 0, "axes": limits}, file)
+    with pytest.raises(ValueError, match="unsupported limits profile version"):
+        load_limits_profile(profile_path)
+
+
+def test_print_report(toolpath, capsys):
+    assert not print_report(check_toolpath(toolpath, {"X": {"min": 0, "max": 10}}), max_lines=1)
+    assert capsys.readouterr().out == "X outside the soft limits on 3 lines: 2 and 2 more\n"
+    assert print_report(check_toolpath(toolpath, {"X": {"min": None, "max": None}}))
+    assert capsys.readouterr().out == "All 5 segments within limits\n"
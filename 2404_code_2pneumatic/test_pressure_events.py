@@ -0,0 +1,65 @@
+import pytest
+
+from aeroscript_compiler import aeroscript_statements
+from fake_controller import FakeController
+from pressure_events import RUNNING_GLOBAL, PressureEventListener, PressureSchedule, annotate_pressure_events
+from toolpath_format import parse_toolpath
+
+
+def test_reset_sets_the_running_flag_before_the_program_starts():
+    controller = FakeController()
+    listener = PressureEventListener(controller, lambda channel, pressure: None, lambda channel, is_open: None)
+    listener.reset()
+    assert controller.runtime.variables.global_.get_integer(RUNNING_GLOBAL) == 1
+    assert listener.poll() == 1
+
+
+def test_program_pressures_keep_hundredths():
+    controller = FakeController()
+    sent = []
+    listener = PressureEventListener(controller, lambda channel, pressure: sent.append((channel, pressure)),
+                                     lambda channel, is_open: None)
+    listener.reset()
+    controller.runtime.variables.global_.set_real(1, 25.55)
+    listener.poll()
+    assert sent == [(1, 25.55)]
+
+
+def test_run_returns_when_the_task_faults_with_the_flag_set():
+    controller = FakeController()
+    listener = PressureEventListener(controller, lambda channel, pressure: None, lambda channel, is_open: None,
+                                     poll_interval=0.0)
+    listener.reset()
+    controller.runtime.tasks[1].status.task_state = "Error"
+    assert listener.run()["polls"] == 1
+
+
+def test_programs_without_events_keep_their_globals():
+    controller = FakeController()
+    variables = controller.runtime.variables.global_
+    variables.set_real(1, 7.5)  # Used by the program for something else
+    variables.set_integer(1, 3)
+    sent = []
+    listener = PressureEventListener(controller, lambda channel, pressure: sent.append((channel, pressure)),
+                                     lambda channel, is_open: sent.append((channel, is_open)),
+                                     host_pressures=lambda: (20, 30), poll_interval=0.0, program_events=False)
+    controller.runtime.tasks[1].status.task_state = "ProgramRunning"
+    listener.poll()
+    controller.runtime.tasks[1].program.stop()
+    listener.run()
+    assert sent == [(1, 20), (2, 30)]
+    assert variables.get_real(1) == 7.5 and variables.get_integer(1) == 3
+
+
+def test_tools_outside_the_channels_are_rejected():
+    lines = ["T2\n", "G1 X1 Y1 E1\n"]
+    with pytest.raises(ValueError, match="T2"):
+        list(annotate_pressure_events(lines, PressureSchedule()))
+    assert list(annotate_pressure_events(lines, PressureSchedule(valve_events=False))) == lines
+
+
+def test_toolpath_channels_outside_the_channels_are_rejected():
+    toolpath = parse_toolpath(["G0 X0 Y0\n", "G1 X1 Y1\n"])
+    toolpath['channel'][1] = 3
+    with pytest.raises(ValueError, match="Channel 3"):
+        list(aeroscript_statements(toolpath))
@@ -0,0 +1,45 @@
+import pytest
+
+from fake_arduino import FakeArduino
+from pressure_protocol import OP_SET_PRESSURE, OP_SET_VALVE, FrameDecoder, FrameEncoder, text_commands
+from serial_writer import SerialWriter
+
+COMMANDS = [(OP_SET_PRESSURE, 1, 20), (OP_SET_VALVE, 1, True), (OP_SET_VALVE, 2, False)]
+
+
+def test_frames_carry_the_opcode_of_every_command():
+    (frame,) = FrameDecoder().feed(FrameEncoder()(COMMANDS))
+    assert [(entry.opcode, entry.channel, entry.value) for entry in frame.value] == \
+        [(OP_SET_PRESSURE, 1, 20), (OP_SET_VALVE, 1, 1), (OP_SET_VALVE, 2, 0)]
+
+
+def test_text_commands_keep_the_firmware_values():
+    assert text_commands(COMMANDS) == b"1,20\n1,-1\n2,-2\n"
+
+
+@pytest.mark.parametrize("encode", [FrameEncoder(), text_commands])
+@pytest.mark.parametrize("pressure", [-1, -2, 100.5])
+def test_out_of_range_pressures_are_rejected(encode, pressure):
+    with pytest.raises(ValueError, match="out of range"):
+        encode([(OP_SET_PRESSURE, 1, pressure)])
+
+
+def test_writer_rejects_out_of_range_pressures_before_queuing():
+    port = FakeArduino(115200)
+    writer = SerialWriter(port, FrameEncoder())
+    with pytest.raises(ValueError):
+        writer.set_channels({1: 30, 2: -1})
+    writer.close()
+    assert port.setpoints == {1: 0, 2: 0} and port.valves == {1: False, 2: False}
+
+
+def test_writer_keeps_hundredths_in_frames_and_rounds_text_commands():
+    binary_port = FakeArduino(115200)
+    text_port = FakeArduino(115200, protocol_version=None)
+    for port, encode in ((binary_port, FrameEncoder()), (text_port, text_commands)):
+        writer = SerialWriter(port, encode)
+        writer.set_pressure(1, 25.554)
+        writer.set_channels({2: 40.25})
+        writer.close()
+    assert binary_port.setpoints == {1: 25.55, 2: 40.25}
+    assert text_port.commands == [(1, 26), (2, 40)]
@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+import pytest
+
+from fake_arduino import FakeArduino
+from pressure_protocol import (OP_ACK, OP_PRESSURE, OP_SET_PRESSURE, OP_SET_VALVE, OP_TELEMETRY, FrameDecoder,
+                               FrameEncoder, encode_batch, request_hello)
+from pressure_telemetry import TelemetryBuffer, TelemetryReader, save_telemetry, telemetry_records
+
+
+def _filled_buffer(count, capacity=8):
+    buffer = TelemetryBuffer(capacity)
+    for index in range(count):
+        buffer.append(float(index), 1 + index % 2, 10.0, 9.5, index % 2)
+    return buffer
+
+
+def test_ring_buffer_keeps_the_newest_records():
+    buffer = _filled_buffer(20)
+    assert (len(buffer), buffer.count) == (8, 20)
+    # The oldest slot of a full buffer is the one written next, a lock-free copy leaves it out
+    assert list(buffer.snapshot()['time']) == list(range(13, 20))
+    assert list(buffer.snapshot(3)['time']) == [17, 18, 19]
+    assert len(_filled_buffer(3).snapshot()) == 3
+
+
+def test_since_picks_up_where_the_reader_left_off():
+    buffer = _filled_buffer(20)
+    records, count = buffer.since(18)
+    assert (list(records['time']), count) == ([18, 19], 20)
+    # Records overwritten before they were read are lost
+    assert list(buffer.since(5)[0]['time']) == list(range(13, 20))
+    assert len(buffer.since(20)[0]) == 0
+
+
+def test_latest_record_per_channel():
+    buffer = _filled_buffer(11)
+    assert buffer.latest(1)['time'] == 10
+    assert buffer.latest(2)['time'] == 9
+    assert buffer.latest(3) is None
+
+
+def test_telemetry_frames_become_one_record_per_channel():
+    entries = [(OP_SET_PRESSURE, 1, 20), (OP_PRESSURE, 1, 19.5), (OP_SET_VALVE, 1, True),
+               (OP_SET_PRESSURE, 2, 30), (OP_PRESSURE, 2, 31.25), (OP_SET_VALVE, 2, False)]
+    frame, = FrameDecoder().feed(encode_batch(entries, 0, OP_TELEMETRY))
+    assert telemetry_records(frame, 0.0) == {1: (20, 19.5, 1), 2: (30, 31.25, 0)}
+
+
+def test_reader_records_the_box_telemetry(tmp_path):
+    port = FakeArduino(baud_rate=10 ** 6, telemetry_interval=0.01, seed=0)
+    port.setpoints = {1: 20.0, 2: 35.0}
+    assert request_hello(port) is not None
+    other_frames = []
+    reader = TelemetryReader(port, TelemetryBuffer(64), on_frame=other_frames.append).start()
+    port.write(FrameEncoder()([(OP_SET_PRESSURE, 1, 25)]))
+    deadline = time.perf_counter() + 5
+    while time.perf_counter() < deadline and (reader.stats["frames"] < 5 or reader.buffer.latest(1) is None
+                                              or reader.buffer.latest(1)['setpoint'] != 25):
+        time.sleep(0.01)
+    reader.stop()
+    port.close()
+    assert reader.failure is None
+    assert reader.stats["records"] == 2 * reader.stats["frames"] >= 10
+    assert [frame.opcode for frame in other_frames] == [OP_ACK]
+    assert reader.buffer.latest(1)['setpoint'] == 25
+    assert reader.buffer.latest(2)['setpoint'] == 35
+
+    csv_path = str(tmp_path / "telemetry.csv")
+    records = reader.buffer.snapshot()
+    save_telemetry(records, csv_path)
+    saved = np.genfromtxt(csv_path, delimiter=",", names=True)
+    assert list(saved.dtype.names) == ["time", "channel", "setpoint", "pressure", "valve"]
+    assert saved['pressure'] == pytest.approx(records['pressure'], abs=0.005)
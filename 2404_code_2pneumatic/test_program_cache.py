@@ -0,0 +1,68 @@
+import pytest
+
+import program_cache
+from fake_controller import FAKE_COMPILED_MAGIC, FakeController
+from program_cache import CONTROLLER_DIR, ProgramCache
+
+SOURCE = "program\n\tMoveLinear([X, Y], [10, 0], 10)\nend\n"
+
+
+@pytest.fixture
+def controller():
+    return FakeController(compile_seconds_per_mb=0.0)
+
+
+@pytest.fixture
+def cache(tmp_path, controller):
+    return ProgramCache(str(tmp_path / "cache"), controller.compile_program)
+
+
+def test_host_program_runs_compiled_from_the_controller_file_system(tmp_path, controller, cache):
+    source_path = tmp_path / "job.ascript"
+    source_path.write_text(SOURCE)
+    program_path = cache.run(controller, str(source_path))
+    task = controller.runtime.tasks[1]
+    assert program_path.startswith(CONTROLLER_DIR + "/") and program_path.endswith(".a1exe")
+    assert task.runs == [program_path]
+    assert controller.files.read_bytes(program_path).startswith(FAKE_COMPILED_MAGIC)
+    assert controller.compiles == [str(source_path)]
+
+    # Unchanged source: neither compiled nor uploaded again
+    assert cache.run(controller, str(source_path)) == program_path
+    assert controller.compiles == [str(source_path)]
+    assert controller.files.uploads == [program_path]
+    assert cache.stats["hits"] == cache.stats["misses"] == cache.stats["uploads"] == 1
+
+
+def test_controller_program_runs_as_it_is(controller, cache):
+    controller.files.write_bytes("test20240110.ascript", SOURCE.encode())
+    assert cache.run(controller, "test20240110.ascript") == "test20240110.ascript"
+    assert controller.runtime.tasks[1].runs == ["test20240110.ascript"]
+    assert controller.compiles == ["test20240110.ascript"]  # Compiled by the controller
+    assert controller.files.uploads == []
+    assert cache.stats["misses"] == 0 and cache.stats["controller_compiles"] == 1
+
+
+def test_program_missing_on_both_sides_fails(controller, cache):
+    with pytest.raises(FileNotFoundError):
+        cache.run(controller, "missing.ascript")
+
+
+def test_without_host_compiler_the_controller_compiles(tmp_path, monkeypatch, controller):
+    monkeypatch.setattr(program_cache, "_automation1_compiler", lambda: None)
+    cache = ProgramCache(str(tmp_path / "cache"))
+    source_path = tmp_path / "job.ascript"
+    source_path.write_text(SOURCE)
+    assert cache.run(controller, str(source_path)) == f"{CONTROLLER_DIR}/job.ascript"
+    assert controller.files.read_bytes(f"{CONTROLLER_DIR}/job.ascript") == SOURCE.encode()
+    assert controller.compiles == [f"{CONTROLLER_DIR}/job.ascript"]
+
+
+def test_cache_directory_is_created_by_the_first_compile(tmp_path, controller):
+    cache = ProgramCache(str(tmp_path / "cache"), controller.compile_program)
+    cache.clear()
+    assert not (tmp_path / "cache").exists()
+    source_path = tmp_path / "job.ascript"
+    source_path.write_text(SOURCE)
+    cache.run(controller, str(source_path))
+    assert (tmp_path / "cache").is_dir()
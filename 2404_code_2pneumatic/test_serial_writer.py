@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+from fake_arduino import FakeArduino
+from serial_writer import SerialWriter
+
+
+class HeldPort(FakeArduino):
+    '''
+    A text-only fake box whose writes wait until the test releases them, so commands can be
+    submitted while a write is in flight.
+    '''
+
+    def __init__(self):
+        super().__init__(baud_rate=10 ** 9, protocol_version=None)
+        self.writing = threading.Event()
+        self.release = threading.Event()
+        self.writes = []
+
+    def write(self, data):
+        self.writing.set()
+        self.release.wait()
+        self.writes.append(data)
+        return super().write(data)
+
+
+@pytest.fixture
+def port():
+    return HeldPort()
+
+
+def _start_held_write(writer, port):
+    writer.set_pressure(1, 15)
+    assert port.writing.wait(1)
+
+
+def test_pending_commands_coalesce_while_a_write_is_in_flight(port):
+    writer = SerialWriter(port)
+    _start_held_write(writer, port)
+    writer.set_pressure(2, 30)
+    writer.set_pressure(1, 20)
+    writer.set_valve(2, True)
+    writer.set_pressure(1, 25)
+    port.release.set()
+    assert writer.flush(1)
+    # The newest value of each channel, in the order the channels were first submitted, in one write
+    assert port.writes == [b"1,15\n", b"2,30\n1,25\n2,-1\n"]
+    assert port.commands == [(1, 15), (2, 30), (1, 25), (2, -1)]
+    assert (writer.stats["coalesced"], writer.stats["writes"], writer.stats["commands"]) == (1, 2, 4)
+    writer.close()
+
+
+def test_unchanged_values_are_not_sent(port):
+    port.release.set()
+    writer = SerialWriter(port)
+    writer.set_channels({1: 15, 2: 15}, {1: True})
+    assert writer.flush(1)
+    assert port.writes == [b"1,15\n2,15\n1,-1\n"]
+    writer.set_pressure(1, 15)
+    writer.set_valve(1, True)
+    assert writer.flush(1)
+    assert len(port.writes) == 1 and writer.stats["dropped"] == 2
+    writer.resend()
+    writer.set_pressure(1, 15)
+    writer.close()
+    assert port.writes[1:] == [b"1,15\n"]
+    assert not port.is_open
+
+
+def test_value_changed_back_is_withdrawn(port):
+    writer = SerialWriter(port)
+    _start_held_write(writer, port)
+    writer.set_pressure(2, 40)
+    writer.set_pressure(1, 20)
+    writer.set_pressure(1, 15)  # What the write in flight sends already
+    port.release.set()
+    writer.close()
+    assert port.writes == [b"1,15\n", b"2,40\n"]
+
+
+def test_closed_writer_rejects_commands(port):
+    port.release.set()
+    writer = SerialWriter(port)
+    writer.close()
+    writer.close()
+    with pytest.raises(RuntimeError, match="closed"):
+        writer.set_pressure(1, 10)
+
+
+def test_write_errors_reach_the_caller(port):
+    port.release.set()
+    port.is_open = False
+    writer = SerialWriter(port)
+    writer.set_pressure(1, 10)
+    with pytest.raises(OSError, match="Port not open"):
+        writer.flush(1)
+    with pytest.raises(OSError):
+        writer.set_pressure(1, 20)
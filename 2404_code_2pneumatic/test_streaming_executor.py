@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+from fake_controller import FakeController
+from streaming_executor import StreamingExecutor
+
+
+def _statements(count):
+    for index in range(count):
+        yield f"MoveLinear([X], [{index}], 10)"
+    yield "$iglobal[5] = 3"
+
+
+def test_queue_stays_below_the_high_watermark():
+    controller = FakeController(commands_per_second=20000)
+    stats = StreamingExecutor(controller, capacity=100, poll_interval=0.001).run(_statements(2000))
+    command_queue, = controller.command_queues
+    assert stats["commands"] == command_queue.executed == 2001
+    assert stats["max_depth"] == 90
+    assert stats["refills"] > 2000 // 90
+    assert controller.runtime.variables.global_.get_integer(5) == 3
+    assert command_queue.is_ended
+    assert controller.runtime.tasks[1].status.task_state == "Idle"
+
+
+def test_stop_event_aborts_the_stream():
+    controller = FakeController(commands_per_second=1000)
+    stop_event = threading.Event()
+    stop_event.set()
+    stats = StreamingExecutor(controller, capacity=100).run(_statements(2000), stop_event)
+    assert stats["aborted"]
+    assert stats["commands"] == 90
+    assert controller.command_queues[0].is_paused
+
+
+def test_producer_errors_reach_the_caller():
+    def statements():
+        yield "MoveLinear([X], [1], 10)"
+        raise ValueError("Broken toolpath")
+
+    with pytest.raises(ValueError, match="Broken toolpath"):
+        StreamingExecutor(FakeController(commands_per_second=1e6)).run(statements())
+
+
+def test_watermarks_are_checked():
+    with pytest.raises(ValueError, match="Watermarks"):
+        StreamingExecutor(FakeController(), low_watermark=0.9, high_watermark=0.5)
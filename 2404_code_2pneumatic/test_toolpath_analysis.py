@@ -0,0 +1,38 @@
+import math
+
+import numpy as np
+import pytest
+
+from toolpath_analysis import analyze_toolpath, segment_lengths
+from toolpath_format import parse_toolpath
+
+# Travel to the origin, a line and a half circle deposited, a layer change and a travel back
+LINES = ["G0 X0 Y0 F6000\n", "G1 X10 Y0 F600\n", "G3 X10 Y10 I0 J5\n", "G91\n", "G1 C0.3 F60\n", "G90\n",
+         "G0 X0 Y0 F6000\n"]
+
+
+@pytest.fixture
+def toolpath():
+    toolpath = parse_toolpath(LINES)
+    toolpath['channel'][2] = 2  # The half circle on the second nozzle
+    return toolpath
+
+
+def test_segment_lengths_measure_arcs_along_the_arc(toolpath):
+    assert segment_lengths(toolpath) == pytest.approx([0, 10, 5 * math.pi, 0.3, math.hypot(10, 10)])
+
+
+def test_analysis_per_layer_and_channel(toolpath):
+    analysis = analyze_toolpath(toolpath)
+    assert analysis["print_length"] == pytest.approx(10 + 5 * math.pi)
+    assert analysis["travel_length"] == pytest.approx(0.3 + math.hypot(10, 10))
+    # Feeds are mm/min: 600 for the deposition, 60 for the layer change and 6000 for travel
+    assert analysis["layer_time"] == pytest.approx([1 + math.pi / 2, 0.3 + math.hypot(10, 10) / 100])
+    assert analysis["total_time"] == pytest.approx(analysis["layer_time"].sum())
+    assert analysis["channel_length"][1:] == pytest.approx([10, 5 * math.pi])
+    assert analysis["channel_volume"][1:] == pytest.approx(np.array([10, 5 * math.pi]) * math.pi * 0.04)
+
+
+def test_block_rate_limits_short_segments(toolpath):
+    layer_time = analyze_toolpath(toolpath, min_segment_time=0.5)["layer_time"]
+    assert layer_time == pytest.approx([0.5 + 1 + math.pi / 2, 0.5 + 0.5])
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from toolpath_format import (OPCODE_ARC_CCW, OPCODE_LINEAR, OPCODE_RAPID, HEADER_SIZE, ToolpathBuilder,
+                             ToolpathWriter, open_toolpath, parse_toolpath, read_toolpath_header)
+from use_this_Gcode_revision import adjust_gcode_file, read_gcode_lines
+
+REVISED_LINES = ["G75\n", "$iglobal[0] = 1\n", "G0 X1 Y2 F6000\n", "G1 X5 Y2 F1200\n", "G91\n", "G1 C0.3\n",
+                 "G90\n", "G3 X5 Y6 I0 J2\n", "$iglobal[0] = 0\n"]
+
+
+def test_records_follow_the_revised_program():
+    toolpath = parse_toolpath(REVISED_LINES)
+    assert toolpath['opcode'].tolist() == [OPCODE_RAPID, OPCODE_LINEAR, OPCODE_LINEAR, OPCODE_ARC_CCW]
+    assert toolpath['layer'].tolist() == [0, 0, 1, 1]
+    assert toolpath['line'].tolist() == [3, 4, 6, 8]
+    assert toolpath['channel'].tolist() == [0, 1, 0, 1]  # Travel, deposition, layer change, deposition
+    assert toolpath[-1][['x', 'y', 'c', 'j', 'feed']].tolist() == (5.0, 6.0, np.float32(0.3), 2.0, 1200.0)
+
+
+def test_file_maps_the_records_written(tmp_path):
+    file_path = str(tmp_path / "part.toolpath")
+    with ToolpathWriter(file_path, chunk_size=2) as writer:
+        writer.add_lines(REVISED_LINES)
+    toolpath = open_toolpath(file_path)
+    assert isinstance(toolpath, np.memmap)
+    assert read_toolpath_header(file_path) == (4, 1)
+    assert toolpath.tobytes() == parse_toolpath(REVISED_LINES).tobytes()
+
+
+def test_other_files_are_rejected(tmp_path):
+    file_path = tmp_path / "part.toolpath"
+    file_path.write_bytes(b"G1 X1 Y1\n" * (HEADER_SIZE // 9 + 1))
+    with pytest.raises(ValueError, match="not a toolpath file"):
+        open_toolpath(str(file_path))
+
+
+def test_revision_writes_the_toolpath_of_its_output(slicer_file, tmp_path):
+    output_path = str(tmp_path / "part_revised.gcode")
+    stats = adjust_gcode_file(slicer_file, "C", output_path, toolpath_path="")
+    assert stats["toolpath_path"] == str(tmp_path / "part_revised.toolpath")
+    builder = ToolpathBuilder()
+    builder.add_lines(read_gcode_lines(output_path))
+    written = open_toolpath(stats["toolpath_path"])
+    expected = builder.to_array()
+    # The writer knows which moves extrude from the E words, re-parsing the output does not
+    for field in ('opcode', 'layer', 'line', 'x', 'y', 'c', 'feed'):
+        assert np.array_equal(written[field], expected[field])
+    revised_lines = list(read_gcode_lines(output_path))
+    assert all(revised_lines[line - 1].startswith(("G0 ", "G1 ")) for line in written['line'].tolist())
@@ -0,0 +1,47 @@
+from travel_optimizer import optimize_travel_lines
+
+
+def _path(x, y, length):
+    return [f"G0 X{x} Y{y}\n", "$iglobal[1] = 1\n", f"G1 X{x + length} Y{y}\n", "$iglobal[1] = 0\n"]
+
+
+def _layer(number, far_first):
+    paths = [_path(0, 0, 10), _path(50, 50, 10), _path(11, 0, 9)] if far_first else \
+        [_path(20, 0, -10), _path(60, 50, -10), _path(9, 0, -9)]
+    header = ["; layer 0\n", "F600\n"] if number == 0 else [f"; layer {number}\n", "G91\n", "G1 C0.3\n", "G90\n"]
+    return header, paths
+
+
+def _split(lines):
+    '''
+    Returns the barrier lines and, per region between them, the paths as tuples of lines.
+    '''
+    barriers, regions = [], [[]]
+    for line in lines:
+        if line.startswith("G0"):
+            regions[-1].append([line])
+        elif regions[-1] and (line.startswith("$iglobal[1]") or line.startswith("G1 X")):
+            regions[-1][-1].append(line)
+        else:
+            barriers.append(line)
+            regions.append([])
+    return barriers, [sorted(map(tuple, region)) for region in regions]
+
+
+def test_paths_move_as_a_whole_within_their_layer():
+    lines = []
+    for number in range(3):
+        header, paths = _layer(number, number % 2 == 0)
+        lines += header + [line for path in paths for line in path]
+    lines += ["$iglobal[0] = 0\n"]
+    stats = {}
+    output = list(optimize_travel_lines(lines, stats))
+    assert stats["travel_after"] < stats["travel_before"]
+    assert output != lines
+    assert _split(output) == _split(lines)
+    # Every layer comment still precedes the paths of its layer only
+    for number in range(3):
+        start = output.index(f"; layer {number}\n")
+        end = output.index(f"; layer {number + 1}\n") if number < 2 else len(output) - 1
+        xs = {float(line.split()[1][1:]) for line in output[start:end] if line.startswith("G0")}
+        assert xs == ({0, 50, 11} if number % 2 == 0 else {20, 60, 9})
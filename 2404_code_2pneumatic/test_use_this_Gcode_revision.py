@@ -0,0 +1,140 @@
+import functools
+import itertools
+import os
+
+import pytest
+
+import use_this_Gcode_revision
+from gcode_benchmark import legacy_revise_lines
+from use_this_Gcode_revision import (LAYER_CHANGE_PREFIXES, adjust_gcode_file, adjust_gcode_variants,
+                                     filter_gcode_lines, iter_layer_blocks, read_gcode_lines, revise_gcode_lines,
+                                     rewrite_gcode_lines)
+
+
+def _rewrite(*lines):
+    return list(rewrite_gcode_lines(lines, "C"))
+
+
+@pytest.mark.parametrize("line, revised", [
+    ("G1X5Y5E4\n", ["G1 X5 Y5\n"]),  # Packed words lose their extrusion word too
+    ("G1 Z0.3 E1 F300\n", ["G91\n", "G1 C0.3 F300\n", "G90\n"]),
+    ("G1 Z0.9 X1 Y2 E0.5 F600\n", ["G91\n", "G1 C0.9 F600\n", "G90\n", "G1 X1 Y2\n"]),
+    ("T10\n", []),  # Every tool change is dropped, not only T0 to T3
+    ("M30\n", []),  # The footer ends the program after clearing $iglobal[0]
+    ("G1 X1 Y2 E0.5 ; switch to T0\n", ["G1 X1 Y2 ; switch to T0\n"]),
+    ("; T0 here\n", ["; T0 here\n"]),
+])
+def test_rewrite(line, revised):
+    assert _rewrite(line) == revised
+
+
+def test_z_never_reaches_the_gantry():
+    lines = ["G1 Z0.3\n", "G1 Z0.6 X1\n", "G1Z0.9X2\n", "g1 z1.2 y3\n"]
+    assert not any("Z" in line for line in _rewrite(*lines))
+
+
+def _read(file_path):
+    with open(file_path) as file:
+        return file.read()
+
+
+def test_revision_matches_the_legacy_script(slicer_file, tmp_path):
+    output_path = str(tmp_path / "part_revised.gcode")
+    stats = adjust_gcode_file(slicer_file, "C", output_path)
+    assert _read(output_path) == "".join(legacy_revise_lines(read_gcode_lines(slicer_file), "C"))
+    assert stats["lines_out"] == _read(output_path).count("\n")
+
+
+def test_revision_streams_its_input():
+    endless = itertools.chain(["; process Process1\n"], itertools.cycle(["G1 X1 Y1 E1\n", "G1 Z0.3\n"]))
+    assert list(itertools.islice(revise_gcode_lines(endless, "C"), 6)) == \
+        ["G75\n", "$iglobal[0] = 1\n", "; process Process1\n", "G1 X1 Y1\n", "G91\n", "G1 C0.3\n"]
+
+
+def test_revised_file_never_replaces_the_input(tmp_path):
+    input_path = tmp_path / "part.nc"
+    input_path.write_text("; process Process1\nG1 X1 Y1 E1\n")
+    stats = adjust_gcode_file(str(input_path), "C")
+    assert stats["revised_file_path"] == str(tmp_path / "part_revised.nc")
+    assert input_path.read_text() == "; process Process1\nG1 X1 Y1 E1\n"
+    os.symlink(input_path, tmp_path / "link.nc")
+    for output_path in (input_path, tmp_path / "link.nc"):
+        with pytest.raises(ValueError, match="is the input file"):
+            adjust_gcode_file(str(input_path), "C", str(output_path))
+    assert input_path.read_text() == "; process Process1\nG1 X1 Y1 E1\n"
+
+
+def test_blocks_are_whole_layers_of_the_filtered_file(slicer_file):
+    blocks = list(iter_layer_blocks(slicer_file, block_size=40000))
+    assert len(blocks) > 3
+    assert "".join(blocks) == "".join(filter_gcode_lines(read_gcode_lines(slicer_file)))
+    assert all(block.startswith(LAYER_CHANGE_PREFIXES) for block in blocks[1:-1])
+
+
+@pytest.mark.parametrize("arc_tolerance", [None, 0.01])
+def test_parallel_revision_is_identical_to_the_sequential_one(slicer_file, tmp_path, monkeypatch, arc_tolerance):
+    sequential_path = str(tmp_path / "sequential.gcode")
+    parallel_path = str(tmp_path / "parallel.gcode")
+    adjust_gcode_file(slicer_file, "C", sequential_path, arc_tolerance=arc_tolerance)
+    # Small blocks, so every worker gets several
+    monkeypatch.setattr(use_this_Gcode_revision, "iter_layer_blocks",
+                        functools.partial(iter_layer_blocks, block_size=40000))
+    stats = adjust_gcode_file(slicer_file, "C", parallel_path, workers=2, arc_tolerance=arc_tolerance)
+    assert _read(parallel_path) == _read(sequential_path)
+    assert stats["lines_out"] == _read(parallel_path).count("\n")
+
+
+def test_cached_revision_revises_only_changed_layers(slicer_file, tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite")
+    sequential_path = str(tmp_path / "sequential.gcode")
+    cached_path = str(tmp_path / "cached.gcode")
+    adjust_gcode_file(slicer_file, "C", sequential_path)
+    first = adjust_gcode_file(slicer_file, "C", cached_path, cache_path=cache_path)
+    assert _read(cached_path) == _read(sequential_path)
+    assert first["layers_reused"] == 0 and first["layers_revised"] > 3
+
+    second = adjust_gcode_file(slicer_file, "C", cached_path, cache_path=cache_path)
+    assert _read(cached_path) == _read(sequential_path)
+    assert second["layers_reused"] == first["layers_revised"] and second["layers_revised"] == 0
+
+    # One move of the third layer edited: only that layer is revised again
+    edited_file = str(tmp_path / "edited.gcode")
+    text = _read(slicer_file)
+    layer_start = text.index("G1 Z0.900")
+    move = text.index("G1 X", layer_start)
+    with open(edited_file, "w") as file:
+        file.write(text[:move] + "G1 X1.5 Y2.5 E0.1\n" + text[move:])
+    adjust_gcode_file(edited_file, "C", sequential_path)
+    third = adjust_gcode_file(edited_file, "C", cached_path, cache_path=cache_path)
+    assert _read(cached_path) == _read(sequential_path)
+    assert third["layers_revised"] == 1
+
+    # Other settings revise every layer
+    assert adjust_gcode_file(slicer_file, "D", cached_path, cache_path=cache_path)["layers_reused"] == 0
+
+
+def test_variants_are_identical_to_single_revisions(slicer_file, tmp_path):
+    variant_paths = [str(tmp_path / "variant_c.gcode"), str(tmp_path / "variant_d.gcode")]
+    stats = adjust_gcode_variants(slicer_file, ["C", "D"], variant_paths, arc_tolerance=0.01)
+    for letter, variant_path, lines_out in zip("CD", variant_paths, stats["lines_out"]):
+        single_path = str(tmp_path / f"single_{letter}.gcode")
+        adjust_gcode_file(slicer_file, letter, single_path, arc_tolerance=0.01)
+        assert _read(variant_path) == _read(single_path)
+        assert lines_out == _read(variant_path).count("\n")
+
+
+def test_variant_offsets_shift_absolute_positions(tmp_path):
+    input_path = tmp_path / "part.gcode"
+    input_path.write_text("; process Process1\nG1 Z0.3\nG0 X1 Y2\nG91\nG1 X1 Y1 E1\nG90\nG92 X0\nG2 X3 Y4 I1 J0\n")
+    output_path = tmp_path / "part_d.gcode"
+    adjust_gcode_variants(str(input_path), ["D:10,-1,0.5"], [str(output_path)])
+    assert output_path.read_text() == ("G75\n$iglobal[0] = 1\nG91\nG0 D0.5\nG90\n; process Process1\n"
+                                       "G91\nG1 D0.3\nG90\nG0 X11 Y1\nG91\nG1 X1 Y1\nG90\nG92 X10\n"
+                                       "G2 X13 Y3 I1 J0\n$iglobal[0] = 0\n")
+
+
+def test_variants_need_their_own_outputs(slicer_file, tmp_path):
+    with pytest.raises(ValueError, match="own output path"):
+        adjust_gcode_variants(slicer_file, ["C", "D"], [str(tmp_path / "same.gcode")] * 2)
+    with pytest.raises(ValueError, match="more than three offsets"):
+        adjust_gcode_variants(slicer_file, ["C:1,2,3,4"])
@@ -0,0 +1,137 @@
+import argparse
+import time
+
+import numpy as np
+
+from gcode_io import open_gcode_file
+from toolpath_format import AXES, OPCODE_ARC_CCW, OPCODE_ARC_CW, open_toolpath, parse_toolpath
+
+# Bead diameter used for the material estimate, same as nozzleDiam in the raster scripts
+NOZZLE_DIAMETER = 0.400
+# Feed (mm/min) assumed for moves issued before any F word
+DEFAULT_FEED = 600.0
+
+
+def load_toolpath(source):
+    '''
+    Returns a toolpath array from a .toolpath file, a revised .gcode (.gz/.xz) file or an array.
+    '''
+    if isinstance(source, np.ndarray):
+        return source
+    if str(source).endswith(".toolpath"):
+        return open_toolpath(source)
+    with open_gcode_file(source) as file:
+        return parse_toolpath(file)
+
+
+def segment_points(toolpath, origin=None):
+    '''
+    Returns (starts, ends), two (n, 7) arrays with the X/Y/Z/A/B/C/D start and end point of
+    every segment. A segment starts at the previous end point, the first one at origin (a
+    sequence of 7 positions) or, without one, where it ends.
+    '''
+    ends = np.column_stack([toolpath[axis].astype(np.float64) for axis in AXES])
+    starts = np.empty_like(ends)
+    if len(ends):
+        starts[0] = ends[0] if origin is None else origin
+        starts[1:] = ends[:-1]
+    return starts, ends
+
+
+def arc_geometry(toolpath, starts, ends, arcs):
+    '''
+    Returns (center, radius, start_angle, sweep) of the arc segments selected by the arcs mask,
+    center being (m, 2) in XY. Clockwise arcs sweep negative angles, a zero sweep is a full circle.
+    '''
+    i = toolpath['i'][arcs].astype(np.float64)
+    j = toolpath['j'][arcs].astype(np.float64)
+    start_xy = starts[arcs, :2]
+    end_xy = ends[arcs, :2]
+    center = start_xy + np.column_stack([i, j])
+    radius = np.hypot(i, j)
+    start_angle = np.arctan2(start_xy[:, 1] - center[:, 1], start_xy[:, 0] - center[:, 0])
+    end_angle = np.arctan2(end_xy[:, 1] - center[:, 1], end_xy[:, 0] - center[:, 0])
+    sweep = end_angle - start_angle
+    clockwise = toolpath['opcode'][arcs] == OPCODE_ARC_CW
+    sweep = np.where(clockwise, -np.mod(-sweep, 2 * np.pi), np.mod(sweep, 2 * np.pi))
+    sweep[sweep == 0] = np.where(clockwise[sweep == 0], -2 * np.pi, 2 * np.pi)
+    return center, radius, start_angle, sweep
+
+
+def segment_lengths(toolpath):
+    '''
+    Returns the path length of every segment. Arcs (G2/G3) are measured along the arc in XY
+    with their I/J centre offsets, combined with any linear motion of the other axes.
+    '''
+    starts, ends = segment_points(toolpath)
+    delta = ends - starts
+    lengths = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+
+    opcode = toolpath['opcode']
+    arcs = (opcode == OPCODE_ARC_CW) | (opcode == OPCODE_ARC_CCW)
+    if arcs.any():
+        _, radius, _, sweep = arc_geometry(toolpath, starts, ends, arcs)
+        other = delta[arcs, 2:]
+        lengths[arcs] = np.hypot(radius * np.abs(sweep), np.sqrt(np.einsum('ij,ij->i', other, other)))
+    return lengths
+
+
+def analyze_toolpath(source, nozzle_diameter=NOZZLE_DIAMETER, default_feed=DEFAULT_FEED, min_segment_time=0.0):
+    '''
+    Estimates path lengths, duration and material use of a toolpath from its feedrates.
+    Args:
+        source: A .toolpath file, a revised .gcode file or a toolpath array.
+        nozzle_diameter: Bead diameter in mm used for the deposited volume.
+        default_feed: Feed in mm/min for moves issued before any F word.
+        min_segment_time: Shortest time in s the controller spends on one motion command, models
+            the block processing rate that limits paths made of many short moves.
+    Returns:
+        A dict with total print/travel length (mm), total and per-layer time (s), and per-channel
+        deposited length (mm) and volume (mm^3), indexed by channel number.
+    '''
+    toolpath = load_toolpath(source)
+    lengths = segment_lengths(toolpath)
+    feed = toolpath['feed'].astype(np.float64)
+    feed = np.where(feed > 0, feed, default_feed) / 60.0  # mm/s
+    times = np.maximum(lengths / feed, min_segment_time)
+
+    channel = toolpath['channel']
+    printing = channel > 0
+    layer = toolpath['layer']
+    layer_count = int(layer.max()) + 1 if len(layer) else 0
+    channel_length = np.bincount(channel, weights=lengths) if len(channel) else np.zeros(1)
+
+    return {
+        "segments": len(toolpath),
+        "print_length": float(lengths[printing].sum()),
+        "travel_length": float(lengths[~printing].sum()),
+        "total_time": float(times.sum()),
+        "layer_time": np.bincount(layer, weights=times, minlength=layer_count),
+        "channel_length": channel_length,
+        "channel_volume": channel_length * np.pi * nozzle_diameter ** 2 / 4,
+    }
+
+
+def print_analysis(analysis):
+    print(f"Segments: {analysis['segments']}")
+    print(f"Print length: {analysis['print_length']:.1f} mm, travel length: {analysis['travel_length']:.1f} mm")
+    total_time = analysis['total_time']
+    print(f"Estimated time: {total_time:.1f} s ({total_time / 3600:.2f} h) over {len(analysis['layer_time'])} layers")
+    for channel in range(1, len(analysis['channel_length'])):
+        print(f"Channel {channel}: {analysis['channel_length'][channel]:.1f} mm deposited, "
+              f"~{analysis['channel_volume'][channel] / 1000:.3f} mL")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate length, time and material of a revised job.")
+    parser.add_argument("source", help="revised .gcode file or .toolpath file")
+    parser.add_argument("--nozzle", type=float, default=NOZZLE_DIAMETER, help="nozzle diameter in mm")
+    args = parser.parse_args()
+    start_time = time.perf_counter()
+    analysis = analyze_toolpath(args.source, args.nozzle)
+    print_analysis(analysis)
+    print(f"Analysed in {time.perf_counter() - start_time:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import struct
+
+import numpy as np
+
+from gcode_io import derived_path
+from gcode_lexer import command_key, tokenize_line
+
+# Motion opcodes, matching the G-code motion command numbers
+OPCODE_RAPID = 0
+OPCODE_LINEAR = 1
+OPCODE_ARC_CW = 2
+OPCODE_ARC_CCW = 3
+MOTION_OPCODES = {"G0": OPCODE_RAPID, "G1": OPCODE_LINEAR, "G2": OPCODE_ARC_CW, "G3": OPCODE_ARC_CCW}
+
+AXES = ['x', 'y', 'z', 'a', 'b', 'c', 'd']
+VERTICAL_AXES = ['z', 'a', 'b', 'c', 'd']
+
+# One record per motion command. Positions are absolute end points after the move, so a
+# segment runs from the previous record to this one. channel is 0 for travel and the
+# 1-based pneumatic channel for deposition moves. line is the 1-based line in the revised file.
+TOOLPATH_DTYPE = np.dtype([
+    ('opcode', 'u1'), ('channel', 'u1'), ('layer', '<u4'), ('line', '<u4'),
+    ('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('a', '<f4'), ('b', '<f4'), ('c', '<f4'), ('d', '<f4'),
+    ('i', '<f4'), ('j', '<f4'), ('feed', '<f4'),
+])
+
+TOOLPATH_MAGIC = b"DIWTPATH"
+TOOLPATH_VERSION = 1
+# magic, version, record size, record count, layer count, padded to 64 bytes
+_HEADER = struct.Struct("<8sIIQI36x")
+HEADER_SIZE = _HEADER.size
+
+
+def toolpath_path_for(revised_file_path):
+    return derived_path(revised_file_path, "", ".toolpath")
+
+
+class ToolpathBuilder:
+    '''
+    Tracks the modal G-code state of a revised program and turns its motion commands into
+    TOOLPATH_DTYPE records. Rows are collected in chunks so memory stays bounded when a
+    subclass writes them out (see ToolpathWriter).
+    '''
+
+    def __init__(self, chunk_size=65536):
+        self.chunk_size = chunk_size
+        self.line_number = 0
+        self.layer = 0
+        self.record_count = 0
+        self._rows = []
+        self._chunks = []
+        self._position = dict.fromkeys(AXES, 0.0)
+        self._feed = 0.0
+        self._motion = "G1"
+        self._relative = False
+        # Extrusion state of the slicer input, the E words themselves are removed by the revision
+        self._extruding = False
+        self._last_e = 0.0
+        self._relative_e = False
+        self._channel = 1
+
+    def add(self, words, outputs):
+        '''
+        Records the revised lines produced from one input line.
+        Args:
+            words: The input line's words from tokenize_line(), or None for lines that are
+                not slicer input (header, footer, pass-through lines).
+            outputs: The revised lines written for it, in order.
+        '''
+        if words:
+            self._observe_input(words)
+        for line in outputs:
+            self.line_number += 1
+            _, line_words, _ = tokenize_line(line)
+            if line_words:
+                self._observe_output(line_words)
+
+    def add_lines(self, lines):
+        '''
+        Records plain G-code lines, e.g. an already revised file. Without E words every G1
+        move is treated as deposition on the current channel.
+        '''
+        self._extruding = True
+        for line in lines:
+            self.add(None, (line,))
+
+    def _observe_input(self, words):
+        key = command_key(words)
+        if key in ("M82", "M83"):
+            self._relative_e = key == "M83"
+            return
+        if key is not None and key[0] == "T":
+            self._channel = int(float(key[1:])) + 1
+            return
+        for word in words:
+            if word[0] == "E":
+                value = float(word[1:])
+                if key == "G92":
+                    self._last_e = value
+                    return
+                delta = value if self._relative_e else value - self._last_e
+                self._last_e = value if not self._relative_e else self._last_e + value
+                self._extruding = delta > 0
+                return
+        if key in MOTION_OPCODES:
+            self._extruding = False
+
+    def _observe_output(self, words):
+        key = command_key(words)
+        if key == "G90" or key == "G91":
+            self._relative = key == "G91"
+            return
+        if key == "G92":
+            for word in words:
+                axis = word[0].lower()
+                if axis in self._position:
+                    self._position[axis] = float(word[1:])
+            return
+        if key in MOTION_OPCODES:
+            self._motion = key
+        elif key is not None:
+            return
+
+        position = self._position
+        moved_axes = []
+        i = j = 0.0
+        for word in words:
+            letter = word[0]
+            if letter == "F":
+                self._feed = float(word[1:])
+                continue
+            if letter == "I":
+                i = float(word[1:])
+                continue
+            if letter == "J":
+                j = float(word[1:])
+                continue
+            axis = letter.lower()
+            if axis in position:
+                value = float(word[1:])
+                position[axis] = position[axis] + value if self._relative else value
+                moved_axes.append(axis)
+        if not moved_axes:
+            return
+
+        opcode = MOTION_OPCODES[self._motion]
+        channel = self._channel if self._extruding and opcode != OPCODE_RAPID else 0
+        # A move of a vertical axis alone is a layer change, nothing is deposited
+        if "x" not in moved_axes and "y" not in moved_axes:
+            self.layer += 1
+            channel = 0
+        self._rows.append((opcode, channel, self.layer, self.line_number,
+                           position['x'], position['y'], position['z'], position['a'],
+                           position['b'], position['c'], position['d'], i, j, self._feed))
+        if len(self._rows) >= self.chunk_size:
+            self._flush_rows()
+
+    def _flush_rows(self):
+        if not self._rows:
+            return
+        chunk = np.array(self._rows, dtype=TOOLPATH_DTYPE)
+        self._rows.clear()
+        self.record_count += len(chunk)
+        self.write_chunk(chunk)
+
+    def write_chunk(self, chunk):
+        self._chunks.append(chunk)
+
+    def to_array(self):
+        '''
+        Returns all records collected so far as one array.
+        '''
+        self._flush_rows()
+        if not self._chunks:
+            return np.zeros(0, dtype=TOOLPATH_DTYPE)
+        return np.concatenate(self._chunks)
+
+
+class ToolpathWriter(ToolpathBuilder):
+    '''
+    ToolpathBuilder that streams its records to a toolpath file.
+    '''
+
+    def __init__(self, file_path, chunk_size=65536):
+        super().__init__(chunk_size)
+        self.file_path = file_path
+        self._file = open(file_path, 'wb')
+        self._file.write(bytes(HEADER_SIZE))  # Placeholder until the record count is known
+
+    def write_chunk(self, chunk):
+        self._file.write(chunk.tobytes())
+
+    def close(self):
+        self._flush_rows()
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(TOOLPATH_MAGIC, TOOLPATH_VERSION, TOOLPATH_DTYPE.itemsize,
+                                      self.record_count, self.layer))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_toolpath_header(file_path):
+    '''
+    Returns (record count, layer count) of a toolpath file after validating its header.
+    '''
+    with open(file_path, 'rb') as file:
+        header = file.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError(f"{file_path} is not a toolpath file")
+    magic, version, record_size, record_count, layer_count = _HEADER.unpack(header)
+    if magic != TOOLPATH_MAGIC:
+        raise ValueError(f"{file_path} is not a toolpath file")
+    if version != TOOLPATH_VERSION or record_size != TOOLPATH_DTYPE.itemsize:
+        raise ValueError(f"{file_path} has unsupported toolpath version {version}")
+    return record_count, layer_count
+
+
+def open_toolpath(file_path, mode='r'):
+    '''
+    Memory-maps a toolpath file as a TOOLPATH_DTYPE array without reading or copying it.
+    Args:
+        file_path: The .toolpath file written by ToolpathWriter.
+        mode: numpy.memmap mode, 'r' for read-only or 'r+' to edit in place.
+    '''
+    record_count, _ = read_toolpath_header(file_path)
+    if record_count == 0:
+        return np.zeros(0, dtype=TOOLPATH_DTYPE)
+    return np.memmap(file_path, dtype=TOOLPATH_DTYPE, mode=mode, offset=HEADER_SIZE, shape=(record_count,))
+
+
+def parse_toolpath(lines):
+    '''
+    Parses revised G-code lines into an in-memory toolpath array.
+    '''
+    builder = ToolpathBuilder()
+    builder.add_lines(lines)
+    return builder.to_array()
@@ -0,0 +1,282 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from gcode_io import open_gcode_file, split_compression_suffix
+from gcode_lexer import command_key, format_number, tokenize_line
+
+# Layers with more paths than this are only ordered nearest-neighbour, 2-opt is O(n^2) per pass
+MAX_TWO_OPT_PATHS = 2000
+# 2-opt stops after this many passes over a layer, or earlier once no reversal improves the order
+MAX_TWO_OPT_PASSES = 50
+# Smallest travel saving (mm) a 2-opt move must bring, avoids cycling on rounding noise
+MIN_IMPROVEMENT = 1e-6
+# Motion commands that deposit in a revised program, travel is G0 (see ToolpathBuilder.add_lines)
+_PRINT_COMMANDS = ("G1", "G2", "G3")
+
+
+class _Path:
+    '''
+    One travel move with the deposition moves up to the next travel. start is where the travel
+    ends and the path begins, end where the path ends. start_feed is the modal feed before the
+    travel, end_feed the one after the path.
+    '''
+    __slots__ = ("lines", "start", "end", "start_feed", "end_feed")
+
+    def __init__(self, line, start_feed):
+        self.lines = [line]
+        self.start = None
+        self.end = None
+        self.start_feed = start_feed
+        self.end_feed = start_feed
+
+
+def _nearest_neighbour(origin, starts, ends):
+    '''
+    Orders paths greedily, always travelling to the closest unvisited path start.
+    '''
+    count = len(starts)
+    visited = np.zeros(count, dtype=bool)
+    order = []
+    position = origin
+    for _ in range(count):
+        distances = np.hypot(*(starts - position).T)
+        distances[visited] = np.inf
+        index = int(np.argmin(distances))
+        order.append(index)
+        visited[index] = True
+        position = ends[index]
+    return np.array(order)
+
+
+def _two_opt(origin, starts, ends, order, max_passes=MAX_TWO_OPT_PASSES):
+    '''
+    Improves a path order by reversing the visiting order of sub-sequences (2-opt). Paths keep
+    their direction, so travel is asymmetric and the inner transitions are re-evaluated too,
+    using prefix sums of the forward and backward travel along the current order. For every
+    first position all possible reversal ends are evaluated at once.
+    '''
+    count = len(order)
+    # travel[a, b]: from the end of path a to the start of path b, row count is the origin
+    travel = np.empty((count + 1, count))
+    travel[:count] = np.hypot(ends[:, None, 0] - starts[None, :, 0], ends[:, None, 1] - starts[None, :, 1])
+    travel[count] = np.hypot(*(starts - origin).T)
+
+    for _ in range(max_passes):
+        improved = False
+        for i in range(count - 1):
+            forward = np.concatenate(([0.0], np.cumsum(travel[order[:-1], order[1:]])))
+            backward = np.concatenate(([0.0], np.cumsum(travel[order[1:], order[:-1]])))
+            previous = order[i - 1] if i > 0 else count
+            j = np.arange(i + 1, count)
+            following = np.append(order[i + 2:], -1)  # Path after position j, -1 past the end
+            has_following = following >= 0
+            exit_old = np.where(has_following, travel[order[j], following], 0.0)
+            exit_new = np.where(has_following, travel[order[i], following], 0.0)
+            delta = (travel[previous, order[j]] - travel[previous, order[i]]
+                     + backward[j] - backward[i] - forward[j] + forward[i]
+                     + exit_new - exit_old)
+            best = int(np.argmin(delta))
+            if delta[best] < -MIN_IMPROVEMENT:
+                end = i + 1 + best
+                order[i:end + 1] = order[i:end + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return order
+
+
+def _travel_length(origin, starts, ends, order):
+    departures = np.vstack([origin[None, :], ends[order[:-1]]])
+    return float(np.hypot(*(starts[order] - departures).T).sum())
+
+
+def order_paths(origin, starts, ends):
+    '''
+    Returns the visiting order of paths that minimizes travel approximately: nearest-neighbour
+    followed by 2-opt for up to MAX_TWO_OPT_PATHS paths.
+    Args:
+        origin: (x, y) position before the first path.
+        starts, ends: (n, 2) arrays of path start and end points.
+    '''
+    order = _nearest_neighbour(origin, starts, ends)
+    if 2 < len(order) <= MAX_TWO_OPT_PATHS:
+        order = _two_opt(origin, starts, ends, order)
+    return order
+
+
+def _reorder_region(prefix, paths, origin, feed, stats):
+    '''
+    Returns the lines of one region (the stretch of a layer between barriers) with its paths
+    reordered, adding feed words where a moved path relied on the modal feed. origin and feed
+    are the position and modal feed before the first path, an unknown origin (start of the
+    program) keeps the first path first.
+    '''
+    if len(paths) < 2:
+        return prefix + [line for path in paths for line in path.lines]
+    starts = np.array([path.start for path in paths])
+    ends = np.array([path.end for path in paths])
+    if origin is None:
+        origin = starts[0]
+    origin = np.asarray(origin, dtype=float)
+    identity = np.arange(len(paths))
+    before = _travel_length(origin, starts, ends, identity)
+    order = order_paths(origin, starts, ends)
+    after = _travel_length(origin, starts, ends, order)
+    if after >= before:
+        order = identity
+        after = before
+    stats["travel_before"] += before
+    stats["travel_after"] += after
+    stats["paths"] += len(paths)
+
+    lines = list(prefix)
+    for index in order:
+        path = paths[index]
+        if path.start_feed is not None and path.start_feed != feed:
+            lines.append(f"F{format_number(path.start_feed)}\n")
+        lines.extend(path.lines)
+        feed = path.end_feed if path.end_feed is not None else feed
+    original_end_feed = paths[-1].end_feed
+    if original_end_feed is not None and original_end_feed != feed:
+        lines.append(f"F{format_number(original_end_feed)}\n")  # Lines after the region may rely on it
+    return lines
+
+
+def _classify(words, comment, line, relative):
+    '''
+    Returns "travel" for a G0 to an absolute XY position, "print" for a deposition move, "attach"
+    for lines that belong to the path they are in (feed, valve writes, blank lines) and None for
+    barriers. Comments are barriers, they mark what follows them (layer, feature type).
+    '''
+    if words is None:
+        is_valve = line.startswith("$iglobal[") and not line.startswith("$iglobal[0]")
+        return "attach" if is_valve else None
+    if not words:
+        return None if comment else "attach"
+    key = command_key(words)
+    if relative:
+        return None
+    if key == "G0":
+        letters = [word[0] for word in words[1:]]
+        if "X" in letters and "Y" in letters and all(letter in "XYF" for letter in letters):
+            return "travel"
+        return None
+    if key in _PRINT_COMMANDS:
+        return "print"
+    if len(words) == 1 and words[0][0] == "F":
+        return "attach"
+    return None
+
+
+def optimize_travel_lines(lines, stats=None):
+    '''
+    Reorders the independent paths within every layer of a revised program to shorten travel.
+    A path is a G0 travel to an absolute XY position followed by the deposition moves, feed
+    and valve writes up to the next travel. Layer changes, comments, $iglobal[0] markers,
+    pressure writes and any other command are barriers that paths never move across, so layer order, the
+    program start/end markers and pressure timing are kept. Paths are never reversed.
+    Args:
+        lines: Iterable of revised lines.
+        stats: Optional dict, receives "travel_before" / "travel_after" (mm) and "paths".
+    '''
+    if stats is None:
+        stats = {}
+    stats.update(travel_before=0.0, travel_after=0.0, paths=0)
+    x = y = None
+    feed = None
+    relative = False
+    prefix = []
+    paths = []
+    origin = None
+    origin_feed = None
+
+    def flush():
+        if paths:
+            return _reorder_region(prefix, paths, origin, origin_feed, stats)
+        return prefix + [line for path in paths for line in path.lines]
+
+    for line in lines:
+        _, words, comment = tokenize_line(line)
+        kind = _classify(words, comment, line, relative)
+        if kind is None:
+            yield from flush()
+            prefix = []
+            paths = []
+            yield line
+        elif kind == "travel":
+            if not paths:
+                origin = (x, y) if x is not None and y is not None else None
+                origin_feed = feed
+            paths.append(_Path(line, feed))
+        elif paths:
+            paths[-1].lines.append(line)
+        else:
+            prefix.append(line)
+
+        # Track the modal position and feed through every line
+        if words:
+            key = command_key(words)
+            if key == "G90" or key == "G91":
+                relative = key == "G91"
+            for word in words:
+                letter = word[0]
+                if letter == "F":
+                    feed = float(word[1:])
+                elif letter in "XY" and not relative and key in ("G0", "G1", "G2", "G3", None):
+                    if letter == "X":
+                        x = float(word[1:])
+                    else:
+                        y = float(word[1:])
+        if paths and kind is not None:
+            path = paths[-1]
+            if kind == "travel":
+                path.start = (x, y)
+            path.end = (x, y)
+            path.end_feed = feed
+
+    yield from flush()
+
+
+def optimize_travel_file(revised_file_path, output_path=None):
+    '''
+    Reorders the paths of a revised file, in place unless output_path is given. The file is
+    streamed through a temporary file next to the output, so memory use is bounded by a layer.
+    Returns the stats of optimize_travel_lines().
+    '''
+    output_path = output_path or revised_file_path
+    base, suffix = split_compression_suffix(output_path)
+    temp_path = f"{base}.reorder_tmp{suffix}"
+    stats = {}
+    try:
+        with open_gcode_file(revised_file_path, 'r') as source, open_gcode_file(temp_path, 'w') as target:
+            target.writelines(optimize_travel_lines(source, stats))
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return stats
+
+
+def print_travel_report(stats):
+    before, after = stats["travel_before"], stats["travel_after"]
+    saved = before - after
+    percent = 100 * saved / before if before else 0.0
+    print(f"Travel: {before:.1f} mm -> {after:.1f} mm, saved {saved:.1f} mm ({percent:.1f} %) over {stats['paths']} paths")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reorder the paths within each layer of a revised job to shorten travel.")
+    parser.add_argument("revised_file", help="revised .gcode file (.gz/.xz compressed files are supported)")
+    parser.add_argument("-o", "--output", help="output path (default: rewrite the revised file in place)")
+    args = parser.parse_args()
+    start_time = time.perf_counter()
+    stats = optimize_travel_file(args.revised_file, args.output)
+    print_travel_report(stats)
+    print(f"Reordered program saved to: {args.output or args.revised_file} ({time.perf_counter() - start_time:.3f} s)")
+
+
+if __name__ == "__main__":
+    main()
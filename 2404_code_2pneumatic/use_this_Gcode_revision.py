@@ -1,22 +1,77 @@
+import argparse
 import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-def adjust_gcode_file(filename, replacement_letter):
-    # Ensure the replacement letter is valid
-    if replacement_letter not in ['A', 'B', 'C', 'D']:
-        raise ValueError("Replacement letter must be one of 'A', 'B', 'C', 'D'")
+from arc_fitting import fit_arcs_gcode_lines
+from gcode_cache import LayerCache, layer_key
+from gcode_io import BUFFER_SIZE, check_output_path, derived_path, is_compressed, open_gcode_file
+from gcode_lexer import command_key, format_line, format_number, remove_words, tokenize_line
+from layer_index import build_layer_index, layer_index_path_for, write_layer_index
+from path_simplify import simplify_gcode_lines
+from pressure_events import PressureSchedule, annotate_pressure_events, load_pressure_schedule
+from toolpath_format import ToolpathWriter, toolpath_path_for
+from travel_optimizer import optimize_travel_file, print_travel_report
+
+REPLACEMENT_LETTERS = ['A', 'B', 'C', 'D']
 
-    # Get the script's directory and construct the file path
+# Number of revised lines handed to writelines() at once
+WRITE_BATCH_SIZE = 4096
+# Approximate amount of slicer text handed to a worker process at once in parallel mode
+PARALLEL_BLOCK_SIZE = 4 * 1024 * 1024
+# Layer changes start with a pure Z move, which is where parallel blocks and cached layers are cut
+LAYER_CHANGE_PREFIXES = ("G1 Z", "G01 Z")
+_LAYER_START_RE = re.compile("^(?=" + "|".join(map(re.escape, LAYER_CHANGE_PREFIXES)) + ")", re.MULTILINE)
+# Bump when the rewrite rules change so cached layers from older revisions are not reused
+REVISION_VERSION = 2
+DEFAULT_CACHE_FILE = "gcode_revision_cache.sqlite"
+# Default arc fitting deviation (mm), far below the 0.4 mm bead width
+ARC_TOLERANCE = 0.01
+# Batches of revised lines queued per output file in multi-nozzle mode, bounds memory
+WRITER_QUEUE_SIZE = 8
+# Commands whose X/Y words are absolute positions that get the nozzle offset (None is a modal move)
+OFFSET_COMMANDS = ("G0", "G1", "G2", "G3", "G92", None)
+
+
+def resolve_gcode_path(filename):
+    '''
+    Resolves a G-code file name relative to this script's directory.
+    Absolute paths are returned unchanged.
+    '''
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(script_dir, filename)
+    return os.path.join(script_dir, filename)
+
 
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
+def revised_path_for(file_path):
+    return derived_path(file_path, "_revised")
 
-    adjusted_lines = ["G75\n"]  # Start with G75
-    process1_encountered = False  # Ensure this variable is defined at the beginning
+
+def read_gcode_lines(file_path):
+    '''
+    Yields the lines of a G-code file one at a time without loading the whole file.
+    .gz and .xz files are decompressed on the fly.
+    '''
+    with open_gcode_file(file_path) as file:
+        yield from file
+
+
+def filter_gcode_lines(lines, stats=None):
+    '''
+    Drops everything before "; process Process1" and the comment lines after "Build Summary".
+    Args:
+        lines: Iterable of raw slicer lines.
+        stats: Optional dict, "lines_in" is set to the number of input lines consumed.
+    '''
+    process1_encountered = False
     build_summary_encountered = False
+    line_count = 0
 
     for line in lines:
+        line_count += 1
         if not process1_encountered:
             if "; process Process1" in line:
                 process1_encountered = True
@@ -30,41 +85,686 @@ def adjust_gcode_file(filename, replacement_letter):
             build_summary_encountered = True
             continue
 
-        # Skip specific commands
-        if any(cmd in line for cmd in ["M3", "M4", "M5", "M6", "T0", "T1", "T2", "T3", "M106"]):
+        yield line
+
+    if stats is not None:
+        stats["lines_in"] = line_count
+
+
+def _drop_command(line, code, words, comment, replacement_letter):
+    return ()
+
+
+def _rewrite_words(line, code, words, comment, replacement_letter):
+    kept_code = code
+    for letter in DROPPED_WORDS:
+        if letter in kept_code:
+            kept_code = remove_words(kept_code, letter)
+    if kept_code is code and line.startswith(code):
+        return (line,)  # Nothing to remove, keep the slicer's formatting (unless tokenize_line() normalized it)
+    if comment:
+        return (f"{kept_code}{comment}\n",)
+    if kept_code.isspace():
+        return ()
+    return (kept_code,)
+
+
+def _rewrite_linear_move(line, code, words, comment, replacement_letter):
+    # A Z move is a layer change: it becomes a relative move of the replacement axis, the gantry
+    # has no Z. A move that also names other axes is split, the layer change goes first.
+    if "Z" not in code:
+        return _rewrite_words(line, code, words, comment, replacement_letter)
+    vertical_words = []
+    other_words = []
+    for word in words:
+        letter = word[0]
+        if letter in DROPPED_WORDS:
             continue
+        if letter == "Z":
+            vertical_words.append(replacement_letter + word[1:])
+        elif letter in "GNF":
+            vertical_words.append(word)
+        else:
+            other_words.append(word)
+    layer_change = ("G91\n", format_line(vertical_words, comment), "G90\n")
+    if not other_words:
+        return layer_change
+    return layer_change + (format_line([command_key(words)] + other_words),)
+
+
+# Dispatch table from a line's command word to the function that rewrites it
+COMMAND_HANDLERS = {
+    "M3": _drop_command,    # Spindle / laser on
+    "M4": _drop_command,
+    "M5": _drop_command,    # Spindle / laser off
+    "M6": _drop_command,    # Tool change
+    "M106": _drop_command,  # Fan on
+    "M2": _drop_command,    # Program end, the footer clears $iglobal[0] first
+    "M30": _drop_command,
+    "T0": _drop_command,    # Tool changes, any other T word too (see _command_handler())
+    "T1": _drop_command,
+    "T2": _drop_command,
+    "T3": _drop_command,
+    "G0": _rewrite_words,
+    "G1": _rewrite_linear_move,
+}
+# Words removed from every line, extrusion is done by the pneumatic system
+DROPPED_WORDS = {"E"}
+
+
+def _command_handler(words):
+    handler = COMMAND_HANDLERS.get(words[0])
+    if handler is None:
+        key = command_key(words)
+        handler = _drop_command if key is not None and key[0] == "T" else COMMAND_HANDLERS.get(key, _rewrite_words)
+    return handler
+
 
-        # Delete parts of the line containing "E" and ensure newline
-        parts = line.split(" ")
-        parts = [part for part in parts if not part.startswith("E")]
-        line = " ".join(parts)
+def rewrite_gcode_lines(lines, replacement_letter, toolpath=None):
+    '''
+    Removes unsupported commands and extrusion words and moves Z onto the replacement axis.
+    Each line is tokenized once and dispatched on its command word through COMMAND_HANDLERS,
+    tool changes (T words) are dropped whatever their number.
+    Args:
+        lines: Iterable of filtered slicer lines.
+        replacement_letter: The axis ('A', 'B', 'C' or 'D') that replaces Z.
+        toolpath: Optional ToolpathBuilder that records every input line and its revised lines.
+    '''
+    for line in lines:
         if not line.endswith("\n"):
             line += "\n"
+        code, words, comment = tokenize_line(line)
+        if not words:
+            # Layer height notes ("; layer 2, Z = 0.600") are not forwarded to the controller,
+            # anything else that is not plain word-address G-code is passed through untouched
+            outputs = (line,) if "Z =" not in line else ()
+        else:
+            handler = _command_handler(words)
+            outputs = handler(line, code, words, comment, replacement_letter)
+        if toolpath is not None:
+            toolpath.add(words, outputs)
+        yield from outputs
 
-        # Replace "Z" with the specified letter and add "G91" before and "G90" after the line if needed
-        if "G1 Z" in line:
-            line = line.replace("Z", replacement_letter)
-            adjusted_lines.append("G91\n")
-            adjusted_lines.append(line)
-            adjusted_lines.append("G90\n")
-            continue
 
-        if "Z =" in line:
-            line = line.replace("Z", replacement_letter)
-            continue
+def prepare_gcode_lines(lines, stats=None, simplify_tolerance=None, arc_tolerance=None, pressure_schedule=None):
+    '''
+    Filters slicer lines and runs the optional stages that work on the slicer text before it is
+    rewritten (see revise_gcode_lines() for the arguments).
+    '''
+    filtered_lines = filter_gcode_lines(lines, stats)
+    if arc_tolerance is not None:
+        filtered_lines = fit_arcs_gcode_lines(filtered_lines, arc_tolerance, stats)
+    if simplify_tolerance is not None:
+        filtered_lines = simplify_gcode_lines(filtered_lines, simplify_tolerance, stats)
+    if pressure_schedule is not None:
+        filtered_lines = annotate_pressure_events(filtered_lines, pressure_schedule, stats)
+    return filtered_lines
+
+
+def revise_gcode_lines(lines, replacement_letter, stats=None, toolpath=None, simplify_tolerance=None,
+                       arc_tolerance=None, pressure_schedule=None):
+    '''
+    Generator pipeline turning slicer G-code lines into revised lines for the Aerotech gantry.
+    Args:
+        lines: Iterable of raw slicer lines, e.g. from read_gcode_lines().
+        replacement_letter: The axis ('A', 'B', 'C' or 'D') that replaces Z.
+        stats: Optional dict that receives the input line count.
+        toolpath: Optional ToolpathBuilder fed with the revised program as it is produced.
+        simplify_tolerance: If given, merge collinear moves and simplify move runs within this
+            deviation in mm before revising (see path_simplify.py).
+        arc_tolerance: If given, replace runs of short moves by G2/G3 arcs within this deviation
+            in mm before simplifying (see arc_fitting.py).
+        pressure_schedule: If given, a PressureSchedule whose pressure and valve events are written
+            into the program as global variable writes (see pressure_events.py).
+    '''
+    # Ensure the replacement letter is valid
+    if replacement_letter not in REPLACEMENT_LETTERS:
+        raise ValueError("Replacement letter must be one of 'A', 'B', 'C', 'D'")
+
+    header = ("G75\n", "$iglobal[0] = 1\n")  # $iglobal[0] signals the host that the program is running
+    footer = ("$iglobal[0] = 0\n",)
+    if toolpath is not None:
+        toolpath.add(None, header)
+    yield from header
+    filtered_lines = prepare_gcode_lines(lines, stats, simplify_tolerance, arc_tolerance, pressure_schedule)
+    yield from rewrite_gcode_lines(filtered_lines, replacement_letter, toolpath)
+    if toolpath is not None:
+        toolpath.add(None, footer)
+    yield from footer
+
+
+def write_gcode_lines(lines, file_path):
+    '''
+    Writes lines to a file in batches through a large buffer, compressed if the path ends
+    with .gz or .xz. Returns the number of lines written.
+    '''
+    line_count = 0
+    batch = []
+    with open_gcode_file(file_path, 'w') as file:
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                file.writelines(batch)
+                line_count += len(batch)
+                batch.clear()
+        file.writelines(batch)
+        line_count += len(batch)
+    return line_count
+
+
+def iter_layer_blocks(file_path, block_size=PARALLEL_BLOCK_SIZE, stats=None):
+    '''
+    Yields the filtered slicer text in blocks of whole layers, the input of the parallel mode.
+    Header and footer filtering is done here with block-wide searches, so the per-line work
+    is left to the workers. A block is cut before the last layer change it contains; a layer
+    longer than block_size is split at a line boundary, which is still correct because the
+    rewrite stage does not carry state from one line to the next.
+    Args:
+        file_path: The slicer file.
+        block_size: Approximate number of characters per block.
+        stats: Optional dict, "lines_in" is set to the number of input lines read.
+    '''
+    process1_encountered = False
+    line_count = 0
+    carry = ""
+
+    with open_gcode_file(file_path) as file:
+        while True:
+            block = file.read(block_size)
+            if block and not block.endswith("\n"):
+                block += file.readline()  # Always end a block on a line boundary
+            line_count += block.count("\n")
+            if not block:
+                if carry:
+                    line_count += 1  # Last line without a newline
+                    yield carry
+                break
+
+            if not process1_encountered:
+                index = block.find("; process Process1")
+                if index < 0:
+                    continue  # Skip all lines until "; process Process1" is encountered
+                process1_encountered = True
+                block = block[block.rfind("\n", 0, index) + 1:]
+            block = carry + block
+
+            index = block.find("Build Summary")
+            if index >= 0:
+                # Everything after "Build Summary" is handled here, the footer is short
+                summary_start = block.rfind("\n", 0, index) + 1
+                footer = block[summary_start:] + file.read()
+                line_count += footer.count("\n") - block.count("\n", summary_start)
+                if not footer.endswith("\n"):
+                    line_count += 1
+                if summary_start:
+                    yield block[:summary_start]
+                footer_lines = footer.splitlines(keepends=True)[1:]
+                footer_block = "".join(line for line in footer_lines if not line.startswith(";"))
+                if footer_block:
+                    yield footer_block
+                carry = ""
+                break
+
+            cut = -1
+            for prefix in LAYER_CHANGE_PREFIXES:
+                cut = max(cut, block.rfind("\n" + prefix))
+            if cut > 0:
+                carry = block[cut + 1:]
+                yield block[:cut + 1]
+            else:
+                carry = ""
+                yield block
+
+    if stats is not None:
+        stats["lines_in"] = line_count
+
+
+def _revise_block(block, replacement_letter, simplify_tolerance=None, arc_tolerance=None):
+    block_stats = {}
+    lines = block.splitlines(keepends=True)
+    if arc_tolerance is not None:
+        lines = fit_arcs_gcode_lines(lines, arc_tolerance, block_stats)
+    if simplify_tolerance is not None:
+        lines = simplify_gcode_lines(lines, simplify_tolerance, block_stats)
+    revised_lines = list(rewrite_gcode_lines(lines, replacement_letter))
+    return "".join(revised_lines), len(revised_lines), block_stats
 
-        adjusted_lines.append(line)
 
-    # Add global commands
-    adjusted_lines.insert(1, "$iglobal[0] = 1\n")  # Insert after G75
-    adjusted_lines.append("$iglobal[0] = 0\n")
+def iter_layers(file_path, stats=None):
+    '''
+    Yields the filtered slicer text one layer at a time, each starting at its layer change.
+    '''
+    for block in iter_layer_blocks(file_path, stats=stats):
+        for layer in _LAYER_START_RE.split(block):
+            if layer:
+                yield layer
 
-    # Writing to a new file
-    revised_file_path = file_path.replace(".gcode", "_revised.gcode")
-    with open(revised_file_path, 'w') as file:
-        file.writelines(adjusted_lines)
+
+def revision_fingerprint(replacement_letter, simplify_tolerance=None, arc_tolerance=None):
+    '''
+    Describes the revision settings a cached layer was produced with.
+    '''
+    handlers = ",".join(f"{command}:{handler.__name__}" for command, handler in sorted(COMMAND_HANDLERS.items()))
+    return (f"{REVISION_VERSION}|{replacement_letter}|{handlers}|{''.join(sorted(DROPPED_WORDS))}"
+            f"|simplify={simplify_tolerance}|arcs={arc_tolerance}")
+
+
+def revise_gcode_file_in_blocks(file_path, revised_file_path, replacement_letter, workers=1, cache=None, stats=None,
+                                simplify_tolerance=None, arc_tolerance=None):
+    '''
+    Revises a slicer file block by block, in parallel and/or through a layer cache.
+    With workers > 1 blocks are revised by a pool of worker processes. Blocks are written back
+    in input order and at most two blocks per worker are in flight, so memory stays bounded.
+    With a LayerCache the file is split into single layers and only layers whose content or
+    revision settings changed since an earlier run are revised again.
+    Returns the number of lines written.
+    '''
+    header = "G75\n$iglobal[0] = 1\n"  # $iglobal[0] signals the host that the program is running
+    footer = "$iglobal[0] = 0\n"
+    fingerprint = revision_fingerprint(replacement_letter, simplify_tolerance, arc_tolerance)
+    window = 2 * workers
+    line_count = 3
+    layers_reused = 0
+    pending = deque()
+
+    def write_oldest():
+        key, result = pending.popleft()
+        if not isinstance(result, tuple):
+            result = result.result()  # Future of a block revised by a worker
+        text, block_lines = result[:2]
+        if len(result) > 2 and stats is not None:
+            for name, value in result[2].items():
+                stats[name] = stats.get(name, 0) + value
+        if key is not None:
+            cache.put(key, text, block_lines)
+        file.write(text)
+        return block_lines
+
+    if cache is not None:
+        blocks = iter_layers(file_path, stats)
+    else:
+        blocks = iter_layer_blocks(file_path, stats=stats)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        with open_gcode_file(revised_file_path, 'w') as file:
+            file.write(header)
+            for block in blocks:
+                key = None
+                result = None
+                if cache is not None:
+                    key = layer_key(block, fingerprint)
+                    result = cache.get(key)
+                if result is not None:
+                    key = None  # Already cached
+                    layers_reused += 1
+                elif executor is not None:
+                    result = executor.submit(_revise_block, block, replacement_letter, simplify_tolerance,
+                                             arc_tolerance)
+                else:
+                    result = _revise_block(block, replacement_letter, simplify_tolerance, arc_tolerance)
+                pending.append((key, result))
+                if len(pending) > window:
+                    line_count += write_oldest()
+            while pending:
+                line_count += write_oldest()
+            file.write(footer)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if stats is not None and cache is not None:
+        stats["layers_reused"] = layers_reused
+        stats["layers_revised"] = cache.misses
+    return line_count
+
+
+def adjust_gcode_file(filename, replacement_letter, output_path=None, toolpath_path=None, workers=1,
+                      cache_path=None, simplify_tolerance=None, arc_tolerance=None, pressure_schedule=None,
+                      layer_index_path=None, reorder_travel=False):
+    '''
+    Revises a slicer G-code file line by line with bounded memory.
+    Args:
+        filename: The slicer file, relative to this script's directory or absolute. Files ending
+            in .gz or .xz are decompressed while they are read.
+        replacement_letter: The axis ('A', 'B', 'C' or 'D') that replaces Z.
+        output_path: Where to write the revised file, defaults to "<name>_revised.gcode" with the
+            input's compression suffix. A .gz or .xz path is compressed while it is written.
+        toolpath_path: Also write a memory-mappable toolpath file (see toolpath_format.py).
+            Pass "" to use "<name>_revised.toolpath".
+        workers: Number of worker processes, 0 for one per CPU core. With more than one the
+            file is revised in blocks of layers in parallel (no toolpath output in this mode).
+        cache_path: Reuse revised layers from earlier runs stored in this SQLite file, so only
+            layers that changed are revised again. Pass "" to use the default cache next to
+            this script (no toolpath output in this mode).
+        simplify_tolerance: Merge collinear moves and simplify move runs within this deviation
+            in mm, 0 merges exactly collinear moves only. None disables the stage.
+        arc_tolerance: Replace runs of short G1 chords by G2/G3 arcs within this deviation in mm.
+            None disables the stage.
+        pressure_schedule: Embed pressure and valve events for the host listener, a PressureSchedule
+            or the path of a "layer,channel,pressure" CSV file. "" writes valve events only.
+            Needs the sequential mode without cache, as events depend on all preceding layers.
+        layer_index_path: Also write the layer index used to resume at a layer (see layer_index.py).
+            Pass "" to use "<name>_revised.layers.json".
+        reorder_travel: Reorder the paths within each layer of the revised file to shorten travel
+            (see travel_optimizer.py). The toolpath would no longer match, so not with toolpath_path.
+    Returns:
+        A dict with the revised file path, line counts, elapsed seconds and throughput.
+    '''
+    # Ensure the replacement letter is valid before touching any file
+    if replacement_letter not in REPLACEMENT_LETTERS:
+        raise ValueError("Replacement letter must be one of 'A', 'B', 'C', 'D'")
+
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    if toolpath_path is not None and (workers > 1 or cache_path is not None):
+        raise ValueError("Toolpath output needs the sequential mode without cache")
+    if toolpath_path is not None and reorder_travel:
+        raise ValueError("Toolpath output cannot be combined with travel reordering")
+    if layer_index_path is not None and is_compressed(output_path or filename):
+        raise ValueError("The layer index needs an uncompressed output file to seek in")
+    if pressure_schedule is not None and (workers > 1 or cache_path is not None):
+        raise ValueError("Pressure events need the sequential mode without cache")
+    if pressure_schedule == "":
+        pressure_schedule = PressureSchedule()
+    elif isinstance(pressure_schedule, str):
+        pressure_schedule = load_pressure_schedule(pressure_schedule)
+
+    file_path = resolve_gcode_path(filename)
+    revised_file_path = output_path or revised_path_for(file_path)
+    check_output_path(file_path, revised_file_path)
+
+    stats = {"revised_file_path": revised_file_path}
+    toolpath = None
+    if toolpath_path is not None:
+        stats["toolpath_path"] = toolpath_path or toolpath_path_for(revised_file_path)
+        toolpath = ToolpathWriter(stats["toolpath_path"])
+
+    start_time = time.perf_counter()
+    cache = None
+    if cache_path is not None:
+        cache = LayerCache(cache_path or resolve_gcode_path(DEFAULT_CACHE_FILE))
+
+    try:
+        if workers > 1 or cache is not None:
+            stats["lines_out"] = revise_gcode_file_in_blocks(file_path, revised_file_path, replacement_letter,
+                                                             workers, cache, stats, simplify_tolerance,
+                                                             arc_tolerance)
+        else:
+            revised_lines = revise_gcode_lines(read_gcode_lines(file_path), replacement_letter, stats, toolpath,
+                                               simplify_tolerance, arc_tolerance, pressure_schedule)
+            stats["lines_out"] = write_gcode_lines(revised_lines, revised_file_path)
+    finally:
+        if toolpath is not None:
+            toolpath.close()
+        if cache is not None:
+            cache.close()
+    if reorder_travel:
+        stats["travel"] = optimize_travel_file(revised_file_path)
+    if layer_index_path is not None:
+        stats["layer_index_path"] = layer_index_path or layer_index_path_for(revised_file_path)
+        layer_index = build_layer_index(revised_file_path)
+        write_layer_index(layer_index, stats["layer_index_path"])
+        stats["layers"] = len(layer_index["layers"])
+    stats["seconds"] = time.perf_counter() - start_time
+    stats["lines_per_second"] = stats["lines_in"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
 
     print(f"File adjusted and saved to: {revised_file_path}")
+    if toolpath is not None:
+        print(f"Toolpath with {toolpath.record_count} segments saved to: {stats['toolpath_path']}")
+    if reorder_travel:
+        print_travel_report(stats["travel"])
+    if layer_index_path is not None:
+        print(f"Layer index with {stats['layers']} layers saved to: {stats['layer_index_path']}")
+    if cache is not None:
+        print(f"Reused {stats['layers_reused']} cached layers, revised {stats['layers_revised']}")
+    if pressure_schedule is not None:
+        print(f"Embedded {stats['pressure_events']} pressure and {stats['valve_events']} valve events")
+    if stats.get("arc_segments_in"):
+        print(f"Fitted {stats['arcs']} arcs, {stats['arc_segments_in']} moves -> {stats['arc_segments_out']}")
+    if stats.get("segments_in"):
+        reduction = 1 - stats["segments_out"] / stats["segments_in"]
+        print(f"Simplified {stats['segments_in']} moves to {stats['segments_out']} "
+              f"({reduction:.1%} fewer motion commands for the controller)")
+        # At a given feed the controller's command rate is inversely proportional to the move length
+        print(f"Mean move length {stats['run_length'] / stats['segments_in']:.3f} mm -> "
+              f"{stats['run_length'] / stats['segments_out']:.3f} mm")
+    print(f"Processed {stats['lines_in']} lines in {stats['seconds']:.2f} s ({stats['lines_per_second']:.0f} lines/s)")
+    return stats
+
+
+class NozzleVariant:
+    '''
+    One nozzle of a multi-nozzle setup: the axis that replaces Z for it and its offset from the
+    slicer's coordinates in mm.
+    '''
+
+    def __init__(self, replacement_letter, x_offset=0.0, y_offset=0.0, z_offset=0.0):
+        if replacement_letter not in REPLACEMENT_LETTERS:
+            raise ValueError("Replacement letter must be one of 'A', 'B', 'C', 'D'")
+        self.replacement_letter = replacement_letter
+        self.x_offset = x_offset
+        self.y_offset = y_offset
+        self.z_offset = z_offset
+
+    def header(self):
+        header = ["G75\n", "$iglobal[0] = 1\n"]
+        if self.z_offset:
+            # The replacement axis only moves relatively, so its offset is one move at the start
+            header += ["G91\n", f"G0 {self.replacement_letter}{format_number(self.z_offset)}\n", "G90\n"]
+        return header
+
+
+def parse_nozzle_variant(text):
+    '''
+    Parses "C" or "D:25.4,0,-0.1" (letter, then optional X,Y,Z offsets in mm).
+    '''
+    letter, _, offsets = text.partition(":")
+    values = [float(value) for value in offsets.split(",")] if offsets else []
+    if len(values) > 3:
+        raise ValueError(f"Nozzle variant {text} has more than three offsets")
+    return NozzleVariant(letter.upper(), *values)
+
+
+def _offset_words(words, x_offset, y_offset):
+    # The line is rebuilt anyway, so the dropped words are left out here already
+    shifted = []
+    for word in words:
+        letter = word[0]
+        if letter == "X" and x_offset:
+            word = "X" + format_number(float(word[1:]) + x_offset)
+        elif letter == "Y" and y_offset:
+            word = "Y" + format_number(float(word[1:]) + y_offset)
+        elif letter in DROPPED_WORDS:
+            continue
+        shifted.append(word)
+    return shifted
+
+
+def rewrite_gcode_variants(lines, variants, batches):
+    '''
+    rewrite_gcode_lines() for several nozzles at once. Every line is tokenized once and
+    rewritten for each variant, with the variant's XY offset added to absolute positions.
+    Lines whose rewrite does not depend on the replacement letter are rewritten once for all
+    variants that share an offset.
+    Args:
+        lines: Iterable of filtered slicer lines.
+        variants: List of NozzleVariant.
+        batches: One list per variant that the revised lines are appended to. The function
+            yields after every WRITE_BATCH_SIZE input lines so the caller can drain them.
+    '''
+    has_offsets = any(variant.x_offset or variant.y_offset for variant in variants)
+    relative = False
+    line_count = 0
+    for line in lines:
+        if not line.endswith("\n"):
+            line += "\n"
+        code, words, comment = tokenize_line(line)
+        if not words:
+            if "Z =" not in line:
+                for batch in batches:
+                    batch.append(line)
+        else:
+            key = command_key(words)
+            if key == "G90" or key == "G91":
+                relative = key == "G91"
+            handler = _command_handler(words)
+            offsettable = has_offsets and not relative and key in OFFSET_COMMANDS and ("X" in code or "Y" in code)
+            shared = "Z" not in code  # Only layer changes depend on the replacement letter
+            if shared and not offsettable:
+                outputs = handler(line, code, words, comment, variants[0].replacement_letter)
+                for batch in batches:
+                    batch.extend(outputs)
+            else:
+                outputs = {}
+                for variant, batch in zip(variants, batches):
+                    offset = (variant.x_offset, variant.y_offset) if offsettable else (0.0, 0.0)
+                    cache_key = offset if shared else (offset, variant.replacement_letter)
+                    variant_outputs = outputs.get(cache_key)
+                    if variant_outputs is None:
+                        if offset[0] or offset[1]:
+                            variant_words = _offset_words(words, *offset)
+                            variant_outputs = handler(format_line(variant_words, comment), format_line(variant_words),
+                                                      variant_words, comment, variant.replacement_letter)
+                        else:
+                            variant_outputs = handler(line, code, words, comment, variant.replacement_letter)
+                        outputs[cache_key] = variant_outputs
+                    batch.extend(variant_outputs)
+        line_count += 1
+        if line_count % WRITE_BATCH_SIZE == 0:
+            yield
+
+
+class LineWriterThread:
+    '''
+    Writes batches of lines to a file on its own thread, so several outputs are written while
+    the main thread keeps revising. At most WRITER_QUEUE_SIZE batches wait in the queue.
+    '''
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.line_count = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=WRITER_QUEUE_SIZE)
+        self._file = open_gcode_file(file_path, 'w')
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                break
+            if self._error is None:  # Keep draining after an error so the producer never blocks
+                try:
+                    self._file.writelines(batch)
+                except OSError as error:
+                    self._error = error
+
+    def write_batch(self, batch):
+        self.line_count += len(batch)
+        self._queue.put(batch)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+
+
+def adjust_gcode_variants(filename, variants, output_paths=None, simplify_tolerance=None, arc_tolerance=None,
+                          pressure_schedule=None):
+    '''
+    Revises a slicer file for several nozzles in a single pass over the input. The file is read,
+    filtered and tokenized once, and every variant is written to its own file concurrently.
+    Args:
+        filename: The slicer file, relative to this script's directory or absolute.
+        variants: List of NozzleVariant or strings for parse_nozzle_variant(), e.g. ["C", "D:25.4,0,0"].
+        output_paths: One path per variant, defaults to "<name>_revised_<letter>.gcode".
+        simplify_tolerance, arc_tolerance, pressure_schedule: As for adjust_gcode_file().
+    Returns:
+        A dict with the revised file paths, line counts, elapsed seconds and throughput.
+    '''
+    variants = [parse_nozzle_variant(variant) if isinstance(variant, str) else variant for variant in variants]
+    file_path = resolve_gcode_path(filename)
+    if output_paths is None:
+        base_path = revised_path_for(file_path)
+        output_paths = [derived_path(base_path, f"_{variant.replacement_letter}") for variant in variants]
+    if len(set(output_paths)) != len(variants):
+        raise ValueError("Every nozzle variant needs its own output path")
+    for output_path in output_paths:
+        check_output_path(file_path, output_path)
+    if pressure_schedule == "":
+        pressure_schedule = PressureSchedule()
+    elif isinstance(pressure_schedule, str):
+        pressure_schedule = load_pressure_schedule(pressure_schedule)
+
+    stats = {"revised_file_paths": output_paths}
+    start_time = time.perf_counter()
+    writers = [LineWriterThread(output_path) for output_path in output_paths]
+    batches = [variant.header() for variant in variants]
+    try:
+        lines = prepare_gcode_lines(read_gcode_lines(file_path), stats, simplify_tolerance, arc_tolerance,
+                                    pressure_schedule)
+        for _ in rewrite_gcode_variants(lines, variants, batches):
+            for index, writer in enumerate(writers):
+                writer.write_batch(batches[index])
+                batches[index] = []
+        for writer, batch in zip(writers, batches):
+            batch.append("$iglobal[0] = 0\n")
+            writer.write_batch(batch)
+    finally:
+        for writer in writers:
+            writer.close()
+    stats["lines_out"] = [writer.line_count for writer in writers]
+    stats["seconds"] = time.perf_counter() - start_time
+    stats["lines_per_second"] = stats["lines_in"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+
+    for variant, output_path in zip(variants, output_paths):
+        print(f"Nozzle {variant.replacement_letter} (offset {variant.x_offset:g}, {variant.y_offset:g}, "
+              f"{variant.z_offset:g} mm) saved to: {output_path}")
+    print(f"Processed {stats['lines_in']} lines for {len(variants)} nozzles in {stats['seconds']:.2f} s "
+          f"({stats['lines_per_second']:.0f} lines/s)")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Revise slicer G-code for the Aerotech DIW gantry.")
+    parser.add_argument("filename", nargs="?", default="cole_nagata_test.gcode",
+                        help="slicer G-code file (relative to this script or absolute)")
+    parser.add_argument("replacement_letter", nargs="?", default="C", choices=REPLACEMENT_LETTERS,
+                        help="axis that replaces Z")
+    parser.add_argument("-o", "--output", help="revised file path (default: <name>_revised.gcode)")
+    parser.add_argument("--toolpath", nargs="?", const="", metavar="PATH",
+                        help="also write a binary toolpath (default path: <name>_revised.toolpath)")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="worker processes for layer-parallel revision (0 = one per core)")
+    parser.add_argument("--cache", nargs="?", const="", metavar="PATH",
+                        help=f"reuse unchanged layers from earlier runs (default path: {DEFAULT_CACHE_FILE})")
+    parser.add_argument("--simplify", nargs="?", type=float, const=0.0, metavar="TOLERANCE",
+                        help="merge collinear moves and simplify paths within TOLERANCE mm (default 0)")
+    parser.add_argument("--arcs", nargs="?", type=float, const=ARC_TOLERANCE, metavar="TOLERANCE",
+                        help=f"fit G2/G3 arcs to short moves within TOLERANCE mm (default {ARC_TOLERANCE})")
+    parser.add_argument("--pressure-events", nargs="?", const="", metavar="SCHEDULE",
+                        help="embed valve events and the pressures of a layer,channel,pressure CSV file")
+    parser.add_argument("--layer-index", nargs="?", const="", metavar="PATH",
+                        help="also write a layer index for resuming (default path: <name>_revised.layers.json)")
+    parser.add_argument("--reorder-travel", action="store_true",
+                        help="reorder the paths within each layer to shorten travel moves")
+    parser.add_argument("--variants", nargs="+", metavar="LETTER[:X,Y,Z]",
+                        help="revise for several nozzles in one pass, e.g. C D:25.4,0,-0.1 (offsets in mm)")
+    args = parser.parse_args()
+    if args.variants:
+        if args.output or args.toolpath is not None or args.workers != 1 or args.cache is not None \
+                or args.layer_index is not None or args.reorder_travel:
+            parser.error("--variants cannot be combined with -o, --toolpath, -j, --cache, --layer-index "
+                         "or --reorder-travel")
+        adjust_gcode_variants(args.filename, args.variants, None, args.simplify, args.arcs, args.pressure_events)
+        return
+    adjust_gcode_file(args.filename, args.replacement_letter, args.output, args.toolpath, args.workers,
+                      args.cache, args.simplify, args.arcs, args.pressure_events, args.layer_index,
+                      args.reorder_travel)
+
 
-# Example usage
-adjust_gcode_file('cole_nagata_test.gcode', 'C')
+if __name__ == "__main__":
+    main()